@@ -16,6 +16,8 @@ def create_artifact(filename: str, content: Union[bytes, str], name: str = None,
     task_id = task_id or context.current.task_id
     root_id = root_id or context.current.root_id
     stream = stream or context.current.stream
+    if not root_id:
+        return
 
     if name is None:
         name = filename
@@ -35,18 +37,25 @@ def create_artifact(filename: str, content: Union[bytes, str], name: str = None,
         raise ValueError(f'ArtifactType enum has no value {type!r}.'
                          f'Supported types: {", ".join(ArtifactType.__members__)}') from exc
 
+    event_data = {
+        'name': str(name),
+        'type': str(type),
+        'category': str(category),
+        'data': data if isinstance(data, dict) else {},
+        'stream': str(stream) if stream else None,
+        'filename': str(filename),
+    }
+
+    store = riberry.blob.store()
+    if content is not None and not store.inline:
+        event_data['blob'] = {'store': store.name, 'digest': store.put(content), 'size': len(content)}
+        content = None
+
     create_event(
         'artifact',
         root_id=root_id,
         task_id=task_id,
-        data={
-            'name': str(name),
-            'type': str(type),
-            'category': str(category),
-            'data': data if isinstance(data, dict) else {},
-            'stream': str(stream) if stream else None,
-            'filename': str(filename),
-        },
+        data=event_data,
         binary=content
     )
 
@@ -44,9 +44,7 @@ def queue_job_execution(execution: riberry.model.job.JobExecution, track_executi
                 category='Fatal',
                 filename='startup-error.log',
                 size=len(message),
-                binary=riberry.model.job.JobExecutionArtifactBinary(
-                    binary=message
-                )
+                binary=riberry.blob.store().create(message),
             )
         )
         riberry.model.conn.commit()
@@ -32,5 +32,5 @@ class BackgroundTasksStep(AddonStartStopStep):
         return True
 
     def run(self):
-        redis_instance = riberry.celery.util.celery_redis_instance()
+        redis_instance = riberry.celery.util.celery_redis_instance(subsystem='background')
         self.lock.run(redis_instance=redis_instance)
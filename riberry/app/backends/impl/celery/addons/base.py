@@ -53,6 +53,7 @@ class AddonStartStopStep(bootsteps.StartStopStep):
             log.exception(f'Encountered redis exception while executing {self.step_name}')
         finally:
             log.debug(f'Completed {self.step_name} in {time.time() - start_time:2} seconds')
+            riberry.celery.util.redis_manager.report()
 
     def should_run(self) -> bool:
         raise NotImplementedError
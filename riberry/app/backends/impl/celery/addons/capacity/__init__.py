@@ -1,22 +1,22 @@
 from sqlalchemy.util.compat import contextmanager
 
 from ..base import AddonStartStopStep
-from .priority_queue import PriorityQueue
+from .priority_queue import PriorityQueue, LeaseRenewer
 import riberry
 from celery.utils.log import logger as log
 
 
 class Capacity(riberry.app.addons.Addon):
 
-    def __init__(self, parameter='capacity', key=None, sep='|', queue_cls=PriorityQueue, blocking: bool = True, block_retry: int = 0.5, r=None):
+    def __init__(self, parameter='capacity', key=None, sep='|', queue_cls=PriorityQueue, blocking: bool = True, block_retry: int = 0.5, r=None, lease_ttl: int = 3600):
         self.parameter = parameter
-        self.r = r or riberry.celery.util.celery_redis_instance()
+        self.r = r or riberry.celery.util.celery_redis_instance(subsystem='capacity')
         self.sep = sep
-        self.queue = queue_cls(r=self.r, key=key, blocking=blocking, block_retry=block_retry)
+        self.queue = queue_cls(r=self.r, key=key, blocking=blocking, block_retry=block_retry, lease_ttl=lease_ttl)
 
     @property
     def last_value_key(self):
-        return self.queue.make_key(self.queue.key, 'raw')
+        return self.queue.make_key(self.queue.key_tag, 'raw')
 
     @property
     def last_value(self):
@@ -29,11 +29,14 @@ class Capacity(riberry.app.addons.Addon):
 
     @contextmanager
     def borrow(self):
-        member, score, version = self.queue.pop()
+        lease = self.queue.pop()
         try:
-            yield member, score, version
+            with LeaseRenewer(queue=self.queue, lease=lease, interval=self.queue.lease_ttl / 3):
+                yield lease.member, lease.score, lease.version
         finally:
-            self.queue.put(member=member, version=version)
+            if not self.queue.put(member=lease.member, version=lease.version, token=lease.token):
+                log.error(f'Capacity: lease of {lease.member!r} expired before it was returned, '
+                          f'its capacity may have been over-committed')
 
     def register(self, riberry_app: 'riberry.app.base.RiberryApplication'):
         class ConcreteCapacityStep(CapacityStep):
@@ -41,7 +44,7 @@ class Capacity(riberry.app.addons.Addon):
             capacity = self
 
         if self.queue.key is None:
-            self.queue.key = riberry_app.context.current.riberry_app_instance.internal_name
+            self.queue.key = riberry_app.context.current.riberry_app_instance_snapshot.internal_name
 
         riberry_app.backend.steps['worker'].add(ConcreteCapacityStep)
 
@@ -57,7 +60,7 @@ class CapacityStep(AddonStartStopStep):
         return True
 
     def on_lock_acquired(self):
-        value = self.rib.context.current.riberry_app_instance.active_schedule_value(name=self.capacity.parameter) or ''
+        value = self.rib.context.current.riberry_app_instance_snapshot.active_schedule_value(name=self.capacity.parameter) or ''
 
         if self.capacity.last_value is not None and value == self.capacity.last_value:
             log.warn(f'DynamicPriorityParameter: ({self.capacity.queue.free_key}) is unchanged')
@@ -71,8 +74,9 @@ class CapacityStep(AddonStartStopStep):
 
         member_scores = {k: int(v) for k, v in values}
         self.capacity.queue.update(member_scores)
+        self.capacity.queue.collect_garbage()
         log.warn(f'DynamicPriorityParameter: ({self.capacity.queue.free_key}) updated {self.capacity.parameter} queue with {value!r}')
 
     def run(self):
-        redis_instance = riberry.celery.util.celery_redis_instance()
+        redis_instance = riberry.celery.util.celery_redis_instance(subsystem='capacity')
         self.lock.run(redis_instance=redis_instance)
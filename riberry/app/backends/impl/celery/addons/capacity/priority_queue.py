@@ -1,24 +1,168 @@
+import math
+import threading
 import time
+import uuid
+from collections import namedtuple
+from typing import Optional
+
 import redis
-import functools
 from celery.utils.log import logger as log
 
+TOKEN_LENGTH = 32
+NOTIFY_LENGTH = 16
+
+Lease = namedtuple('Lease', ['member', 'score', 'version', 'token'])
+
+# KEYS: counter, free, lease, expiry (of the expected version), notify
+# ARGV: expected version, separator, now (ms), lease ttl (ms), token
+POP_SCRIPT = """
+local version = tonumber(redis.call('GET', KEYS[1]) or '0')
+if version ~= tonumber(ARGV[1]) then
+    return {version}
+end
+local free, lease, expiry = KEYS[2], KEYS[3], KEYS[4]
+local now = tonumber(ARGV[3])
+
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', expiry, '-inf', now)) do
+    local member = string.sub(id, TOKEN_LENGTH + #ARGV[2] + 1)
+    redis.call('ZREM', expiry, id)
+    redis.call('ZINCRBY', free, 1, member)
+    redis.call('ZINCRBY', lease, -1, member)
+end
+
+local top = redis.call('ZREVRANGE', free, 0, 0)
+if #top == 0 then
+    -- notifications pushed before the queue was found empty are stale, and would wake the caller needlessly
+    redis.call('DEL', KEYS[5])
+    return {}
+end
+
+local member = top[1]
+local score = redis.call('ZINCRBY', free, -1, member)
+redis.call('ZINCRBY', lease, 1, member)
+redis.call('ZADD', expiry, now + tonumber(ARGV[4]), ARGV[5] .. ARGV[2] .. member)
+return {member, score, version}
+""".replace('TOKEN_LENGTH', str(TOKEN_LENGTH))
+
+# KEYS: counter, notify, free, lease, expiry (of the lease's version)
+# ARGV: separator, lease ttl (ms), version, member, token (blank to release any of the member's leases)
+PUT_SCRIPT = """
+local version = tonumber(ARGV[3])
+local free, lease, expiry = KEYS[3], KEYS[4], KEYS[5]
+local member, token = ARGV[4], ARGV[5]
+
+local id
+if token ~= '' then
+    id = token .. ARGV[1] .. member
+else
+    for _, candidate in ipairs(redis.call('ZRANGE', expiry, 0, -1)) do
+        if string.sub(candidate, TOKEN_LENGTH + #ARGV[1] + 1) == member then
+            id = candidate
+            break
+        end
+    end
+end
+
+if not id or redis.call('ZREM', expiry, id) == 0 then
+    return 0
+end
+
+redis.call('ZINCRBY', free, 1, member)
+redis.call('ZINCRBY', lease, -1, member)
+redis.call('RPUSH', KEYS[2], 1)
+redis.call('LTRIM', KEYS[2], -NOTIFY_LENGTH, -1)
+
+if tonumber(redis.call('GET', KEYS[1]) or '0') ~= version then
+    if redis.call('ZCARD', expiry) == 0 then
+        redis.call('DEL', free, lease, expiry)
+    else
+        redis.call('PEXPIRE', free, ARGV[2])
+    end
+end
+return 1
+""".replace('TOKEN_LENGTH', str(TOKEN_LENGTH)).replace('NOTIFY_LENGTH', str(NOTIFY_LENGTH))
+
+# KEYS: counter, free, lease, expiry (of the lease's version)
+# ARGV: lease id, new expiry (ms), lease ttl (ms), version
+RENEW_SCRIPT = """
+local free, lease, expiry = KEYS[2], KEYS[3], KEYS[4]
+if not redis.call('ZSCORE', expiry, ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', expiry, ARGV[2], ARGV[1])
+
+-- the keys of superseded versions expire unless their leases are renewed
+if tonumber(redis.call('GET', KEYS[1]) or '0') ~= tonumber(ARGV[4]) then
+    redis.call('PEXPIRE', free, ARGV[3])
+    redis.call('PEXPIRE', lease, ARGV[3])
+    redis.call('PEXPIRE', expiry, ARGV[3])
+end
+return 1
+"""
+
+# KEYS: counter, notify, free (of the next version), free, lease, expiry (of the expected previous version)
+# ARGV: expected previous version, lease ttl (ms), member/score pairs...
+UPDATE_SCRIPT = """
+local previous = tonumber(redis.call('GET', KEYS[1]) or '0')
+if previous ~= tonumber(ARGV[1]) then
+    return -1
+end
+local version = previous + 1
+redis.call('SET', KEYS[1], version)
+
+for i = 3, #ARGV, 2 do
+    redis.call('ZADD', KEYS[3], ARGV[i + 1], ARGV[i])
+end
+
+if redis.call('ZCARD', KEYS[6]) == 0 then
+    redis.call('DEL', KEYS[4], KEYS[5], KEYS[6])
+else
+    redis.call('DEL', KEYS[4])
+    redis.call('PEXPIRE', KEYS[5], ARGV[2])
+    redis.call('PEXPIRE', KEYS[6], ARGV[2])
+end
+
+for _ = 1, NOTIFY_LENGTH do
+    redis.call('RPUSH', KEYS[2], 1)
+end
+redis.call('LTRIM', KEYS[2], -NOTIFY_LENGTH, -1)
+return version
+""".replace('NOTIFY_LENGTH', str(NOTIFY_LENGTH))
+
 
 class PriorityQueue:
+    """ Redis-backed pool of capacity, leasing one unit of the member with the highest score at a time.
+
+    Leases expire after `lease_ttl` seconds unless renewed, and are returned to the pool by the next
+    pop, so that capacity borrowed by a worker which died is not lost.
+
+    All of a queue's keys share the `{key}` hash tag, so that its scripts run within a single slot of
+    a Redis Cluster.
+    """
 
     def __init__(
-            self, r: redis.Redis, key: str, prefix: str='pq', sep: str=':', blocking: bool=True, block_retry: int=0.5):
+            self, r: redis.Redis, key: str, prefix: str='pq', sep: str=':', blocking: bool=True, block_retry: int=0.5,
+            lease_ttl: int=3600):
         self.r: redis.Redis = r
         self.key = key
         self.prefix = prefix
         self.sep = sep
         self.blocking = blocking
         self.block_retry = block_retry
+        self.lease_ttl = lease_ttl
+        self._pop_script = self.r.register_script(POP_SCRIPT)
+        self._put_script = self.r.register_script(PUT_SCRIPT)
+        self._renew_script = self.r.register_script(RENEW_SCRIPT)
+        self._update_script = self.r.register_script(UPDATE_SCRIPT)
 
     def make_key(self, *args):
         sub_key = self.sep.join(map(str, args))
         return f'{self.prefix}{self.sep}{sub_key}'
 
+    @property
+    def key_tag(self):
+        return f'{{{self.key}}}'
+
     @property
     def version(self):
         return int(self.r.get(self.version_key) or 0)
@@ -29,7 +173,11 @@ class PriorityQueue:
 
     @property
     def version_key(self):
-        return self.make_key(self.key, 'counter')
+        return self.make_key(self.key_tag, 'counter')
+
+    @property
+    def notify_key(self):
+        return self.make_key(self.key_tag, 'notify')
 
     @property
     def free_key(self):
@@ -39,64 +187,114 @@ class PriorityQueue:
     def lease_key(self):
         return self.generate_lease_key(version=self.version)
 
+    @property
+    def expiry_key(self):
+        return self.generate_expiry_key(version=self.version)
+
     def generate_free_key(self, version):
-        return self.make_key(self.key, f'{version:09}', 'free')
+        return self.make_key(self.key_tag, f'{version:09}', 'free')
 
     def generate_lease_key(self, version):
-        return self.make_key(self.key, f'{version:09}', 'lease')
+        return self.make_key(self.key_tag, f'{version:09}', 'lease')
+
+    def generate_expiry_key(self, version):
+        return self.make_key(self.key_tag, f'{version:09}', 'expiry')
 
-    def pop(self):
+    def _version_keys(self, version):
+        return [
+            self.generate_free_key(version=version),
+            self.generate_lease_key(version=version),
+            self.generate_expiry_key(version=version),
+        ]
+
+    @property
+    def _lease_ttl_ms(self):
+        return int(self.lease_ttl * 1000)
+
+    def pop(self) -> Lease:
+        """ Leases a unit of the member with the highest score.
+
+        Raises a ValueError if the queue is empty and not blocking, otherwise waits until members are added.
+        """
+
+        token = uuid.uuid4().hex
+        version = self.version
         while True:
-            version = self.version
-            result = self.r.transaction(
-                functools.partial(self.pop_transaction, version=version),
-                self.generate_free_key(version=version),
-                self.generate_lease_key(version=version),
-                value_from_callable=True
+            result = self._pop_script(
+                keys=[self.version_key, *self._version_keys(version), self.notify_key],
+                args=[version, self.sep, int(time.time() * 1000), self._lease_ttl_ms, token],
             )
-            if not result and self.blocking:
-                log.warn(f'PriorityQueue: ({self.free_key}) encountered blank key, '
-                         f'retrying after {self.block_retry} seconds.')
-                time.sleep(self.block_retry)
+            if len(result) == 1:
+                # the queue was updated since its version was read
+                version = int(result[0])
                 continue
-            else:
+            if result:
                 break
+            if not self.blocking:
+                raise ValueError(f'PriorityQueue: ({self.generate_free_key(version)}) is empty')
 
-        return result, self.r.zscore(self.generate_free_key(version=version), result), version
+            log.warn(f'PriorityQueue: ({self.generate_free_key(version)}) encountered blank key, '
+                     f'waiting up to {self.block_retry} seconds.')
+            self.r.blpop(self.notify_key, timeout=max(1, math.ceil(self.block_retry)))
+            version = self.version
 
-    def pop_transaction(self, pipe: redis.client.Pipeline, version):
-        free_key, lease_key = self.generate_free_key(version=version), self.generate_lease_key(version=version)
-        [(member, score)] = pipe.zrevrange(free_key, 0, 0, withscores=True)
-        member = member.decode()
+        member, score, version = result
+        return Lease(member=member.decode(), score=float(score), version=int(version), token=token)
 
-        pipe.multi()
-        pipe.zincrby(free_key, value=member, amount=-1)
-        pipe.zincrby(lease_key, value=member, amount=1)
-        return member
+    def put(self, member, version, token: Optional[str] = None) -> bool:
+        """ Returns a leased unit of the member, returning False if the lease had already expired. """
 
-    def put(self, member, version):
-        self.r.transaction(
-            functools.partial(self.put_transaction, member=member, version=version),
-            self.generate_free_key(version=version),
-            self.generate_lease_key(version=version),
-        )
+        return bool(self._put_script(
+            keys=[self.version_key, self.notify_key, *self._version_keys(version)],
+            args=[self.sep, self._lease_ttl_ms, version, member, token or ''],
+        ))
 
-    def put_transaction(self, pipe: redis.client.Pipeline, member, version):
-        free_key, lease_key = self.generate_free_key(version=version), self.generate_lease_key(version=version)
+    def renew(self, lease: Lease) -> bool:
+        """ Extends the lease by `lease_ttl` seconds, returning False if it had already expired. """
 
-        pipe.multi()
-        pipe.zincrby(free_key, value=member, amount=1)
-        pipe.zincrby(lease_key, value=member, amount=-1)
+        return bool(self._renew_script(
+            keys=[self.version_key, *self._version_keys(lease.version)],
+            args=[f'{lease.token}{self.sep}{lease.member}', int(time.time() * 1000) + self._lease_ttl_ms,
+                  self._lease_ttl_ms, lease.version],
+        ))
 
     def update(self, member_scores: dict):
-        func = functools.partial(self.update_transaction, member_scores=member_scores)
-        self.version = self.r.transaction(func, value_from_callable=True)
+        """ Replaces the members and their scores with a new version of the queue. """
+
+        pairs = []
+        for member, score in member_scores.items():
+            pairs += [member, score]
+
+        while True:
+            previous = self.version
+            version = self._update_script(
+                keys=[self.version_key, self.notify_key, self.generate_free_key(previous + 1),
+                      *self._version_keys(previous)],
+                args=[previous, self._lease_ttl_ms, *pairs],
+            )
+            if version != -1:
+                return
+
+    def _collect_versions(self, key, version):
+        prefix = self.make_key(key, '')
+        for found in self.r.scan_iter(match=self.make_key(key, '[0-9]*')):
+            found = found.decode()
+            key_version = found[len(prefix):].split(self.sep, 1)[0]
+            if not key_version.isdigit() or int(key_version) >= version:
+                continue
+            if not self.r.zcard(self.make_key(key, key_version, 'expiry')):
+                self.r.delete(found)
 
-    def update_transaction(self, pipe: redis.client.Pipeline, member_scores):
-        version = self.version + 1
-        pipe.multi()
-        pipe.zadd(self.generate_free_key(version=version), mapping=member_scores)
-        return version
+    def collect_garbage(self):
+        """ Deletes the keys of superseded versions which have no leases outstanding.
+
+        The previous version is cleaned up by `update`, this sweeps any older versions left behind,
+        including those stored before the keys were hash tagged (except the version which workers
+        that haven't been upgraded may still be using).
+        """
+
+        self._collect_versions(self.key_tag, self.version)
+        self._collect_versions(self.key, int(self.r.get(self.make_key(self.key, 'counter')) or 0))
 
     def items(self):
         return [(k.decode(), v) for k, v in self.r.zrevrange(self.free_key, 0, -1, withscores=True)]
@@ -105,7 +303,7 @@ class PriorityQueue:
         return [(k.decode(), v) for k, v in self.r.zrevrange(self.lease_key, 0, -1, withscores=True)]
 
     def clear(self):
-        self.r.delete(self.free_key, self.lease_key)
+        self.r.delete(self.free_key, self.lease_key, self.expiry_key)
 
     def __iter__(self):
         return self
@@ -115,3 +313,31 @@ class PriorityQueue:
             return self.pop()
         except ValueError:
             raise StopIteration
+
+
+class LeaseRenewer:
+    """ Renews a lease every `interval` seconds from a background thread while it is held. """
+
+    def __init__(self, queue: PriorityQueue, lease: Lease, interval: float):
+        self.queue = queue
+        self.lease = lease
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(name=f'lease-renewer:{lease.member}', target=self._run, daemon=True)
+
+    def __enter__(self) -> 'LeaseRenewer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                if not self.queue.renew(self.lease):
+                    log.error(f'PriorityQueue: lease of {self.lease.member!r} expired before it could be renewed')
+                    return
+            except redis.RedisError:
+                log.exception(f'PriorityQueue: failed to renew lease of {self.lease.member!r}')
@@ -46,7 +46,7 @@ class ExternalTaskReceiverStep(AddonStartStopStep):
         active = riberry.model.job.JobExecution.query().filter_by(
             status='ACTIVE'
         ).join(riberry.model.job.Job).filter_by(
-            instance=self.rib.context.current.riberry_app_instance,
+            instance=self.rib.context.current.riberry_app_instance_snapshot,
         ).join(riberry.model.job.JobExecutionExternalTask).filter_by(
             status='READY'
         ).count()
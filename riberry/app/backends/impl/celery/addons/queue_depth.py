@@ -0,0 +1,89 @@
+import json
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+import redis
+
+# kombu's Redis transport stores each priority level of a queue in its own list, named
+# `<queue><sep><priority>` (the lowest level uses the queue name itself)
+PRIORITY_SEP = '\x06\x16'
+PRIORITY_STEPS = (0, 3, 6, 9)
+
+
+class QueueDepthSampler:
+    """ Samples the number of messages waiting in the broker's queues.
+
+    Each queue's broker keys are resolved once, all keys are measured in a single pipelined round
+    trip, and the result is cached in Redis for `ttl` seconds so that other workers sampling the same
+    queues under the same `cache_key` can reuse it.
+    """
+
+    def __init__(
+            self,
+            cache_key: Optional[str] = None,
+            ttl: float = 1.0,
+            sep: str = PRIORITY_SEP,
+            steps: Iterable[int] = PRIORITY_STEPS,
+            prefix: str = '',
+    ):
+        self.cache_key = cache_key
+        self.ttl = ttl
+        self.sep = sep
+        self.steps = tuple(steps)
+        self.prefix = prefix
+        self._keys: Dict[str, List[str]] = {}
+
+    @classmethod
+    def from_transport_options(cls, transport_options: Optional[dict], **kwargs) -> 'QueueDepthSampler':
+        transport_options = transport_options or {}
+        return cls(
+            sep=transport_options.get('sep', PRIORITY_SEP),
+            steps=transport_options.get('priority_steps', PRIORITY_STEPS),
+            prefix=transport_options.get('global_keyprefix', ''),
+            **kwargs
+        )
+
+    def keys(self, queue_name: str) -> List[str]:
+        """ Returns the broker keys holding the messages of the given queue. """
+
+        if queue_name not in self._keys:
+            self._keys[queue_name] = [
+                f'{self.prefix}{queue_name}{self.sep}{step}' if step else f'{self.prefix}{queue_name}'
+                for step in sorted(set(self.steps) | {0})
+            ]
+        return self._keys[queue_name]
+
+    def _cache_key(self, queue_names: List[str]) -> str:
+        return f'{self.cache_key}:{zlib.crc32(" ".join(queue_names).encode()):08x}'
+
+    def sample(self, r: redis.Redis, queue_names: Iterable[str]) -> Dict[str, int]:
+        """ Measures the depth of each queue, bypassing the cache. """
+
+        queue_names = sorted(queue_names)
+        pipe = r.pipeline(transaction=False)
+        for queue_name in queue_names:
+            for key in self.keys(queue_name):
+                pipe.llen(key)
+        lengths = iter(length if isinstance(length, int) else 0 for length in pipe.execute(raise_on_error=False))
+        return {queue_name: sum(next(lengths) for _ in self.keys(queue_name)) for queue_name in queue_names}
+
+    def depths(self, r: redis.Redis, queue_names: Iterable[str]) -> Dict[str, int]:
+        """ Returns the depth of each queue, from the shared cache if sampled within the last `ttl` seconds. """
+
+        queue_names = sorted(queue_names)
+        if not queue_names:
+            return {}
+        if not self.cache_key:
+            return self.sample(r, queue_names)
+
+        cache_key = self._cache_key(queue_names)
+        cached = r.get(cache_key)
+        if cached is not None:
+            return json.loads(cached)
+
+        depths = self.sample(r, queue_names)
+        r.set(cache_key, json.dumps(depths), px=max(int(self.ttl * 1000), 1))
+        return depths
+
+    def empty(self, r: redis.Redis, queue_names: Iterable[str]) -> bool:
+        return not any(self.depths(r, queue_names).values())
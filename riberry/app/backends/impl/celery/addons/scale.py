@@ -2,6 +2,8 @@ import math
 
 import riberry
 from .base import AddonStartStopStep
+from .queue_depth import QueueDepthSampler
+from .scale_policy import policies
 from celery.utils.log import logger as log
 
 
@@ -14,6 +16,8 @@ class Scale(riberry.app.addons.Addon):
             minimum_concurrency=None,
             maximum_concurrency=None,
             check_queues=None,
+            queue_depth_ttl=1.0,
+            policy='schedule',
     ):
         self.conf = ScaleConfiguration(
             active_parameter=active_parameter,
@@ -21,6 +25,8 @@ class Scale(riberry.app.addons.Addon):
             minimum_concurrency=minimum_concurrency,
             maximum_concurrency=maximum_concurrency,
             check_queues=check_queues,
+            queue_depth_ttl=queue_depth_ttl,
+            policy=policy,
         )
         self.active_parameter = active_parameter
         self.concurrency_parameter = concurrency_parameter
@@ -57,6 +63,11 @@ class Scale(riberry.app.addons.Addon):
             '--rib-scale-min', default=None,
             help='Minimum concurrency when auto-scaling (zero by default)',
         )
+        parser.add_argument(
+            '--rib-scale-policy', default=None, choices=sorted(policies),
+            help='Scale to the scheduled concurrency ("schedule", default) or to the concurrency predicted '
+                 'from queue depth and step durations, up to the scheduled concurrency ("predictive")',
+        )
 
         feature_parser = parser.add_mutually_exclusive_group(required=False)
         feature_parser.add_argument(
@@ -81,6 +92,8 @@ class ScaleConfiguration:
             minimum_concurrency=None,
             maximum_concurrency=None,
             check_queues=None,
+            queue_depth_ttl=1.0,
+            policy='schedule',
     ):
         self.active_parameter = active_parameter
         self.concurrency_parameter = concurrency_parameter
@@ -89,6 +102,8 @@ class ScaleConfiguration:
         self.minimum_concurrency = minimum_concurrency
         self.maximum_concurrency = maximum_concurrency
         self.check_queues = check_queues
+        self.queue_depth_ttl = queue_depth_ttl
+        self.policy = policy
         self.ignore_queues = set()
 
 
@@ -96,7 +111,7 @@ class ScaleStep(AddonStartStopStep):
 
     conf: ScaleConfiguration
 
-    def __init__(self, worker, rib_scale, rib_scale_group, rib_scale_parameter, rib_scale_min, rib_scale_max, rib_scale_check_queues, **_):
+    def __init__(self, worker, rib_scale, rib_scale_group, rib_scale_parameter, rib_scale_min, rib_scale_max, rib_scale_check_queues, rib_scale_policy=None, **_):
         super().__init__(worker=worker, interval=1.0)
 
         self.conf.scale = bool(rib_scale)
@@ -105,6 +120,7 @@ class ScaleStep(AddonStartStopStep):
         self.conf.minimum_concurrency = int(rib_scale_min) if rib_scale_min is not None else self.conf.minimum_concurrency
         self.conf.maximum_concurrency = int(rib_scale_max) if rib_scale_max is not None else self.conf.maximum_concurrency
         self.conf.check_queues = bool(rib_scale_check_queues) if rib_scale_check_queues is not None else self.conf.check_queues
+        self.conf.policy = rib_scale_policy or self.conf.policy
 
         self.lock = riberry.app.util.redis_lock.RedisLock(name=f'step:scale:{self.conf.scale_group}', on_acquired=self.on_lock_acquired, interval=5000)
 
@@ -113,14 +129,21 @@ class ScaleStep(AddonStartStopStep):
         self.initial_concurrency = None
         self.is_active = False
         self._worker_uuid = self.rib.context.current.WORKER_UUID
-        self._instance_name = self.rib.context.current.riberry_app_instance.internal_name
+        self._instance_name = self.rib.context.current.riberry_app_instance_snapshot.internal_name
         self.idle_counter = 0
+        self.scale_group = []
+        self.queue_depth = QueueDepthSampler.from_transport_options(
+            worker.app.conf.broker_transport_options,
+            cache_key=f'{self.scale_groups_key}:queue-depth',
+            ttl=self.conf.queue_depth_ttl,
+        )
+        self.policy = policies[self.conf.policy]()
 
     def should_run(self) -> bool:
         return True
 
     def run(self):
-        redis_instance = riberry.celery.util.celery_redis_instance()
+        redis_instance = riberry.celery.util.celery_redis_instance(subsystem='scale')
         self.lock.run(redis_instance=redis_instance)
         if not self.consumer.task_consumer:
             return
@@ -129,7 +152,7 @@ class ScaleStep(AddonStartStopStep):
         self.scale()
 
     def on_lock_acquired(self):
-        r = riberry.celery.util.celery_redis_instance()
+        r = riberry.celery.util.celery_redis_instance(subsystem='scale')
         epoch, _ = r.time()
         occurrence = set(r.zrevrangebyscore(name=self.scale_groups_log_key, max=epoch, min=epoch - 60))
         if occurrence:
@@ -137,50 +160,46 @@ class ScaleStep(AddonStartStopStep):
             r.sadd(self.scale_groups_active_temp_key, *occurrence)
             r.rename(src=self.scale_groups_active_temp_key, dst=self.scale_groups_active_key)
 
-    @classmethod
-    def _tasks_available(cls, r, state, queues):
+    def _tasks_available(self, r, state, queues):
         return bool(
             len(state.reserved_requests) or
             len(state.active_requests) or
             state.requests or
-            not cls._queues_empty(r, queues=queues)
+            not self._queues_empty(r, queues=queues)
         )
 
-    @staticmethod
-    def _queues_empty(r, queues):
-        for queue_name in queues:
-            for queue in r.scan_iter(f'{queue_name}*'):
-                try:
-                    queue_length = r.llen(queue)
-                    log.debug(f'ScaleStep:: Queue length of {queue.decode()!r} is {queue_length}')
-                    if queue_length:
-                        return False
-                except:
-                    continue
-        return True
+    def _queues_empty(self, r, queues):
+        depths = self.queue_depth.depths(r, queues)
+        for queue_name, queue_length in depths.items():
+            log.debug(f'ScaleStep:: Queue length of {queue_name!r} is {queue_length}')
+        return not any(depths.values())
 
     def report(self, r):
         epoch, _ = r.time()
         r.zadd(name=self.scale_groups_log_key, mapping={self._worker_uuid: epoch})
 
+    @property
+    def scale_groups_key(self):
+        return f'{self._instance_name}:scale-groups:{self.conf.scale_group}'
+
     @property
     def scale_groups_active_key(self):
-        return f'{self._instance_name}:scale-groups:{self.conf.scale_group}:active'
+        return f'{self.scale_groups_key}:active'
 
     @property
     def scale_groups_log_key(self):
-        return f'{self._instance_name}:scale-groups:{self.conf.scale_group}:log'
+        return f'{self.scale_groups_key}:log'
 
     @property
     def scale_groups_active_temp_key(self):
-        return f'{self._instance_name}:scale-groups:{self.conf.scale_group}:active-temp'
+        return f'{self.scale_groups_key}:active-temp'
 
     def update(self, redis_instance):
         self.queues.update({q.name for q in self.worker.consumer.task_consumer.queues})
         if not self.initial_concurrency:
             self.initial_concurrency = self.worker.consumer.pool.num_processes
 
-        instance = self.rib.context.current.riberry_app_instance
+        instance = self.rib.context.current.riberry_app_instance_snapshot
         active_flag = instance.active_schedule_value(name=self.conf.active_parameter, default='Y') == 'Y'
         tasks_available = self._tasks_available(r=redis_instance, state=self.worker_state, queues=self.queues - self.conf.ignore_queues)
         if tasks_available:
@@ -195,12 +214,21 @@ class ScaleStep(AddonStartStopStep):
         self.idle_counter = 0
 
         scale_group = list(sorted(b.decode() for b in redis_instance.smembers(self.scale_groups_active_key)))
+        self.scale_group = scale_group
         if self.conf.scale and self.conf.concurrency_parameter:
             target_concurrency = instance.active_schedule_value(name=self.conf.concurrency_parameter, default=None)
             if target_concurrency is None:
                 target_concurrency = self.initial_concurrency
             else:
                 target_concurrency = int(target_concurrency)
+            queue_depth = 0
+            if self.policy.uses_queue_depth:
+                queue_depth = sum(self.queue_depth.depths(redis_instance, self.queues - self.conf.ignore_queues).values())
+            target_concurrency = self.policy.group_concurrency(
+                instance=instance,
+                limit=target_concurrency,
+                queue_depth=queue_depth,
+            )
             target_concurrency *= (1 / len(scale_group)) if self._worker_uuid in scale_group else 0
 
             if target_concurrency:
@@ -225,8 +253,7 @@ class ScaleStep(AddonStartStopStep):
         actual_concurrency = self.worker.consumer.pool.num_processes
         target_concurrency = self.target_concurrency
 
-        scale_group = list(sorted(b.decode() for b in riberry.celery.util.celery_redis_instance().smembers(self.scale_groups_active_key)))
-        log.debug(f'A: {self.is_active} C[T]: {self.target_concurrency}, C[A]: {actual_concurrency}, P: {self.worker.consumer.qos.value},  M: {scale_group}')
+        log.debug(f'A: {self.is_active} C[T]: {self.target_concurrency}, C[A]: {actual_concurrency}, P: {self.worker.consumer.qos.value},  M: {self.scale_group}')
 
         if target_concurrency == 0:
             for queue in list(self.consumer.task_consumer.queues):
@@ -242,12 +269,12 @@ class ScaleStep(AddonStartStopStep):
             if actual_concurrency == 0:
                 self.worker.consumer.pool.grow(1)
             else:
-                self.worker.consumer.pool.grow(min(target_concurrency - actual_concurrency, 8))
+                self.worker.consumer.pool.grow(min(target_concurrency - actual_concurrency, self.policy.max_step))
             log.info(f'ScaleStep:: Scaled concurrency up to {self.worker.consumer.pool.num_processes} concurrency (target: {self.target_concurrency}, prefetch: {self.worker.consumer.qos.value})')
         elif actual_concurrency > target_concurrency:
             self.worker.consumer.qos.decrement_eventually(n=1)
             self.worker.consumer.qos.update()
-            self.worker.consumer.pool.shrink(min(actual_concurrency - target_concurrency, 8))
+            self.worker.consumer.pool.shrink(min(actual_concurrency - target_concurrency, self.policy.max_step))
             log.info(f'ScaleStep:: Scaled concurrency down to {self.worker.consumer.pool.num_processes} concurrency (target: {self.target_concurrency}, prefetch: {self.worker.consumer.qos.value})')
 
         prefetch_target = self.worker.consumer.pool.num_processes * self.worker.consumer.prefetch_multiplier
@@ -0,0 +1,138 @@
+import math
+import time
+from typing import Optional, Tuple
+
+from sqlalchemy import func
+
+import riberry
+
+
+class ScalePolicy:
+    """ Determines the concurrency of a scale group, bounded by its scheduled concurrency.
+
+    The queue depth is only sampled for policies which set `uses_queue_depth` (0 is passed otherwise).
+    """
+
+    name = None
+    max_step = 8
+    uses_queue_depth = False
+
+    def group_concurrency(self, instance, limit: int, queue_depth: int, now: Optional[float] = None) -> int:
+        raise NotImplementedError
+
+
+class ScheduleScalePolicy(ScalePolicy):
+    """ Runs the scale group at its scheduled concurrency while active. """
+
+    name = 'schedule'
+
+    def group_concurrency(self, instance, limit: int, queue_depth: int, now: Optional[float] = None) -> int:
+        return limit
+
+
+def step_statistics(instance_id, window: float, now: Optional[float] = None) -> Tuple[float, Optional[float]]:
+    """ Returns the rate of completed steps per second and their mean duration for the given
+    instance's forms over the last `window` seconds, from the recorded execution metrics. """
+
+    now = now or time.time()
+    metric, form = riberry.model.job.JobExecutionMetric, riberry.model.interface.Form
+    count, sum_duration = riberry.model.conn.query(
+        func.sum(metric.count), func.sum(metric.sum_duration)
+    ).join(
+        form, form.id == metric.form_id
+    ).filter(
+        form.instance_id == instance_id,
+        metric.epoch_end > now - window,
+    ).one()
+
+    if not count:
+        return 0.0, None
+    return count / window, sum_duration / count
+
+
+class PredictiveScalePolicy(ScalePolicy):
+    """ Estimates the concurrency needed to keep up with arriving tasks and drain the queued backlog.
+
+    By Little's law, `arrival_rate * mean_duration` processes are needed to keep up, plus
+    `queue_depth * mean_duration / drain_time` to work through the backlog within `drain_time`
+    seconds. The arrival rate is the completion rate recorded in the execution metrics plus the
+    smoothed growth of the queue. Scaling down requires the estimate to fall by more than
+    `hysteresis` and is subject to a longer cooldown than scaling up.
+    """
+
+    name = 'predictive'
+    max_step = 32
+    uses_queue_depth = True
+
+    def __init__(
+            self,
+            window: float = 900.0,
+            refresh_interval: float = 60.0,
+            drain_time: float = 60.0,
+            hysteresis: float = 0.2,
+            up_cooldown: float = 5.0,
+            down_cooldown: float = 60.0,
+            smoothing: float = 0.3,
+    ):
+        self.window = window
+        self.refresh_interval = refresh_interval
+        self.drain_time = drain_time
+        self.hysteresis = hysteresis
+        self.up_cooldown = up_cooldown
+        self.down_cooldown = down_cooldown
+        self.smoothing = smoothing
+
+        self.completion_rate = 0.0
+        self.mean_duration: Optional[float] = None
+        self.queue_growth = 0.0
+        self.current: Optional[int] = None
+        self._refreshed = None
+        self._changed = None
+        self._queue_sample: Optional[Tuple[float, int]] = None
+
+    def refresh(self, instance, now: float):
+        if self._refreshed is None or now - self._refreshed >= self.refresh_interval:
+            self.completion_rate, self.mean_duration = step_statistics(instance.id, window=self.window, now=now)
+            self._refreshed = now
+
+    def observe(self, queue_depth: int, now: float):
+        if self._queue_sample is not None:
+            previous_time, previous_depth = self._queue_sample
+            if now > previous_time:
+                growth = (queue_depth - previous_depth) / (now - previous_time)
+                self.queue_growth += self.smoothing * (growth - self.queue_growth)
+        self._queue_sample = now, queue_depth
+
+    def predict(self, queue_depth: int) -> Optional[int]:
+        if not self.mean_duration:
+            return None
+        arrival_rate = self.completion_rate + max(self.queue_growth, 0.0)
+        required = arrival_rate * self.mean_duration + queue_depth * self.mean_duration / self.drain_time
+        return max(math.ceil(required), 1)
+
+    def group_concurrency(self, instance, limit: int, queue_depth: int, now: Optional[float] = None) -> int:
+        now = now or time.time()
+        self.refresh(instance, now=now)
+        self.observe(queue_depth, now=now)
+
+        predicted = self.predict(queue_depth)
+        target = limit if predicted is None else min(predicted, limit)
+
+        since_change = now - self._changed if self._changed is not None else math.inf
+        if self.current is None:
+            scale = True
+        elif target > self.current:
+            scale = since_change >= self.up_cooldown
+        else:
+            scale = target < self.current * (1 - self.hysteresis) and since_change >= self.down_cooldown
+
+        if scale and target != self.current:
+            self.current = target
+            self._changed = now
+        return min(self.current, limit)
+
+
+policies = {
+    ScheduleScalePolicy.name: ScheduleScalePolicy,
+    PredictiveScalePolicy.name: PredictiveScalePolicy,
+}
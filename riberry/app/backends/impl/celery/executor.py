@@ -155,6 +155,9 @@ class TaskExecutor:
                             state=state,
                         )
 
+                    # fails the task if its buffered events can't be committed
+                    riberry.app.util.events.event_buffer.task_complete()
+
     def _max_retries_reached(self, exc):
         active_task = self.riberry_app.context.current.task
         return bool(
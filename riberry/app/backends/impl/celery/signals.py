@@ -48,6 +48,26 @@ def worker_ready(sender, **_):
     riberry.model.conn.dispose_engine()
 
 
+@signals.task_postrun.connect
+def task_postrun(**_):
+    """ Commit events buffered after the task's own flush, e.g. those of its completion. """
+
+    if not riberry.app.util.events.event_buffer.enabled:
+        return
+
+    with riberry.model.conn:
+        riberry.app.util.events.event_buffer.task_complete()
+
+
+@signals.worker_process_shutdown.connect
+@signals.worker_shutdown.connect
+def worker_shutdown(**_):
+    """ Flush any events still held in Riberry's event buffer. """
+
+    with riberry.model.conn:
+        riberry.app.util.events.event_buffer.flush()
+
+
 @signals.before_task_publish.connect
 def before_task_publish(sender, headers, body, **_):
     """ Inform Riberry of newly created tasks. """
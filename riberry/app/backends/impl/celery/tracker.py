@@ -16,13 +16,16 @@ class CeleryExecutionTracker(riberry.app.backends.tracker.RiberryExecutionTracke
             executions: List[riberry.model.job.JobExecution],
             app_instance: riberry.model.application.ApplicationInstance
     ):
-        redis = riberry.celery.util.celery_redis_instance()
-        for execution in executions:
-            if not redis.sismember(_tracker_key(app_instance.internal_name), execution.task_id):
+        key = _tracker_key(app_instance.internal_name)
+        tracked = riberry.celery.util.redis_manager.read_many(
+            [('sismember', key, execution.task_id) for execution in executions], subsystem='tracker'
+        )
+        for execution, is_tracked in zip(executions, tracked):
+            if is_tracked is False:
                 self._cancel_execution(execution=execution)
 
     def track_execution(self, root_id: str, app_instance: riberry.model.application.ApplicationInstance):
-        redis = riberry.celery.util.celery_redis_instance()
+        redis = riberry.celery.util.celery_redis_instance(subsystem='tracker')
         instance = riberry.app.env.get_instance_name()
         key = _tracker_key(instance)
         log.debug(f'Tracking execution: root={root_id!r}, key={key!r}')
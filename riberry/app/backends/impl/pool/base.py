@@ -6,6 +6,7 @@ from typing import AnyStr, Dict, Optional
 import riberry
 from riberry.app import RiberryApplication, current_context as cxt
 from . import tasks
+from .tasks.executor import TaskExecutor
 from .task_queue import TaskQueue, Task, TaskDefinition
 from .tracker import PoolExecutionTracker
 
@@ -31,6 +32,7 @@ class RiberryPoolBackend(riberry.app.backends.RiberryApplicationBackend):
     def __init__(self):
         super().__init__(instance=None)
         self.task_queue: TaskQueue = TaskQueue(backend=self, limit=3)
+        self.executor: TaskExecutor = TaskExecutor(task_queue=self.task_queue)
         self.tasks = {}
         self._exit = threading.Event()
         self._threads = []
@@ -48,6 +50,12 @@ class RiberryPoolBackend(riberry.app.backends.RiberryApplicationBackend):
             if hasattr(signal, sig):
                 signal.signal(getattr(signal, sig), self._stop_signal)
 
+        # one connection for each task executed in this process plus one for each of the backend's threads
+        self.executor.max_workers = self.task_queue.limit
+        if self.task_queue.limit:
+            riberry.model.size_pool(pool_size=self.executor.connections + len(self._threads))
+        self.executor.start()
+
         for thread in self._threads:
             thread.start()
 
@@ -55,6 +63,13 @@ class RiberryPoolBackend(riberry.app.backends.RiberryApplicationBackend):
         for thread in self._threads:
             thread.join()
 
+        log.info('Draining %s queued task(s) of application %s', self.task_queue.counter.value,
+                 riberry.app.current_riberry_app.name)
+        self.executor.drain()
+
+        with riberry.model.conn:
+            riberry.app.util.events.event_buffer.flush()
+
     # noinspection PyUnusedLocal
     def _stop_signal(self, signum, frame):
         self.stop()
@@ -66,7 +81,7 @@ class RiberryPoolBackend(riberry.app.backends.RiberryApplicationBackend):
     def initialize(self):
         self._create_thread('backend.executor', lambda: tasks.run_task(
             name='Task Executor',
-            func=lambda: tasks.execution_listener(self.task_queue),
+            func=lambda: tasks.execution_listener(self.task_queue, self.executor),
             interval=0,
             exit_event=self._exit,
         ))
@@ -18,10 +18,12 @@ class TaskDefinition:
 
 class Task:
 
-    def __init__(self, task_id: str, execution_id: int, definition: TaskDefinition):
+    def __init__(self, task_id: str, execution_id: int, definition: TaskDefinition, root_id: str = None, origin=None):
         self.id = task_id
         self.execution_id = execution_id
         self.definition = definition
+        self.root_id = root_id
+        self.origin = origin
 
 
 class TaskCounter:
@@ -106,6 +108,8 @@ def make_receiver_task(backend, external_task: riberry.model.job.JobExecutionExt
             step=definition.step,
             options=definition.options,
         ),
+        root_id=external_task.job_execution.task_id,
+        origin=('receiver', external_task.id),
     )
 
 
@@ -119,5 +123,7 @@ def make_entry_task(execution_id: int, root_id: str, entry_point: riberry.app.ba
             stream=entry_point.stream,
             step=entry_point.step,
             options={},
-        )
+        ),
+        root_id=root_id,
+        origin=('entry', entry_point.form),
     )
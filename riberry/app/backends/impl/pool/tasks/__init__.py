@@ -2,11 +2,17 @@ from threading import Event
 
 import riberry
 from .background import background
-from .executor import execution_listener
+from .executor import execution_listener, TaskExecutor
 from .external_task_receiver import queue_receiver_tasks
+from .process import ProcessTaskExecutor
 
 log = riberry.log.make(__name__)
 
+executors = {
+    'thread': TaskExecutor,
+    'process': ProcessTaskExecutor,
+}
+
 
 def run_task(name, func, interval, exit_event: Event):
     log.debug('Started task %s', name)
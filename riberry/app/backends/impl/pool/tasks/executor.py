@@ -1,6 +1,7 @@
-import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from queue import Empty
+from typing import Optional
 
 import time
 
@@ -11,48 +12,91 @@ from ..task_queue import TaskQueue, Task
 log = riberry.log.make(__name__)
 
 
-def execution_listener(task_queue: TaskQueue):
+class TaskExecutor:
+    """ Runs the tasks dequeued from a `TaskQueue` on a bounded pool of reusable threads. """
+
+    def __init__(self, task_queue: TaskQueue, max_workers: Optional[int] = None):
+        self.task_queue = task_queue
+        self.max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='backend.task')
+        return self._pool
+
+    @property
+    def connections(self) -> int:
+        """ Number of database connections used by the executor's tasks in the current process. """
+        return self.max_workers or 0
+
+    def start(self):
+        return self.pool
+
+    def submit(self, task: Task):
+        self.pool.submit(execute, task, self.task_queue)
+
+    def drain(self):
+        """ Submits the tasks remaining in the queue and waits for all submitted tasks to complete. """
+
+        while True:
+            try:
+                task: Task = self.task_queue.queue.get_nowait()
+            except Empty:
+                break
+            self.submit(task)
+
+        if self._pool is not None:
+            self._shutdown()
+            self._pool = None
+
+    def _shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+def execution_listener(task_queue: TaskQueue, executor: TaskExecutor):
     try:
         task: Task = task_queue.queue.get(timeout=2.0)
     except Empty:
         return
 
-    execution_thread = threading.Thread(
-        name=f'{task.execution_id}:{task.id}:{task.definition.name}',
-        target=execute,
-        args=(task, task_queue)
-    )
-    execution_thread.start()
+    executor.submit(task)
 
 
 def execute(task: Task, task_queue: TaskQueue):
     try:
+        with riberry.model.conn:
+            execute_in_session(task=task)
+    except:
+        log.exception('Error occurred while executing task %s', task.definition.name)
+    finally:
+        task_queue.counter.decrement()
 
-        job_execution: riberry.model.job.JobExecution = riberry.model.conn.query(
-            riberry.model.job.JobExecution
-        ).filter_by(
-            id=task.execution_id,
-        ).one()
-
-        if job_execution.task_id == task.id:
-            task_scope = execute_entry_task(job_execution=job_execution, task=task)
-        else:
-            task_scope = execute_receiver_task(job_execution=job_execution, task=task)
-
-        context_scope = riberry.app.current_context.scope(
-            root_id=job_execution.task_id,
-            task_id=task.id,
-            task_name=task.definition.name,
-            stream=task.definition.stream,
-            category=None,
-            step=task.definition.step,
-        )
 
-        with context_scope, task_scope:
-            execute_task(job_execution=job_execution, task=task)
+def execute_in_session(task: Task):
+    job_execution: riberry.model.job.JobExecution = riberry.model.conn.query(
+        riberry.model.job.JobExecution
+    ).filter_by(
+        id=task.execution_id,
+    ).one()
 
-    finally:
-        task_queue.counter.decrement()
+    if job_execution.task_id == task.id:
+        task_scope = execute_entry_task(job_execution=job_execution, task=task)
+    else:
+        task_scope = execute_receiver_task(job_execution=job_execution, task=task)
+
+    context_scope = riberry.app.current_context.scope(
+        root_id=task.root_id or job_execution.task_id,
+        task_id=task.id,
+        task_name=task.definition.name,
+        stream=task.definition.stream,
+        category=None,
+        step=task.definition.step,
+    )
+
+    with context_scope, task_scope:
+        execute_task(job_execution=job_execution, task=task)
 
 
 @contextmanager
@@ -114,3 +158,4 @@ def execute_task(job_execution: riberry.model.job.JobExecution, task: Task):
             )
 
         riberry.app.current_riberry_app.backend.set_active_task(task=None)
+        riberry.app.util.events.event_buffer.task_complete()
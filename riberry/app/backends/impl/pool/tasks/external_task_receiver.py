@@ -13,7 +13,7 @@ def ready_external_tasks() -> List[riberry.model.job.JobExecutionExternalTask]:
     ).join(riberry.model.job.JobExecution).filter_by(
         status='ACTIVE',
     ).join(riberry.model.job.Job).filter_by(
-        instance=ctx.current.riberry_app_instance,
+        instance=ctx.current.riberry_app_instance_snapshot,
     ).all()
 
 
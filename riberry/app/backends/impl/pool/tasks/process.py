@@ -0,0 +1,127 @@
+import signal
+from typing import Optional
+
+from billiard.pool import Pool
+
+import riberry
+from ..task_queue import TaskQueue, Task
+from ..task_queue.base import make_entry_task, make_receiver_task
+from .executor import TaskExecutor, execute_in_session
+
+log = riberry.log.make(__name__)
+
+
+class TaskPayload:
+    """ Picklable reference to a `Task`, along with its context scope, resolved again within a child process. """
+
+    def __init__(self, task_id, execution_id, root_id, name, stream, step, origin):
+        self.task_id = task_id
+        self.execution_id = execution_id
+        self.root_id = root_id
+        self.name = name
+        self.stream = stream
+        self.step = step
+        self.origin = origin
+
+    @classmethod
+    def from_task(cls, task: Task) -> 'TaskPayload':
+        return cls(
+            task_id=task.id,
+            execution_id=task.execution_id,
+            root_id=task.root_id,
+            name=task.definition.name,
+            stream=task.definition.stream,
+            step=task.definition.step,
+            origin=task.origin,
+        )
+
+    def to_task(self, backend) -> Task:
+        kind, key = self.origin
+        if kind == 'entry':
+            entry_point = riberry.app.current_riberry_app.entry_points[key]
+            task = make_entry_task(execution_id=self.execution_id, root_id=self.root_id, entry_point=entry_point)
+        else:
+            external_task = riberry.model.job.JobExecutionExternalTask.query().filter_by(id=key).one()
+            task = make_receiver_task(backend=backend, external_task=external_task)
+
+        task.id, task.execution_id, task.root_id = self.task_id, self.execution_id, self.root_id
+        task.definition.name, task.definition.stream, task.definition.step = self.name, self.stream, self.step
+        return task
+
+
+def initialize_child():
+    # the parent handles termination signals and drains the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for sig in ('SIGTERM', 'SIGHUP'):
+        if hasattr(signal, sig):
+            signal.signal(getattr(signal, sig), signal.SIG_DFL)
+
+    riberry.model.conn.detach_engine()
+
+
+def execute_payload(payload: TaskPayload):
+    with riberry.model.conn:
+        task = payload.to_task(backend=riberry.app.current_riberry_app.backend)
+        execute_in_session(task=task)
+        riberry.app.util.events.event_buffer.flush()
+
+
+class ProcessTaskExecutor(TaskExecutor):
+    """ Runs the tasks dequeued from a `TaskQueue` in a pool of pre-forked processes.
+
+    Children inherit the imported application from the parent. A child is replaced after completing
+    `max_tasks_per_child` tasks, or once its resident memory exceeds `max_memory_per_child` KiB.
+    """
+
+    def __init__(
+            self,
+            task_queue: TaskQueue,
+            max_workers: Optional[int] = None,
+            max_tasks_per_child: Optional[int] = None,
+            max_memory_per_child: Optional[int] = None,
+    ):
+        super().__init__(task_queue=task_queue, max_workers=max_workers)
+        self.max_tasks_per_child = max_tasks_per_child
+        self.max_memory_per_child = max_memory_per_child
+        self._results = []
+
+    @property
+    def connections(self) -> int:
+        return 0
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            # children are forked with a fresh connection pool
+            riberry.model.conn.dispose_engine()
+            self._pool = Pool(
+                processes=self.max_workers,
+                initializer=initialize_child,
+                maxtasksperchild=self.max_tasks_per_child,
+                max_memory_per_child=self.max_memory_per_child,
+            )
+        return self._pool
+
+    def submit(self, task: Task):
+        def on_complete(_):
+            self.task_queue.counter.decrement()
+
+        def on_error(exc):
+            log.error('Error occurred while executing task %s: %r', task.definition.name, exc)
+            self.task_queue.counter.decrement()
+
+        self._results = [result for result in self._results if not result.ready()]
+        self._results.append(self.pool.apply_async(
+            execute_payload,
+            (TaskPayload.from_task(task),),
+            callback=on_complete,
+            error_callback=on_error,
+        ))
+
+    def _shutdown(self):
+        # children are no longer replaced once the pool is closed, so wait for the submitted tasks first
+        for result in self._results:
+            result.wait()
+        self._results = []
+        self._pool.close()
+        self._pool.join()
@@ -52,6 +52,10 @@ class ContextCurrent:
     def riberry_app_instance(self) -> riberry.model.application.ApplicationInstance:
         return riberry.app.env.get_instance_model()
 
+    @property
+    def riberry_app_instance_snapshot(self) -> riberry.model.application.ApplicationInstance:
+        return riberry.app.env.get_instance_snapshot()
+
     @property
     def task_id(self):
         return self._get_state('task_id')
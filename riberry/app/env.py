@@ -3,6 +3,7 @@ import os
 import riberry
 from .base import RiberryApplication
 from .context import Context
+from .util.instance_cache import InstanceCache
 from .util.misc import Proxy
 
 __cache = dict(
@@ -30,6 +31,14 @@ def get_instance_model() -> riberry.model.application.ApplicationInstance:
     ).one()
 
 
+instance_cache = InstanceCache.from_config(riberry.config.config.instances.cache)
+
+
+def get_instance_snapshot() -> riberry.model.application.ApplicationInstance:
+    """ Returns the cached, read-only snapshot of the current instance. """
+    return instance_cache.get(name=get_instance_name(raise_on_none=True))
+
+
 def is_current_instance(instance_name: str) -> bool:
     return bool(instance_name and get_instance_name(raise_on_none=False) == instance_name)
 
@@ -28,7 +28,7 @@ def poll(
         filter_func: Optional[Callable[[riberry.model.job.JobExecution], bool]] = None,
 ):
     with riberry.model.conn:
-        app_instance = env.get_instance_model()
+        app_instance = env.get_instance_snapshot()
 
         if track_executions:
             current_riberry_app.backend.execution_tracker.check_stale_executions(app_instance=app_instance)
@@ -1 +1 @@
-from . import misc, events, redis_lock, task_transitions
+from . import misc, events, redis_lock, task_transitions, instance_cache
@@ -1,10 +1,179 @@
-import json
+import atexit
+import os
+import threading
+import time
 import traceback
+from collections import deque
+from typing import Optional
 
 import pendulum
 
 import riberry
 
+log = riberry.log.make(__name__)
+
+
+class EventBuffer:
+    """ Per-process write-behind buffer for events created via `create_event`.
+
+    Buffered events are published to the event transport as a single batch (an
+    executemany INSERT for the SQL transport) whenever the buffer reaches `size`
+    events, the oldest buffered event is older than `age` seconds, or the worker
+    shuts down. The buffer holds at most `capacity` events; if flushing fails the
+    oldest events beyond this limit are dropped.
+
+    Durability modes:
+        task: events are also flushed at the end of every task, so a task is only
+              reported as complete once its events have been committed. A crash
+              can only lose the events of tasks which were still in-flight.
+        lazy: events are only flushed on the size/age limits and at shutdown. A
+              crash can lose up to `size` events or `age` seconds worth of events.
+    """
+
+    DURABILITY_TASK = 'task'
+    DURABILITY_LAZY = 'lazy'
+
+    def __init__(self, enabled=False, size=100, age=1.0, capacity=10_000, durability=DURABILITY_TASK):
+        self.enabled = False
+        self.size = size
+        self.age = age
+        self.capacity = capacity
+        self.durability = None
+        self._pid = os.getpid()
+        self._events = deque()
+        self._oldest = None
+        self._lock = threading.RLock()
+        self._flusher: Optional[threading.Thread] = None
+        self.configure(enabled=enabled, durability=durability)
+
+    @classmethod
+    def from_config(cls, config: 'riberry.config.EventBufferConfig') -> 'EventBuffer':
+        return cls(
+            enabled=config.enabled,
+            size=config.size,
+            age=config.age,
+            capacity=config.capacity,
+            durability=config.durability,
+        )
+
+    def configure(self, enabled=None, size=None, age=None, capacity=None, durability=None):
+        if durability is not None and durability not in (self.DURABILITY_TASK, self.DURABILITY_LAZY):
+            raise ValueError(f'EventBuffer.durability must be either {self.DURABILITY_TASK!r} or '
+                             f'{self.DURABILITY_LAZY!r} (received {durability!r})')
+
+        self.size = size if size is not None else self.size
+        self.age = age if age is not None else self.age
+        self.capacity = capacity if capacity is not None else self.capacity
+        self.durability = durability if durability is not None else self.durability
+        if enabled is not None:
+            if self.enabled and not enabled:
+                self.flush()
+            self.enabled = bool(enabled)
+
+    def __len__(self):
+        return len(self._events)
+
+    def _check_pid(self):
+        """ Discards state inherited from the parent process after a fork. """
+
+        current_pid = os.getpid()
+        if self._pid != current_pid:
+            self._pid = current_pid
+            self._events = deque()
+            self._oldest = None
+            self._lock = threading.RLock()
+            self._flusher = None
+
+    def _ensure_flusher(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(name='riberry.event_buffer', target=self._flush_aged, daemon=True)
+            self._flusher.start()
+
+    def _flush_aged(self):
+        pid = self._pid
+        while pid == os.getpid():
+            time.sleep(self.age)
+            if self._oldest is not None and time.time() - self._oldest >= self.age:
+                with riberry.model.conn:
+                    self.flush()
+
+    def add(self, event: dict):
+        self._check_pid()
+        with self._lock:
+            self._events.append(event)
+            if self._oldest is None:
+                self._oldest = time.time()
+            self._ensure_flusher()
+
+            if len(self._events) >= self.size or time.time() - self._oldest >= self.age:
+                self.flush()
+
+    def task_complete(self):
+        """ Flushes the buffer if events must be committed before a task completes.
+
+        Raises if the events could not be published, so that the task fails rather than completing
+        without them. The events are kept in the buffer to be retried by the next flush.
+        """
+
+        if self.enabled and self.durability == self.DURABILITY_TASK:
+            self.flush(raise_on_error=True)
+
+    def flush(self, raise_on_error=False):
+        self._check_pid()
+        with self._lock:
+            if not self._events:
+                return
+
+            rows = list(self._events)
+            self._events.clear()
+            self._oldest = None
+
+            try:
+                publish(rows)
+                log.debug(f'EventBuffer:: flushed {len(rows)} events')
+            except:
+                log.exception(f'EventBuffer:: failed to flush {len(rows)} events')
+                riberry.model.conn.rollback()
+                self._requeue(rows)
+                if raise_on_error:
+                    raise
+
+    def _requeue(self, rows):
+        self._events.extendleft(reversed(rows))
+        overflow = len(self._events) - self.capacity
+        if overflow > 0:
+            log.error(f'EventBuffer:: capacity of {self.capacity} events exceeded, dropping {overflow} oldest events')
+            for _ in range(overflow):
+                self._events.popleft()
+        if self._events:
+            self._oldest = time.time()
+
+
+def publish(events):
+    """ Publishes the given events via the configured transport.
+
+    If a transport other than the event table fails, the events are stored in the event table
+    instead, which the background processor also drains.
+    """
+
+    from riberry.celery.background.events.transport import SqlEventTransport
+
+    transport = riberry.config.config.events.transport.instance
+    if isinstance(transport, SqlEventTransport):
+        transport.publish(events)
+        return
+
+    try:
+        transport.publish(events)
+    except Exception:
+        log.exception(f'publish:: failed to publish {len(events)} events via the {transport.name} transport, '
+                      f'storing them in the event table')
+        SqlEventTransport().publish(events)
+
+
+event_buffer = EventBuffer.from_config(riberry.config.config.events.buffer)
+atexit.register(event_buffer.flush)
+
 
 def create_event(name, root_id, task_id, data=None, binary=None):
     if not root_id:
@@ -13,19 +182,27 @@ def create_event(name, root_id, task_id, data=None, binary=None):
     if isinstance(binary, str):
         binary = binary.encode()
 
-    evt = riberry.model.misc.Event(
+    try:
+        encoded_data = riberry.model.misc.codec.encode(data, encoding=riberry.config.config.events.encoding)
+    except riberry.model.misc.codec.EventDataTooLarge as exc:
+        log.error(f'create_event:: dropping {name!r} event for {task_id}: {exc}')
+        return
+
+    event = dict(
         name=name,
         time=pendulum.DateTime.utcnow().timestamp(),
         task_id=task_id,
         root_id=root_id,
-        data=json.dumps(data),
+        data=encoded_data,
         binary=binary,
     )
 
+    if event_buffer.enabled:
+        event_buffer.add(event)
+        return
+
     try:
-        riberry.model.conn.add(evt)
-        riberry.model.conn.commit()
-        riberry.model.conn.flush([evt])
+        publish([event])
     except:
         traceback.print_exc()
         riberry.model.conn.rollback()
@@ -0,0 +1,100 @@
+import threading
+import time
+from typing import Optional, Tuple
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+
+import riberry
+
+log = riberry.log.make(__name__)
+
+
+class InstanceCache:
+    """ Per-process snapshot of an `ApplicationInstance` with its application, schedules and heartbeat.
+
+    The snapshot is detached from any session, so that it can be read by the worker's addon steps
+    without querying the instance each time. Every `check_interval` seconds a single query reads a
+    version stamp of the instance's schedules along with its latest heartbeat. The snapshot is
+    reloaded when the stamp changes or after `ttl` seconds. Otherwise only the heartbeat is updated.
+
+    Snapshots are read-only: they must not be added to a session or modified.
+    """
+
+    def __init__(self, enabled: bool = True, ttl: float = 30.0, check_interval: float = 1.0):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._instance: Optional[riberry.model.application.ApplicationInstance] = None
+        self._stamp: Optional[Tuple] = None
+        self._loaded = 0.0
+        self._checked = 0.0
+
+    @classmethod
+    def from_config(cls, config: 'riberry.config.InstanceCacheConfig') -> 'InstanceCache':
+        return cls(enabled=config.enabled, ttl=config.ttl, check_interval=config.check_interval)
+
+    @staticmethod
+    def _load(name: str) -> riberry.model.application.ApplicationInstance:
+        # loaded through a separate session on the current connection, so that the snapshot is detached
+        # once the session closes without removing any instance already loaded in the current session
+        instance_model = riberry.model.application.ApplicationInstance
+        session = Session(bind=riberry.model.conn.connection())
+        try:
+            return session.query(instance_model).filter_by(internal_name=name).options(
+                joinedload(instance_model.application),
+                joinedload(instance_model.heartbeat),
+                selectinload(instance_model.schedules),
+            ).one()
+        finally:
+            session.close()
+
+    @staticmethod
+    def _stamp_of(instance_id) -> Tuple[Tuple, object]:
+        """ Returns the instance's schedule stamp (count and latest id) and its latest heartbeat. """
+
+        schedule = riberry.model.application.ApplicationInstanceSchedule
+        heartbeat = riberry.model.application.Heartbeat
+        count, latest, updated = riberry.model.conn.query(
+            select([func.count(schedule.id)]).where(schedule.instance_id == instance_id).as_scalar(),
+            select([func.max(schedule.id)]).where(schedule.instance_id == instance_id).as_scalar(),
+            select([heartbeat.updated]).where(heartbeat.instance_id == instance_id).limit(1).as_scalar(),
+        ).one()
+        return (count, latest), updated
+
+    def get(self, name: str, now: Optional[float] = None) -> riberry.model.application.ApplicationInstance:
+        """ Returns the snapshot of the named instance, refreshing it if it may be outdated. """
+
+        if not self.enabled:
+            return riberry.app.env.get_instance_model()
+
+        now = now or time.time()
+        with self._lock:
+            instance = self._instance
+            if instance is None or instance.internal_name != name or now - self._loaded >= self.ttl:
+                return self._reload(name, now)
+
+            if now - self._checked >= self.check_interval:
+                stamp, heartbeat_updated = self._stamp_of(instance.id)
+                self._checked = now
+                if stamp != self._stamp or (heartbeat_updated is None) != (instance.heartbeat is None):
+                    return self._reload(name, now)
+                if heartbeat_updated is not None:
+                    set_committed_value(instance.heartbeat, 'updated', heartbeat_updated)
+
+            return instance
+
+    def _reload(self, name: str, now: float) -> riberry.model.application.ApplicationInstance:
+        instance = self._load(name)
+        self._stamp, _ = self._stamp_of(instance.id)
+        self._instance = instance
+        self._loaded = self._checked = now
+        log.debug(f'InstanceCache:: loaded snapshot of instance {name!r}')
+        return instance
+
+    def invalidate(self):
+        with self._lock:
+            self._instance = None
+            self._stamp = None
@@ -0,0 +1,154 @@
+import hashlib
+import os
+import pathlib
+import tempfile
+from typing import Iterator, Optional
+
+from sqlalchemy import func
+
+import riberry
+
+CHUNK_SIZE = 64 * 1024
+
+
+def digest(content: bytes) -> str:
+    """ Returns the key under which the given content is stored. """
+    return hashlib.sha256(content).hexdigest()
+
+
+class BlobStore:
+    """ Stores the content of artifacts, keyed by the SHA-256 digest of the content. """
+
+    name = None
+    inline = False
+
+    def __init__(self, config_dict=None):
+        self.raw_config = config_dict or {}
+
+    def put(self, content: bytes) -> str:
+        """ Stores the given content (if not already stored) and returns its digest. """
+        raise NotImplementedError
+
+    def create(self, content: Optional[bytes]) -> 'riberry.model.job.JobExecutionArtifactBinary':
+        """ Returns a new artifact binary holding the given content. """
+
+        if content is None:
+            return riberry.model.job.JobExecutionArtifactBinary(binary=None)
+        return riberry.model.job.JobExecutionArtifactBinary(store=self.name, digest=self.put(content))
+
+    def chunks(
+            self,
+            binary: 'riberry.model.job.JobExecutionArtifactBinary',
+            chunk_size: int = CHUNK_SIZE,
+    ) -> Iterator[bytes]:
+        """ Yields the content of the given artifact binary in chunks of at most `chunk_size` bytes. """
+        raise NotImplementedError
+
+
+class DatabaseBlobStore(BlobStore):
+    """ Stores content inline within the `job_artifact_binary.binary` column.
+
+    Unlike the other stores, identical content is not de-duplicated, as every
+    artifact binary holds its own copy of the content.
+    """
+
+    name = 'database'
+    inline = True
+
+    def put(self, content: bytes) -> str:
+        return digest(content)
+
+    def create(self, content: Optional[bytes]) -> 'riberry.model.job.JobExecutionArtifactBinary':
+        return riberry.model.job.JobExecutionArtifactBinary(
+            binary=content,
+            store=self.name,
+            digest=digest(content) if content is not None else None,
+        )
+
+    def chunks(
+            self,
+            binary: 'riberry.model.job.JobExecutionArtifactBinary',
+            chunk_size: int = CHUNK_SIZE,
+    ) -> Iterator[bytes]:
+        if binary.id is None or 'binary' in binary.__dict__:
+            content = binary.binary or b''
+            for offset in range(0, len(content), chunk_size):
+                yield content[offset:offset + chunk_size]
+            return
+
+        column = riberry.model.job.JobExecutionArtifactBinary.binary
+        offset = 1
+        while True:
+            chunk = riberry.model.conn.query(func.substr(column, offset, chunk_size)).filter(
+                riberry.model.job.JobExecutionArtifactBinary.id == binary.id
+            ).scalar()
+            if not chunk:
+                return
+            yield bytes(chunk)
+            if len(chunk) < chunk_size:
+                return
+            offset += chunk_size
+
+
+class FilesystemBlobStore(BlobStore):
+    """ Stores content as files named by their digest beneath `path`.
+
+    Identical content is only stored once. The path must be shared between the
+    Riberry workers, which write artifacts, and any process which reads them.
+    """
+
+    name = 'filesystem'
+
+    def __init__(self, config_dict=None):
+        super().__init__(config_dict=config_dict)
+        self.path = pathlib.Path(self.raw_config.get('path') or riberry.config.CONF_DEFAULT_BLOB_STORE_PATH)
+
+    def location(self, key: str) -> pathlib.Path:
+        return self.path / key[:2] / key[2:4] / key
+
+    def put(self, content: bytes) -> str:
+        key = digest(content)
+        location = self.location(key)
+        if location.exists():
+            return key
+
+        location.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=str(location.parent), prefix=f'.{key}.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(temp_path, str(location))
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return key
+
+    def chunks(
+            self,
+            binary: 'riberry.model.job.JobExecutionArtifactBinary',
+            chunk_size: int = CHUNK_SIZE,
+    ) -> Iterator[bytes]:
+        with open(str(self.location(binary.digest)), 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+
+stores = {
+    DatabaseBlobStore.name: DatabaseBlobStore,
+    FilesystemBlobStore.name: FilesystemBlobStore,
+}
+
+
+def store(name: Optional[str] = None) -> BlobStore:
+    """ Returns the configured blob store, or the store with the given name. """
+
+    config = riberry.config.config.artifacts.store
+    if name is None or name == config.type:
+        return config.instance
+    if name not in stores:
+        raise ValueError(f'Unknown artifact blob store {name!r}')
+    return stores[name]()
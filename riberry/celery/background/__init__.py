@@ -1,25 +1,49 @@
 from celery import Celery
 from riberry import config
+from riberry.celery.background.events import claim
 
 app = Celery(main='background-tasks')
 
 app.conf.update(config.config.celery)
 
 app.conf.beat_schedule.update({
-    'process:execution': {
+    claim.schedule_name(partition, config.config.background.events.partitions): {
         'task': 'riberry.celery.background.tasks.process_events',
         'schedule': config.config.background.events.interval,
         'kwargs': {
-            'event_limit': config.config.background.events.processing_limit
+            'event_limit': config.config.background.events.processing_limit,
+            'partition': partition,
+            'partitions': config.config.background.events.partitions,
         },
-        'options': {'queue': 'riberry.background.events'}
-    },
+        'options': {
+            'queue': claim.queue_name(
+                partition,
+                config.config.background.events.partitions,
+                claim.effective_mode(),
+            )
+        }
+    }
+    for partition in range(config.config.background.events.partitions)
+    if not config.config.background.events.daemon.enabled
+})
+
+app.conf.beat_schedule.update({
     'process:metrics': {
         'task': 'riberry.celery.background.tasks.update_execution_metrics',
         'schedule': config.config.background.metrics.interval,
         'kwargs': {
             'time_interval': config.config.background.metrics.time_interval,
             'step_limit': config.config.background.metrics.step_limit,
+            'lateness': config.config.background.metrics.lateness,
+            'engine': config.config.background.metrics.engine,
+        },
+        'options': {'queue': 'riberry.background.metrics'}
+    },
+    'process:metric-rollups': {
+        'task': 'riberry.celery.background.tasks.update_metric_rollups',
+        'schedule': config.config.background.rollups.interval,
+        'kwargs': {
+            'lateness': config.config.background.metrics.lateness,
         },
         'options': {'queue': 'riberry.background.metrics'}
     },
@@ -28,6 +52,14 @@ app.conf.beat_schedule.update({
         'schedule': config.config.background.schedules.interval,
         'options': {'queue': 'riberry.background.schedules'}
     },
+    'process:mail': {
+        'task': 'riberry.celery.background.tasks.send_mail',
+        'schedule': config.config.background.mail.interval,
+        'kwargs': {
+            'limit': config.config.background.mail.limit,
+        },
+        'options': {'queue': 'riberry.background.mail'}
+    },
     'process:capacity': {
         'task': 'riberry.celery.background.tasks.update_capacity_parameters',
         'schedule': config.config.background.capacity.interval,
@@ -1,9 +1,10 @@
 from collections import Counter, defaultdict
 from enum import Enum
-from typing import Optional, Dict, List, Set
+from typing import Optional, Dict, List
 
-import itertools
 from celery.utils.log import logger
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload, joinedload
 
 from riberry import model
 
@@ -38,11 +39,27 @@ class CapacityConsumer:
             for consumer in consumers
         }
 
+    @classmethod
+    def allocate(cls, consumers, total_capacity) -> Dict['CapacityConsumer', int]:
+        """ Distributes the total capacity in whole units using the largest remainder method. """
+
+        distribution = cls.distribute(consumers=consumers, total_capacity=total_capacity)
+        shares = {consumer: sum(capacities) for consumer, capacities in distribution.items()}
+        allocation = {consumer: int(share) for consumer, share in shares.items()}
+        remainder = min(total_capacity, round(sum(shares.values()))) - sum(allocation.values())
+        by_remainder = sorted(shares, key=lambda c: (-(shares[c] - allocation[c]), c.name))
+        for consumer in by_remainder[:max(remainder, 0)]:
+            allocation[consumer] += 1
+        return allocation
+
     @classmethod
     def from_weight_parameter(cls, parameter_name: str):
-        schedules: List[model.application.ApplicationInstanceSchedule] = \
-            model.application.ApplicationInstanceSchedule.query().filter_by(parameter=parameter_name).all()
-        instances: Set[model.application.ApplicationInstance] = {sched.instance for sched in schedules}
+        instances: List[model.application.ApplicationInstance] = model.application.ApplicationInstance.query().filter(
+            model.application.ApplicationInstance.schedules.any(parameter=parameter_name)
+        ).options(
+            selectinload(model.application.ApplicationInstance.schedules),
+            joinedload(model.application.ApplicationInstance.heartbeat),
+        ).all()
         schedule_values = {
             instance.internal_name: int(instance.active_schedule_value(name=parameter_name, default=0))
             for instance in instances
@@ -76,17 +93,63 @@ class CapacityProducer:
         return sum(p.capacity for p in producers)
 
     @staticmethod
-    def producers_name_pool(producers, distribution_strategy: model.application.CapacityDistributionStrategy):
-        name_lists = sorted(
-            [[producer.name] * producer.capacity for producer in producers],
-            key=len,
-            reverse=True
-        )
-
+    def allocate(
+            producers,
+            capacities: List[int],
+            distribution_strategy: model.application.CapacityDistributionStrategy,
+    ) -> List[Counter]:
+        """ Allocates the producers' capacity to consumers, given the capacity of each consumer in order.
+
+        Equivalent to taking consecutive slices from a pool holding each producer's name once per unit of
+        capacity, ordered by capacity (binpack) or interleaved round-robin (spread), without building the pool.
+        """
+
+        producers = sorted((p for p in producers if p.capacity > 0), key=lambda p: p.capacity, reverse=True)
         if distribution_strategy == model.application.CapacityDistributionStrategy.spread:
-            name_lists = [filter(None, name_list) for name_list in itertools.zip_longest(*name_lists)]
+            return list(CapacityProducer._allocate_spread(producers, capacities))
+        return list(CapacityProducer._allocate_binpack(producers, capacities))
 
-        return list(itertools.chain.from_iterable(name_lists))
+    @staticmethod
+    def _allocate_binpack(producers, capacities):
+        remaining = [producer.capacity for producer in producers]
+        index = 0
+        for capacity in capacities:
+            allocation = Counter()
+            while capacity and index < len(producers):
+                taken = min(capacity, remaining[index])
+                allocation[producers[index].name] += taken
+                remaining[index] -= taken
+                capacity -= taken
+                if not remaining[index]:
+                    index += 1
+            yield allocation
+
+    @staticmethod
+    def _allocate_spread(producers, capacities):
+        # each round allocates one unit from every producer with capacity left, which are always the
+        # first `active` producers as they are sorted by capacity
+        round_, position, active = 0, 0, len(producers)
+        for capacity in capacities:
+            allocation = Counter()
+            while capacity and active:
+                if position or capacity < active:
+                    taken = min(capacity, active - position)
+                    for producer in producers[position:position + taken]:
+                        allocation[producer.name] += 1
+                    position += taken
+                    capacity -= taken
+                    rounds = 1 if position == active else 0
+                    position = 0 if rounds else position
+                else:
+                    rounds = min(capacity // active, producers[active - 1].capacity - round_)
+                    for producer in producers[:active]:
+                        allocation[producer.name] += rounds
+                    capacity -= rounds * active
+
+                round_ += rounds
+                while active and producers[active - 1].capacity <= round_:
+                    active -= 1
+            yield allocation
 
 
 def weighted_schedules(parameter_name: str):
@@ -96,75 +159,113 @@ def weighted_schedules(parameter_name: str):
 
 def execution_count_for_instances(instances, states=('ACTIVE', 'READY')):
     execution_count = defaultdict(int)
-    job_executions: List[model.job.JobExecution] = model.job.JobExecution.query().filter(
-        model.job.JobExecution.status.in_(states)).all()
-
-    for job_execution in job_executions:
-        instance = job_execution.job.instance
-        if instance in instances:
-            execution_count[instance.internal_name] += 1
+    instance_ids = [instance.id for instance in instances]
+    if not instance_ids:
+        return execution_count
+
+    execution, job, form, instance = (
+        model.job.JobExecution, model.job.Job, model.interface.Form, model.application.ApplicationInstance)
+    counts = model.conn.query(instance.internal_name, func.count(execution.id)).select_from(execution).join(
+        job, job.id == execution.job_id
+    ).join(
+        form, form.id == job.form_id
+    ).join(
+        instance, instance.id == form.instance_id
+    ).filter(
+        execution.status.in_(states),
+        instance.id.in_(instance_ids),
+    ).group_by(instance.internal_name)
+
+    for internal_name, count in counts:
+        execution_count[internal_name] = count
 
     return execution_count
 
 
+def _schedule_signature(schedules):
+    return sorted(
+        (sched.parameter, sched.value, sched.priority, sched.days, sched.start_time, sched.end_time, sched.timezone)
+        for sched in schedules
+    )
+
+
 def update_instance_schedule(
         instance: model.application.ApplicationInstance,
         capacity: int,
         producer_allocations: Counter,
         allocation_config_name: str,
         capacity_config_name: str
-):
-    for sched in list(instance.schedules):
-        if sched.parameter in (capacity_config_name, allocation_config_name):
-            model.conn.delete(sched)
+) -> bool:
+    """ Replaces the instance's capacity and allocation schedules, returning False if they were unchanged. """
 
+    parameters = (capacity_config_name, allocation_config_name)
+    current = [sched for sched in instance.schedules if sched.parameter in parameters]
     schedule_capacity = model.application.ApplicationInstanceSchedule(
-        instance=instance,
         parameter=capacity_config_name,
         value=str(capacity),
         priority=100,
+        days='*',
+        start_time='00:00:00',
+        end_time='23:59:59',
+        timezone='UTC',
     )
 
     schedule_allocation = model.application.ApplicationInstanceSchedule(
-        instance=instance,
         parameter=allocation_config_name,
         value=' '.join(f'{k}|{v}' for k, v in sorted(producer_allocations.items())),
         priority=101,
+        days='*',
+        start_time='00:00:00',
+        end_time='23:59:59',
+        timezone='UTC',
     )
 
+    if _schedule_signature(current) == _schedule_signature([schedule_capacity, schedule_allocation]):
+        return False
+
+    for sched in current:
+        model.conn.delete(sched)
+
+    schedule_capacity.instance = instance
+    schedule_allocation.instance = instance
     model.conn.add(schedule_capacity)
     model.conn.add(schedule_allocation)
+    return True
 
 
 def update_instance_capacities(
         producers, weight_parameter, capacity_parameter, producer_parameter, distribution_strategy):
 
-    consumers = CapacityConsumer.from_weight_parameter(parameter_name=weight_parameter)
+    consumers = sorted(CapacityConsumer.from_weight_parameter(parameter_name=weight_parameter), key=lambda c: c.name)
 
     total_capacity = CapacityProducer.total_capacity(producers=producers)
-    capacity_distribution = CapacityConsumer.distribute(consumers=consumers, total_capacity=total_capacity)
-    producer_name_pool = CapacityProducer.producers_name_pool(
-        producers=producers, distribution_strategy=distribution_strategy)
-
-    logger.info(f'[{weight_parameter}] Total capacity: {total_capacity}')
+    capacity_allocation = CapacityConsumer.allocate(consumers=consumers, total_capacity=total_capacity)
+    producer_allocations = CapacityProducer.allocate(
+        producers=producers,
+        capacities=[capacity_allocation[consumer] for consumer in consumers],
+        distribution_strategy=distribution_strategy,
+    )
 
-    for consumer, capacities in sorted(capacity_distribution.items(), key=lambda x: x[0].name):
-        raw_capacity = round(sum(capacities))
-        allocated_names = producer_name_pool[:raw_capacity]
-        producer_name_pool = producer_name_pool[raw_capacity:]
+    instances = {
+        instance.internal_name: instance
+        for instance in model.application.ApplicationInstance.query().filter(
+            model.application.ApplicationInstance.internal_name.in_([consumer.name for consumer in consumers])
+        ).options(selectinload(model.application.ApplicationInstance.schedules)).all()
+    } if consumers else {}
 
-        capacity = len(allocated_names)
-        producer_allocations = Counter(allocated_names)
+    logger.info(f'[{weight_parameter}] Total capacity: {total_capacity}')
 
-        instance = model.application.ApplicationInstance.query().filter_by(internal_name=consumer.name).one()
-        update_instance_schedule(
-            instance=instance,
+    for consumer, allocations in zip(consumers, producer_allocations):
+        capacity = sum(allocations.values())
+        updated = update_instance_schedule(
+            instance=instances[consumer.name],
             capacity=capacity,
-            producer_allocations=producer_allocations,
+            producer_allocations=allocations,
             allocation_config_name=producer_parameter,
             capacity_config_name=capacity_parameter,
         )
 
-        allocations_formatted = ', '.join([f'{k}: {v:2}' for k, v in sorted(producer_allocations.items())]) or '-'
+        allocations_formatted = ', '.join([f'{k}: {v:2}' for k, v in sorted(allocations.items())]) or '-'
         logger.info(
-            f'[{weight_parameter}] {consumer.name} -> capacity: {capacity:2}, allocations: [ {allocations_formatted} ]')
+            f'[{weight_parameter}] {consumer.name} -> capacity: {capacity:2}, allocations: [ {allocations_formatted} ]'
+            f'{"" if updated else " (unchanged)"}')
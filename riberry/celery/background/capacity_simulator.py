@@ -0,0 +1,284 @@
+""" Offline simulation of capacity distribution.
+
+Drives the allocation code in `capacity_config` and a `PriorityQueue` per consumer with a synthetic
+stream of executions, in simulated time, to evaluate distribution changes without a live fleet.
+
+Each consumer runs at most as many executions concurrently as the capacity allocated to it, with
+each running execution leasing a unit of a producer from the consumer's queue. Consumers are active
+while they have executions queued or running, and capacity is re-allocated every `tick` seconds.
+Executions still queued `drain_time` seconds after arrivals stop are reported as unserved.
+"""
+
+import heapq
+import itertools
+import random
+import time
+from collections import Counter, defaultdict, deque
+from typing import Dict, List, Optional, Tuple
+
+from riberry import model
+from riberry.app.backends.impl.celery.addons.capacity.priority_queue import PriorityQueue
+from riberry.celery.background.capacity_config import CapacityConsumer, CapacityProducer, ConsumerStatus
+
+ARRIVAL, COMPLETION, TICK = 'arrival', 'completion', 'tick'
+
+
+class SimulationReport:
+    """ Results of a capacity simulation. """
+
+    def __init__(self, duration: float, total_capacity: int):
+        self.duration = duration
+        self.total_capacity = total_capacity
+        self.arrived = 0
+        self.completed = 0
+        self.unserved = 0
+        self.busy_time = 0.0
+        self.delays: List[float] = []
+        self.served: Dict[str, float] = defaultdict(float)
+        self.weights: Dict[str, int] = {}
+        self.producer_peaks: Dict[str, int] = defaultdict(int)
+        self.producer_capacities: Dict[str, int] = {}
+        self.reallocations = 0
+        self.redis_commands: Counter = Counter()
+        self.wall_time = 0.0
+
+    @property
+    def utilization(self) -> float:
+        capacity_time = self.total_capacity * self.duration
+        return self.busy_time / capacity_time if capacity_time else 0.0
+
+    @property
+    def delay_mean(self) -> float:
+        return sum(self.delays) / len(self.delays) if self.delays else 0.0
+
+    def delay_quantile(self, q: float) -> float:
+        if not self.delays:
+            return 0.0
+        delays = sorted(self.delays)
+        return delays[min(int(q * len(delays)), len(delays) - 1)]
+
+    @property
+    def fairness(self) -> float:
+        """ Jain's fairness index of the capacity time served per unit of weight, across consumers. """
+
+        shares = [self.served[name] / weight for name, weight in self.weights.items() if weight]
+        if not shares or not any(shares):
+            return 1.0
+        return sum(shares) ** 2 / (len(shares) * sum(share ** 2 for share in shares))
+
+    @property
+    def redis_ops_per_second(self) -> float:
+        """ Redis commands per simulated second, i.e. the load the simulated workers would place on Redis. """
+        return sum(self.redis_commands.values()) / self.duration if self.duration else 0.0
+
+    def to_dict(self) -> dict:
+        return dict(
+            duration=self.duration,
+            total_capacity=self.total_capacity,
+            arrived=self.arrived,
+            completed=self.completed,
+            unserved=self.unserved,
+            utilization=self.utilization,
+            delay_mean=self.delay_mean,
+            delay_p95=self.delay_quantile(0.95),
+            delay_max=max(self.delays, default=0.0),
+            fairness=self.fairness,
+            reallocations=self.reallocations,
+            producer_load={
+                name: self.producer_peaks[name] / capacity if capacity else 0.0
+                for name, capacity in sorted(self.producer_capacities.items())
+            },
+            redis_commands=dict(self.redis_commands),
+            redis_ops_per_second=self.redis_ops_per_second,
+            wall_time=self.wall_time,
+        )
+
+
+def count_commands(connection, counter: Counter):
+    """ Counts the commands sent through the given Redis connection by name. """
+
+    execute_command = connection.execute_command
+
+    def counting_execute_command(*args, **options):
+        counter[str(args[0]).upper()] += 1
+        return execute_command(*args, **options)
+
+    connection.execute_command = counting_execute_command
+    return connection
+
+
+def weights_from_schedules(parameter_name: str) -> Dict[str, int]:
+    """ Returns the consumer weights defined by the instances' active schedules for the given parameter. """
+
+    instances = model.application.ApplicationInstance.query().filter(
+        model.application.ApplicationInstance.schedules.any(parameter=parameter_name)
+    ).all()
+    return {
+        instance.internal_name: int(instance.active_schedule_value(name=parameter_name, default=0))
+        for instance in instances
+    }
+
+
+class CapacitySimulator:
+    """ Simulates executions of weighted consumers sharing the capacity of the given producers. """
+
+    def __init__(
+            self,
+            connection,
+            producers: List[CapacityProducer],
+            weights: Dict[str, int],
+            distribution_strategy: model.application.CapacityDistributionStrategy,
+            arrival_rate: float = 0.1,
+            mean_duration: float = 30.0,
+            tick: float = 5.0,
+            seed: Optional[int] = None,
+            key_prefix: str = 'riberry:simulation',
+            drain_time: Optional[float] = None,
+    ):
+        self.connection = connection
+        self.producers = producers
+        self.weights = weights
+        self.distribution_strategy = distribution_strategy
+        self.arrival_rate = arrival_rate
+        self.mean_duration = mean_duration
+        self.tick = tick
+        self.drain_time = drain_time
+        self.random = random.Random(seed)
+        self.queues = {
+            name: PriorityQueue(r=connection, key=name, prefix=key_prefix, blocking=False)
+            for name in sorted(weights)
+        }
+        self.capacities: Dict[str, int] = {name: 0 for name in weights}
+        self.allocations: Dict[str, Counter] = {name: Counter() for name in weights}
+        self.pending: Dict[str, deque] = {name: deque() for name in weights}
+        self.running: Dict[str, int] = {name: 0 for name in weights}
+        self.leased: Counter = Counter()
+        self._events = []
+        self._sequence = itertools.count()
+
+    def _schedule(self, at: float, kind: str, *payload):
+        heapq.heappush(self._events, (at, next(self._sequence), kind, payload))
+
+    def _allocate(self, report: SimulationReport):
+        consumers = [
+            CapacityConsumer(
+                name=name,
+                status=ConsumerStatus.active if self.pending[name] or self.running[name] else ConsumerStatus.inactive,
+                requested_capacity=weight,
+            )
+            for name, weight in sorted(self.weights.items())
+        ]
+        total_capacity = CapacityProducer.total_capacity(producers=self.producers)
+        capacity_allocation = CapacityConsumer.allocate(consumers=consumers, total_capacity=total_capacity)
+        producer_allocations = CapacityProducer.allocate(
+            producers=self.producers,
+            capacities=[capacity_allocation[consumer] for consumer in consumers],
+            distribution_strategy=self.distribution_strategy,
+        )
+
+        for consumer, allocation in zip(consumers, producer_allocations):
+            if allocation != self.allocations[consumer.name]:
+                self.queues[consumer.name].update(dict(allocation))
+                self.allocations[consumer.name] = allocation
+                report.reallocations += 1
+            self.capacities[consumer.name] = sum(allocation.values())
+
+    def _start(self, name: str, now: float, report: SimulationReport):
+        while self.pending[name] and self.running[name] < self.capacities[name]:
+            arrived, duration = self.pending[name].popleft()
+            try:
+                lease = self.queues[name].pop()
+            except ValueError:
+                self.pending[name].appendleft((arrived, duration))
+                return
+
+            self.running[name] += 1
+            self.leased[lease.member] += 1
+            report.producer_peaks[lease.member] = max(report.producer_peaks[lease.member], self.leased[lease.member])
+            report.delays.append(now - arrived)
+            self._schedule(now + duration, COMPLETION, name, lease, duration)
+
+    def run(self, duration: float) -> SimulationReport:
+        """ Simulates `duration` seconds of arrivals, returning the report once all started executions have
+        completed and no queued execution can start within `drain_time` seconds (default: `duration`). """
+
+        report = SimulationReport(duration=duration, total_capacity=CapacityProducer.total_capacity(self.producers))
+        report.weights = dict(self.weights)
+        report.producer_capacities = {producer.name: producer.capacity for producer in self.producers}
+        start = time.time()
+
+        for name in self.weights:
+            if self.arrival_rate > 0:
+                self._schedule(self.random.expovariate(self.arrival_rate), ARRIVAL, name)
+        self._schedule(0.0, TICK)
+        drain_time = duration if self.drain_time is None else self.drain_time
+
+        while self._events:
+            now, _, kind, payload = heapq.heappop(self._events)
+            if kind == ARRIVAL:
+                name, = payload
+                report.arrived += 1
+                self.pending[name].append((now, self.random.expovariate(1 / self.mean_duration)))
+                next_arrival = now + self.random.expovariate(self.arrival_rate)
+                if next_arrival < duration:
+                    self._schedule(next_arrival, ARRIVAL, name)
+                self._start(name, now, report)
+            elif kind == COMPLETION:
+                name, lease, execution_duration = payload
+                self.queues[name].put(member=lease.member, version=lease.version, token=lease.token)
+                self.running[name] -= 1
+                self.leased[lease.member] -= 1
+                report.completed += 1
+                report.busy_time += max(0.0, min(now, duration) - (now - execution_duration))
+                report.served[name] += execution_duration
+                self._start(name, now, report)
+            elif kind == TICK:
+                self._allocate(report)
+                for name in sorted(self.weights):
+                    self._start(name, now, report)
+                working = any(self.pending.values()) or any(self.running.values())
+                if now < duration or (working and now < duration + drain_time):
+                    self._schedule(now + self.tick, TICK)
+
+        report.unserved = sum(len(pending) for pending in self.pending.values())
+        report.wall_time = time.time() - start
+        return report
+
+    def clear(self):
+        for queue in self.queues.values():
+            for key in self.connection.scan_iter(match=queue.make_key(queue.key_tag, '*')):
+                self.connection.delete(key)
+
+
+def simulate(
+        producers: List[Tuple[str, int]],
+        weights: Dict[str, int],
+        distribution_strategy: model.application.CapacityDistributionStrategy,
+        duration: float,
+        connection=None,
+        **kwargs,
+) -> SimulationReport:
+    """ Runs a simulation against the given Redis connection, or an in-memory fake Redis if not given. """
+
+    if connection is None:
+        try:
+            import fakeredis
+        except ImportError:
+            raise ImportError('fakeredis is required to simulate without a Redis connection, '
+                              'install riberry with the "simulation" extra') from None
+        connection = fakeredis.FakeRedis()
+
+    commands = Counter()
+    simulator = CapacitySimulator(
+        connection=count_commands(connection, commands),
+        producers=[CapacityProducer(name, capacity) for name, capacity in producers],
+        weights=weights,
+        distribution_strategy=distribution_strategy,
+        **kwargs,
+    )
+    try:
+        report = simulator.run(duration=duration)
+        report.redis_commands = Counter(commands)
+    finally:
+        simulator.clear()
+    return report
@@ -0,0 +1,153 @@
+from collections import OrderedDict
+from typing import List, Optional
+
+from sqlalchemy import exists, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import Query
+
+from riberry import model, config
+from .index import chunks, IN_CLAUSE_LIMIT
+
+CLAIM_PARTITION = 'partition'
+CLAIM_SKIP_LOCKED = 'skip-locked'
+CLAIM_MODES = (CLAIM_PARTITION, CLAIM_SKIP_LOCKED)
+
+SKIP_LOCKED_DIALECTS = {'postgresql', 'oracle'}
+
+EVENT_QUEUE = 'riberry.background.events'
+
+
+def supports_skip_locked(dialect_name: str) -> bool:
+    """ Returns whether the given dialect supports SELECT ... FOR UPDATE SKIP LOCKED. """
+    return dialect_name in SKIP_LOCKED_DIALECTS
+
+
+def effective_mode(mode: Optional[str] = None, dialect_name: Optional[str] = None) -> str:
+    """ Returns the claim mode to use, falling back to partitioning if SKIP LOCKED is unsupported.
+
+    Transports other than the SQL table are always partitioned.
+    """
+
+    mode = mode or config.config.background.events.claim
+    if mode not in CLAIM_MODES:
+        raise ValueError(f'Event claim mode must be one of {", ".join(CLAIM_MODES)} (received {mode!r})')
+
+    if dialect_name is None:
+        dialect_name = make_url(config.config.database.connection_url).get_backend_name()
+
+    if mode == CLAIM_SKIP_LOCKED and (
+            not supports_skip_locked(dialect_name) or config.config.events.transport.type != 'sql'):
+        return CLAIM_PARTITION
+    return mode
+
+
+def queue_name(partition: int, partitions: int, mode: str) -> str:
+    """ Returns the celery queue which processes the given partition.
+
+    Partitions are only processed from separate queues in partition mode, where each
+    queue is consumed by a single process so that a partition is never processed
+    concurrently.
+    """
+
+    if partitions <= 1 or mode == CLAIM_SKIP_LOCKED:
+        return EVENT_QUEUE
+    return f'{EVENT_QUEUE}.{partition}'
+
+
+def schedule_name(partition: int, partitions: int) -> str:
+    return 'process:execution' if partitions <= 1 else f'process:execution:{partition}'
+
+
+class EventClaim:
+    """ Restricts an event processor to a disjoint subset of the pending events.
+
+    partition:   events are split by their execution's primary key modulo `partitions`.
+                 Events without an execution are claimed by partition 0.
+    skip-locked: executions are locked with SELECT ... FOR UPDATE SKIP LOCKED before their
+                 events are applied, so concurrent processors skip each other's executions.
+                 Dialects without SKIP LOCKED support fall back to partition mode.
+
+    Both modes ensure that the events for a single execution are only ever applied by one
+    processor at a time and in order.
+    """
+
+    def __init__(self, partition: Optional[int] = None, partitions: Optional[int] = None, mode: Optional[str] = None):
+        self.partitions = partitions or 1
+        self.partition = partition or 0
+        self.mode = effective_mode(mode=mode, dialect_name=model.conn.raw_engine.dialect.name)
+        if not 0 <= self.partition < self.partitions:
+            raise ValueError(f'Event partition must be between 0 and {self.partitions - 1} '
+                             f'(received {self.partition})')
+
+    @property
+    def partitioned(self) -> bool:
+        return self.mode == CLAIM_PARTITION and self.partitions > 1
+
+    def filter(self, query: Query) -> Query:
+        """ Restricts the given event query to the events within this processor's partition. """
+
+        if not self.partitioned:
+            return query
+
+        job_execution = model.job.JobExecution
+        condition = model.misc.Event.root_id.in_(
+            select([job_execution.task_id]).where(job_execution.id % self.partitions == self.partition)
+        )
+        if self.partition == 0:
+            condition |= ~exists().where(job_execution.task_id == model.misc.Event.root_id)
+
+        return query.filter(condition)
+
+    def chunks(self, events: List[model.misc.Event], size: int):
+        """ Splits the given events into chunks of roughly the given size.
+
+        In skip-locked mode, all events for a single execution are kept within the same chunk.
+        """
+
+        if self.mode != CLAIM_SKIP_LOCKED:
+            yield from chunks(events, size)
+            return
+
+        groups = OrderedDict()
+        for event in events:
+            groups.setdefault(event.root_id, []).append(event)
+
+        chunk = []
+        for group in groups.values():
+            if chunk and len(chunk) + len(group) > size:
+                yield sorted(chunk, key=lambda e: (e.time, e.id))
+                chunk = []
+            chunk += group
+        if chunk:
+            yield sorted(chunk, key=lambda e: (e.time, e.id))
+
+    def acquire(self, events: List[model.misc.Event]) -> List[model.misc.Event]:
+        """ Claims the given events for the current transaction.
+
+        In skip-locked mode, the events' executions are locked and any events belonging to
+        executions locked by another processor are dropped. The remaining events are re-read
+        as they may have been applied by another processor since they were first queried.
+        """
+
+        if self.mode != CLAIM_SKIP_LOCKED:
+            return events
+
+        job_execution = model.job.JobExecution
+        root_ids = {event.root_id for event in events}
+        existing, locked = set(), set()
+        for root_ids_chunk in chunks(root_ids, IN_CLAUSE_LIMIT):
+            existing.update(task_id for task_id, in model.conn.query(job_execution.task_id).filter(
+                job_execution.task_id.in_(root_ids_chunk),
+            ))
+            locked.update(task_id for task_id, in model.conn.query(job_execution.task_id).filter(
+                job_execution.task_id.in_(root_ids_chunk),
+            ).with_for_update(skip_locked=True))
+
+        claimed_ids = [event.id for event in events if event.root_id in locked or event.root_id not in existing]
+        claimed = []
+        for event_ids_chunk in chunks(claimed_ids, IN_CLAUSE_LIMIT):
+            claimed += model.misc.Event.query().filter(
+                model.misc.Event.id.in_(event_ids_chunk),
+            ).populate_existing().all()
+
+        return sorted(claimed, key=lambda e: (e.time, e.id))
@@ -0,0 +1,88 @@
+import traceback
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import List, Dict, Callable, Hashable, Optional
+
+import pendulum
+from celery.utils.log import logger
+
+from riberry import model
+
+
+def coalesce(
+        events: List[model.misc.Event],
+        key: Callable[[model.misc.Event], Hashable],
+        kind: str,
+) -> Dict[Hashable, List[model.misc.Event]]:
+    """ Groups the given state events by `key`, preserving their order.
+
+    Events which are missing their key or state are logged and left out so that they
+    remain unprocessed, as they would be when applied individually.
+    """
+
+    groups = OrderedDict()
+    for event in events:
+        try:
+            event_key = key(event)
+            event.payload['state']
+        except:
+            logger.warn(f'An error occurred processing {kind} event {event}: {traceback.format_exc()}')
+            continue
+        groups.setdefault(event_key, []).append(event)
+    return groups
+
+
+def _utc(value: datetime) -> datetime:
+    return value if value.tzinfo is None else value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class StateTransition:
+    """ The net effect of applying a sequence of state events to a stream or step.
+
+    Applying the transition is equivalent to applying each event in turn: an event only
+    takes effect if it is at least as recent as the last applied update. Timestamps are
+    compared at microsecond resolution, as they are once stored.
+    """
+
+    def __init__(self):
+        self.state: Optional[model.misc.Event] = None
+        self.started: Optional[model.misc.Event] = None
+        self.completed: Optional[model.misc.Event] = None
+
+    @classmethod
+    def fold(
+            cls,
+            events: List[model.misc.Event],
+            updated: datetime,
+            started: Optional[datetime],
+            keep_first_start: bool,
+    ) -> 'StateTransition':
+        transition = cls()
+        updated = _utc(updated)
+        has_started = started is not None
+
+        for event in events:
+            event_time = datetime.utcfromtimestamp(event.time)
+            if event_time < updated:
+                continue
+
+            state = event.payload['state']
+            transition.state = event
+            updated = event_time
+            if state == 'ACTIVE':
+                if not (keep_first_start and has_started):
+                    transition.started = event
+                    has_started = True
+            elif state in ('SUCCESS', 'FAILURE'):
+                transition.completed = event
+
+        return transition
+
+    def apply(self, target):
+        if self.state is not None:
+            target.status = self.state.payload['state']
+            target.updated = pendulum.from_timestamp(self.state.time, tz='utc')
+        if self.started is not None:
+            target.started = pendulum.from_timestamp(self.started.time, tz='utc')
+        if self.completed is not None:
+            target.completed = pendulum.from_timestamp(self.completed.time, tz='utc')
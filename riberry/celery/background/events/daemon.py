@@ -0,0 +1,130 @@
+import signal
+import threading
+import traceback
+from typing import Optional
+
+from celery.utils.log import logger
+
+from riberry import model, config
+from . import events
+from .wakeup import Wakeup, create as create_wakeup
+
+
+class AdaptiveBatch:
+    """ Batch size which doubles while a backlog exists and halves once the backlog has drained. """
+
+    def __init__(self, minimum: int, maximum: int, initial: Optional[int] = None):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.size = min(max(initial or minimum, self.minimum), self.maximum)
+
+    def update(self, fetched: int) -> int:
+        if fetched >= self.size:
+            self.size = min(self.size * 2, self.maximum)
+        elif fetched < self.size // 4:
+            self.size = max(self.size // 2, self.minimum)
+        return self.size
+
+
+class Backoff:
+    """ Exponentially increasing delay between polls of an idle event queue. """
+
+    def __init__(self, minimum: float, maximum: float):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.delay = minimum
+
+    def reset(self):
+        self.delay = self.minimum
+
+    def next(self) -> float:
+        delay = self.delay
+        self.delay = min(self.delay * 2, self.maximum)
+        return delay
+
+
+class EventDaemon:
+    """ Processes events continuously, without waiting on the beat schedule between batches.
+
+    Batches are processed back to back while a backlog exists, growing the batch size each time
+    a full batch is fetched. Once the queue is empty, the daemon waits with exponential backoff
+    and is woken early by its `wakeup` when new events are published.
+    """
+
+    def __init__(
+            self,
+            batch: AdaptiveBatch,
+            backoff: Backoff,
+            wakeup: Optional[Wakeup] = None,
+            partition: Optional[int] = None,
+            partitions: Optional[int] = None,
+            claim: Optional[str] = None,
+    ):
+        self.batch = batch
+        self.backoff = backoff
+        self.wakeup = wakeup or Wakeup()
+        self.partition = partition
+        self.partitions = partitions
+        self.claim = claim
+        self.stopped = threading.Event()
+
+    @classmethod
+    def from_config(cls, partition=None, partitions=None, claim=None) -> 'EventDaemon':
+        daemon_config = config.config.background.events.daemon
+        return cls(
+            batch=AdaptiveBatch(
+                minimum=daemon_config.min_batch,
+                maximum=daemon_config.max_batch,
+                initial=config.config.background.events.processing_limit,
+            ),
+            backoff=Backoff(minimum=daemon_config.min_idle, maximum=daemon_config.max_idle),
+            wakeup=create_wakeup(partition=partition, partitions=partitions),
+            partition=partition,
+            partitions=partitions,
+            claim=claim,
+        )
+
+    def run_once(self) -> int:
+        """ Processes a single batch of events, returning the number of events fetched. """
+
+        with model.conn:
+            stats = events.process(
+                event_limit=self.batch.size,
+                partition=self.partition,
+                partitions=self.partitions,
+                claim=self.claim,
+            )
+        fetched = stats.events if stats else 0
+        self.batch.update(fetched)
+        return fetched
+
+    def run(self, iterations: Optional[int] = None):
+        """ Processes events until stopped, or for the given number of iterations. """
+
+        logger.info(f'EventDaemon:: started processing partition {self.partition or 0} '
+                    f'of {self.partitions or 1} (batch size {self.batch.size})')
+        try:
+            while not self.stopped.is_set() and iterations != 0:
+                iterations = iterations - 1 if iterations else iterations
+                try:
+                    fetched = self.run_once()
+                except Exception:
+                    logger.error(f'EventDaemon:: failed to process events: {traceback.format_exc()}')
+                    self.stopped.wait(self.backoff.next())
+                    continue
+
+                if fetched:
+                    self.backoff.reset()
+                elif self.wakeup.wait(self.backoff.next()):
+                    self.backoff.reset()
+        finally:
+            self.wakeup.close()
+            logger.info(f'EventDaemon:: stopped processing partition {self.partition or 0}')
+
+    def stop(self, *_):
+        self.stopped.set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
@@ -1,44 +1,22 @@
-import json
-import smtplib
 import traceback
 from collections import defaultdict
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from typing import List
+from typing import List, Optional
 
 import pendulum
-from sqlalchemy.orm.exc import NoResultFound
-
-from riberry import model, config
+from riberry import model, config, blob
 from celery.utils.log import logger
+from riberry.celery.background import mail
+from .coalesce import coalesce, StateTransition
+from .index import EventIndex
+from .stats import ProcessingStats, record as record_stats
+from .transport import EventConsumer, EventTransport, SqlEventTransport
 
 
-def email_notification(host, body, mime_type, subject, sender, recipients: List):
-    if not recipients:
-        logger.warn('Attempted to send email notification with no recipients provided.')
-        return
-
-    try:
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = sender
-        msg['To'] = ', '.join(recipients)
-        msg.attach(MIMEText(body, mime_type))
-        s = smtplib.SMTP(host)
-        s.sendmail(sender, recipients, msg.as_string())
-        s.quit()
-    except:
-        logger.warn(f'An error occurred while sending email notification: {traceback.format_exc()}')
-
-
-def handle_artifacts(events: List[model.misc.Event]):
-    job_executions = {}
-    streams = {}
-
+def handle_artifacts(events: List[model.misc.Event], index: EventIndex):
     to_delete = []
     for event in events:
         try:
-            event_data = json.loads(event.data)
+            event_data = event.payload
             stream_name = event_data['stream']
 
             artifact = model.job.JobExecutionArtifact(
@@ -48,7 +26,6 @@ def handle_artifacts(events: List[model.misc.Event]):
                 filename=event_data['filename'] or 'Untitled',
                 size=len(event.binary) if event.binary else 0,
                 created=pendulum.from_timestamp(event.time),
-                binary=model.job.JobExecutionArtifactBinary(binary=event.binary),
                 data=[
                     model.job.JobExecutionArtifactData(
                         title=str(title),
@@ -57,27 +34,30 @@ def handle_artifacts(events: List[model.misc.Event]):
                 ]
             )
 
-            if event.root_id not in job_executions:
-                try:
-                    job_executions[event.root_id] = model.job.JobExecution.query().filter_by(task_id=event.root_id).one()
-                except NoResultFound:
-                    to_delete.append(event)
-                    continue
+            job_execution = index.execution(event.root_id)
+            if job_execution is None:
+                to_delete.append(event)
+                continue
 
-            job_execution = job_executions[event.root_id]
-            artifact.job_execution = job_executions[event.root_id]
+            artifact.job_execution = job_execution
 
             if stream_name:
-                if (stream_name, event.root_id) not in streams:
-                    try:
-                        streams[(stream_name, event.root_id)] = model.job.JobExecutionStream.query().filter_by(
-                            name=stream_name, job_execution=job_execution).one()
-                    except NoResultFound:
-                        to_delete.append(event)
-                        continue
-                stream = streams[(stream_name, event.root_id)]
+                stream = index.stream(stream_name, event.root_id)
+                if stream is None:
+                    to_delete.append(event)
+                    continue
                 artifact.stream = stream
 
+            blob_reference = event_data.get('blob')
+            if blob_reference:
+                artifact.size = blob_reference['size']
+                artifact.binary = model.job.JobExecutionArtifactBinary(
+                    store=blob_reference['store'],
+                    digest=blob_reference['digest'],
+                )
+            else:
+                artifact.binary = blob.store().create(event.binary)
+
             model.conn.add(artifact)
         except:
             logger.warn(f'An error occurred processing artifact event {event}: {traceback.format_exc()}')
@@ -87,113 +67,83 @@ def handle_artifacts(events: List[model.misc.Event]):
     return to_delete
 
 
-def handle_steps(events: List[model.misc.Event]):
+def handle_steps(events: List[model.misc.Event], index: EventIndex):
     to_delete = []
-    steps = {}
-    streams = {}
-    job_executions = {}
 
-    for event in events:
-        try:
-            event_data = json.loads(event.data)
-            event_time = pendulum.from_timestamp(event.time)
-            stream_name = event_data['stream']
-
-            if event.root_id not in job_executions:
-                try:
-                    job_executions[event.root_id] = model.job.JobExecution.query().filter_by(
-                        task_id=event.root_id).one()
-                except NoResultFound:
-                    to_delete.append(event)
-                    continue
-            job_execution = job_executions[event.root_id]
+    groups = coalesce(events, key=lambda e: (e.root_id, e.payload['stream'], e.task_id), kind='step')
+    for (root_id, stream_name, task_id), step_events in groups.items():
+        job_execution = index.execution(root_id)
+        if job_execution is None:
+            to_delete += step_events
+            continue
 
-            if (stream_name, event.root_id) not in streams:
-                try:
-                    streams[(stream_name, event.root_id)] = model.job.JobExecutionStream.query().filter_by(
-                        name=stream_name, job_execution=job_execution).one()
-                except NoResultFound:
-                    to_delete.append(event)
-                    continue
-            stream = streams[(stream_name, event.root_id)]
+        stream = index.stream(stream_name, root_id)
+        if stream is None:
+            to_delete += step_events
+            continue
 
-            try:
-                if (stream_name, event.task_id) not in steps:
-                    steps[(stream_name, event.task_id)] = model.job.JobExecutionStreamStep.query().filter_by(
-                        task_id=event.task_id, stream=stream).one()
-                step = steps[(stream_name, event.task_id)]
-            except NoResultFound:
+        try:
+            step = index.step(stream, task_id)
+            if step is None:
+                first_event = step_events[0]
                 step = model.job.JobExecutionStreamStep(
-                    name=event_data['step'],
-                    created=pendulum.from_timestamp(event.time),
-                    updated=pendulum.from_timestamp(event.time),
-                    task_id=event.task_id,
+                    name=first_event.payload['step'],
+                    created=pendulum.from_timestamp(first_event.time),
+                    updated=pendulum.from_timestamp(first_event.time),
+                    task_id=task_id,
                     stream=stream,
-                    status=event_data['state']
+                    status=first_event.payload['state']
                 )
                 model.conn.add(step)
+                index.add_step(step=step, stream=stream)
 
-            step_updated = pendulum.instance(step.updated, tz='utc')
-            if event_time >= step_updated:
-                status = event_data['state']
-                step.status = status
-                step.updated = event_time
-                if status == 'ACTIVE':
-                    step.started = event_time
-                elif status in ('SUCCESS', 'FAILURE'):
-                    step.completed = event_time
+            StateTransition.fold(
+                step_events,
+                updated=step.updated,
+                started=step.started,
+                keep_first_start=False,
+            ).apply(step)
 
         except:
-            logger.warn(f'An error occurred processing step event {event}: {traceback.format_exc()}')
+            logger.warn(f'An error occurred processing step events {step_events}: {traceback.format_exc()}')
         else:
-            to_delete.append(event)
+            to_delete += step_events
 
     return to_delete
 
 
-def handle_streams(events: List[model.misc.Event]):
+def handle_streams(events: List[model.misc.Event], index: EventIndex):
     to_delete = []
-    streams = {}
-    job_executions = {}
 
-    for event in events:
-        try:
-            event_data = json.loads(event.data)
-            event_time = pendulum.from_timestamp(event.time, tz='utc')
-            stream_name = event_data['stream']
+    groups = coalesce(events, key=lambda e: (e.root_id, e.payload['stream']), kind='stream')
+    for (root_id, stream_name), stream_events in groups.items():
+        if not stream_name:
+            logger.warn('Empty stream name provided, skipping')
+            to_delete += stream_events
+            continue
 
-            if not stream_name:
-                logger.warn('Empty stream name provided, skipping')
-                to_delete.append(event)
-                continue
+        job_execution = index.execution(root_id)
+        if job_execution is None:
+            to_delete += stream_events
+            continue
 
-            if event.root_id not in job_executions:
-                try:
-                    job_executions[event.root_id] = model.job.JobExecution.query().filter_by(
-                        task_id=event.root_id).one()
-                except NoResultFound:
-                    to_delete.append(event)
-                    continue
-            job_execution = job_executions[event.root_id]
-            try:
-                if (stream_name, event.root_id) not in streams:
-                    streams[(stream_name, event.root_id)] = model.job.JobExecutionStream.query().filter_by(
-                        name=stream_name, job_execution=job_execution).one()
-                stream = streams[(stream_name, event.root_id)]
-            except NoResultFound:
-                existing_stream = model.job.JobExecutionStream.query().filter_by(task_id=event.task_id).first()
+        try:
+            stream = index.stream(stream_name, root_id)
+            while stream is None and stream_events:
+                event = stream_events[0]
+                existing_stream = index.stream_by_task_id(event.task_id)
                 if existing_stream:
                     logger.warn(f'Skipping stream event {event}. Task ID {event.task_id!r} already exists against '
                                 f'an existing stream (id={existing_stream.id}).\n'
                                 f'Details:\n'
                                 f'  root_id: {event.root_id!r}\n'
                                 f'  name: {stream_name!r}\n'
-                                f'  data: {event_data}\n')
-                    to_delete.append(event)
+                                f'  data: {event.payload}\n')
+                    to_delete.append(stream_events.pop(0))
                     continue
 
                 stream = model.job.JobExecutionStream(
-                    name=str(event_data['stream']),
+                    name=str(stream_name),
                     task_id=event.task_id,
                     created=pendulum.from_timestamp(event.time, tz='utc'),
                     updated=pendulum.from_timestamp(event.time, tz='utc'),
@@ -201,48 +151,46 @@ def handle_streams(events: List[model.misc.Event]):
                     job_execution=job_execution
                 )
                 model.conn.add(stream)
-
-            stream_updated = pendulum.instance(stream.updated, tz='utc')
-            if event_time >= stream_updated:
-                status = event_data['state']
-                stream.status = status
-                stream.updated = event_time
-                if status == 'ACTIVE' and stream.started is None:
-                    stream.started = event_time
-                elif status in ('SUCCESS', 'FAILURE'):
-                    stream.completed = event_time
+                index.add_stream(stream=stream, root_id=root_id)
+
+            if stream is not None:
+                StateTransition.fold(
+                    stream_events,
+                    updated=stream.updated,
+                    started=stream.started,
+                    keep_first_start=True,
+                ).apply(stream)
         except:
-            logger.warn(f'An error occurred processing stream event {event}: {traceback.format_exc()}')
+            logger.warn(f'An error occurred processing stream events {stream_events}: {traceback.format_exc()}')
         else:
-            to_delete.append(event)
+            to_delete += stream_events
 
     return to_delete
 
 
-def handle_notifications(events: List[model.misc.Event]):
+def handle_notifications(events: List[model.misc.Event], index: EventIndex):
     to_delete = []
 
     for event in events:
-        event_data = json.loads(event.data)
+        event_data = event.payload
         notification_type = event_data['type']
         notification_data = event_data['data']
 
-        try:
-            execution: model.job.JobExecution = model.job.JobExecution.query().filter_by(task_id=event.root_id).one()
-            user = execution.creator
-        except NoResultFound:
+        execution: model.job.JobExecution = index.execution(event.root_id)
+        if execution is None:
             to_delete.append(event)
             continue
+        user = execution.creator
 
         if notification_type == 'custom-email' and config.config.email.enabled:
             try:
-                email_notification(
-                    host=config.config.email.smtp_server,
+                mail.enqueue(
                     body=notification_data['body'],
                     mime_type=notification_data.get('mime_type') or 'plain',
                     subject=notification_data['subject'],
                     sender=notification_data.get('from') or config.config.email.sender,
                     recipients=list(filter(None, [user.details.email] + notification_data.get('to', []))),
+                    user=user,
                 )
             except:
                 logger.warn(f'An error occurred processing notification type {notification_type}: '
@@ -267,13 +215,14 @@ def handle_notifications(events: List[model.misc.Event]):
             )
             model.conn.add(notification)
             if config.config.email.enabled and user.details.email:
-                email_notification(
-                    host=config.config.email.smtp_server,
+                mail.enqueue(
                     body=message,
                     mime_type='plain',
                     subject=f'Riberry / {status.title()} / {execution.job.name} / execution #{execution.id}',
                     sender=config.config.email.sender,
                     recipients=[user.details.email],
+                    kind=notification_type,
+                    user=user,
                 )
 
         elif notification_type == 'workflow_started':
@@ -290,13 +239,14 @@ def handle_notifications(events: List[model.misc.Event]):
             )
             model.conn.add(notification)
             if config.config.email.enabled and user.details.email:
-                email_notification(
-                    host=config.config.email.smtp_server,
+                mail.enqueue(
                     body=message,
                     mime_type='plain',
                     subject=f'Riberry / Started / {execution.job.name} / execution #{execution.id}',
                     sender=config.config.email.sender,
                     recipients=[user.details.email],
+                    kind=notification_type,
+                    user=user,
                 )
         else:
             logger.warn(f'Received unknown notification type {notification_type}')
@@ -314,36 +264,119 @@ handlers = {
 }
 
 
-def process(event_limit=None, query_extension=None):
-    event_mapping = defaultdict(list)
-    query = model.misc.Event.query().order_by(model.misc.Event.time.asc(), model.misc.Event.id.asc())
-    if event_limit:
-        query = query.limit(event_limit)
-    if callable(query_extension):
-        query = query_extension(query)
-    events = query.all()
+def apply_handlers(events: List[model.misc.Event], stats: Optional[ProcessingStats] = None) -> List[model.misc.Event]:
+    """ Applies the given events via their handlers and returns the events which were processed. """
 
-    if not events:
-        return
+    stats = stats or ProcessingStats()
 
+    event_mapping = defaultdict(list)
     for event in events:
         event_mapping[event.name].append(event)
 
-    to_delete = []
+    index = EventIndex.build(events)
+
+    processed = []
     for handler_name, handler_func in handlers.items():
         handler_events = event_mapping[handler_name]
         if handler_events:
             try:
-                to_delete += handlers[handler_name](handler_events)
+                with stats.measure_handler(handler_name, handler_events):
+                    processed += handler_func(handler_events, index)
             except:
                 logger.warn(f'Failed to process {handler_name} events: {handler_events}')
                 raise
 
-    for event in to_delete:
-        logger.info(f'Removing processed event {event}')
-        model.conn.delete(event)
+    return processed
 
+
+def process_chunk(
+        events: List[model.misc.Event],
+        delete_chunk_size: int,
+        consumer: Optional[EventConsumer] = None,
+        stats: Optional[ProcessingStats] = None,
+) -> int:
+    """ Applies and acknowledges the given events, committing the result.
+
+    The chunk is applied within a savepoint. If it fails as a whole, each event is re-applied
+    within its own savepoint so that only the offending events are left for a later run.
+    """
+
+    consumer = consumer or SqlEventTransport().consumer()
+    stats = stats or ProcessingStats()
+    events = consumer.acquire(events)
+    if not events:
+        model.conn.rollback()
+        return 0
+
+    try:
+        with model.conn.begin_nested():
+            processed = apply_handlers(events, stats=stats)
+    except:
+        logger.warn(f'Failed to process chunk of {len(events)} events, retrying individually: '
+                    f'{traceback.format_exc()}')
+        processed = []
+        for event in events:
+            event_id = event.id
+            try:
+                with model.conn.begin_nested():
+                    if apply_handlers([event], stats=stats):
+                        processed.append(event)
+            except:
+                logger.warn(f'An error occurred processing event {event_id}: {traceback.format_exc()}')
+
+    applied = [(event.name, event.time) for event in processed]
+    deleted = consumer.acknowledge(events=processed, chunk_size=delete_chunk_size)
     model.conn.commit()
+    consumer.commit()
+    stats.applied(applied)
+    logger.debug(f'Removed {deleted} processed events')
+    return deleted
+
+
+def process(
+        event_limit=None,
+        query_extension=None,
+        commit_size=None,
+        delete_chunk_size=None,
+        partition=None,
+        partitions=None,
+        claim=None,
+        transport: Optional[EventTransport] = None,
+) -> Optional[ProcessingStats]:
+    commit_size = commit_size or config.config.background.events.commit_size
+    delete_chunk_size = delete_chunk_size or config.config.background.events.delete_chunk_size
+    transport = transport or config.config.events.transport.instance
+    consumer = transport.consumer(partition=partition, partitions=partitions, claim=claim)
+
+    stats = ProcessingStats()
+    with stats.measure():
+        events = consumer.fetch(limit=event_limit, query_extension=query_extension)
+
+        if not events:
+            return None
+
+        stats.fetched(events)
+        for events_chunk in consumer.chunks(events, commit_size):
+            stats.deleted += process_chunk(
+                events=events_chunk,
+                delete_chunk_size=delete_chunk_size,
+                consumer=consumer,
+                stats=stats,
+            )
+
+    logger.info(
+        f'Processed {stats.events} events in {stats.duration:.3f}s '
+        f'({stats.events_per_second:.1f} events/s, {stats.queries} queries, {stats.deleted} removed, '
+        f'oldest event {stats.oldest_event_age:.1f}s old, max latency {stats.latency_max:.1f}s)'
+    )
+
+    try:
+        record_stats(stats, partition=partition)
+    except:
+        model.conn.rollback()
+        logger.warn(f'Failed to record event processing statistics: {traceback.format_exc()}')
+
+    return stats
 
 
 if __name__ == '__main__':
@@ -0,0 +1,106 @@
+from typing import List, Dict, Tuple, Iterable, Optional
+
+from riberry import model
+
+IN_CLAUSE_LIMIT = 500
+
+
+def chunks(values: Iterable, size: int) -> Iterable[List]:
+    """ Splits the given values into lists of at most the given size. """
+    values = list(values)
+    for idx in range(0, len(values), size):
+        yield values[idx:idx + size]
+
+
+class EventIndex:
+    """ In-memory index of the executions, streams and steps referenced by a batch of events.
+
+    Each entity type is resolved with one `IN (...)` query (per chunk of `IN_CLAUSE_LIMIT`
+    values) so that the handlers never need to query rows individually.
+    """
+
+    def __init__(self):
+        self.executions: Dict[str, model.job.JobExecution] = {}
+        self.streams: Dict[Tuple[str, str], model.job.JobExecutionStream] = {}
+        self.streams_by_task_id: Dict[str, model.job.JobExecutionStream] = {}
+        self.steps: Dict[Tuple[model.job.JobExecutionStream, str], model.job.JobExecutionStreamStep] = {}
+
+    @classmethod
+    def build(cls, events: List[model.misc.Event]) -> 'EventIndex':
+        index = cls()
+        index.load_executions(root_ids={event.root_id for event in events})
+
+        stream_names, stream_task_ids, step_task_ids = set(), set(), set()
+        for event in events:
+            if event.name not in ('stream', 'step', 'artifact'):
+                continue
+            try:
+                stream_name = event.payload['stream']
+            except Exception:
+                continue
+            if stream_name:
+                stream_names.add(str(stream_name))
+            if event.name == 'stream':
+                stream_task_ids.add(event.task_id)
+            elif event.name == 'step':
+                step_task_ids.add(event.task_id)
+
+        index.load_streams(stream_names=stream_names, task_ids=stream_task_ids)
+        index.load_steps(task_ids=step_task_ids)
+        return index
+
+    def load_executions(self, root_ids):
+        for root_ids_chunk in chunks(root_ids, IN_CLAUSE_LIMIT):
+            for execution in model.job.JobExecution.query().filter(
+                model.job.JobExecution.task_id.in_(root_ids_chunk),
+            ).all():
+                self.executions[execution.task_id] = execution
+
+    def load_streams(self, stream_names, task_ids):
+        root_ids_by_execution_id = {execution.id: root_id for root_id, execution in self.executions.items()}
+        if stream_names:
+            for execution_ids_chunk in chunks(root_ids_by_execution_id, IN_CLAUSE_LIMIT):
+                for stream in model.job.JobExecutionStream.query().filter(
+                    model.job.JobExecutionStream.job_execution_id.in_(execution_ids_chunk),
+                    model.job.JobExecutionStream.name.in_(stream_names),
+                ).all():
+                    self.add_stream(stream=stream, root_id=root_ids_by_execution_id[stream.job_execution_id])
+
+        missing_task_ids = set(task_ids) - set(self.streams_by_task_id)
+        for task_ids_chunk in chunks(missing_task_ids, IN_CLAUSE_LIMIT):
+            for stream in model.job.JobExecutionStream.query().filter(
+                model.job.JobExecutionStream.task_id.in_(task_ids_chunk),
+            ).all():
+                self.streams_by_task_id[stream.task_id] = stream
+
+    def load_steps(self, task_ids):
+        streams_by_id = {stream.id: stream for stream in self.streams.values()}
+        if not streams_by_id:
+            return
+
+        for task_ids_chunk in chunks(task_ids, IN_CLAUSE_LIMIT):
+            for step in model.job.JobExecutionStreamStep.query().filter(
+                model.job.JobExecutionStreamStep.task_id.in_(task_ids_chunk),
+            ).all():
+                if step.stream_id in streams_by_id:
+                    self.add_step(step=step, stream=streams_by_id[step.stream_id])
+
+    def add_stream(self, stream: model.job.JobExecutionStream, root_id: str):
+        self.streams[(stream.name, root_id)] = stream
+        if stream.task_id:
+            self.streams_by_task_id[stream.task_id] = stream
+
+    def add_step(self, step: model.job.JobExecutionStreamStep, stream: model.job.JobExecutionStream):
+        self.steps[(stream, step.task_id)] = step
+
+    def execution(self, root_id: str) -> Optional[model.job.JobExecution]:
+        return self.executions.get(root_id)
+
+    def stream(self, stream_name: str, root_id: str) -> Optional[model.job.JobExecutionStream]:
+        return self.streams.get((stream_name, root_id))
+
+    def stream_by_task_id(self, task_id: str) -> Optional[model.job.JobExecutionStream]:
+        return self.streams_by_task_id.get(task_id)
+
+    def step(self, stream: model.job.JobExecutionStream, task_id: str) -> Optional[model.job.JobExecutionStreamStep]:
+        return self.steps.get((stream, task_id))
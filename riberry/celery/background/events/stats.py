@@ -0,0 +1,292 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event as sqla_event, func
+from sqlalchemy.exc import IntegrityError
+
+from riberry import model
+
+STATS_RESOURCE_NAME = 'riberry.background.events.stats'
+HISTORY_SIZE = 100
+HANDLER_NAMES = ('stream', 'step', 'artifact', 'notify')
+
+
+class HandlerStats:
+    """ Statistics gathered for a single event handler. """
+
+    def __init__(self, events=0, deleted=0, duration=0.0, latency_total=0.0, latency_max=0.0):
+        self.events = events
+        self.deleted = deleted
+        self.duration = duration
+        self.latency_total = latency_total
+        self.latency_max = latency_max
+
+    @property
+    def latency_mean(self) -> float:
+        return self.latency_total / self.deleted if self.deleted else 0.0
+
+    def applied(self, latency: float):
+        self.deleted += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def merge(self, other: 'HandlerStats'):
+        self.events += other.events
+        self.deleted += other.deleted
+        self.duration += other.duration
+        self.latency_total += other.latency_total
+        self.latency_max = max(self.latency_max, other.latency_max)
+
+    def to_dict(self) -> dict:
+        return dict(
+            events=self.events,
+            deleted=self.deleted,
+            duration=self.duration,
+            latency_total=self.latency_total,
+            latency_max=self.latency_max,
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'HandlerStats':
+        return cls(**data)
+
+
+class ProcessingStats:
+    """ Statistics gathered while processing a single batch of events. """
+
+    def __init__(self):
+        self.events = 0
+        self.deleted = 0
+        self.queries = 0
+        self.duration = 0.0
+        self.started = time.time()
+        self.oldest_event_age = 0.0
+        self.handlers: Dict[str, HandlerStats] = {name: HandlerStats() for name in HANDLER_NAMES}
+
+    @property
+    def events_per_second(self) -> float:
+        return self.events / self.duration if self.duration else 0.0
+
+    @property
+    def latency_max(self) -> float:
+        return max((handler.latency_max for handler in self.handlers.values()), default=0.0)
+
+    @property
+    def latency_mean(self) -> float:
+        deleted = sum(handler.deleted for handler in self.handlers.values())
+        return sum(handler.latency_total for handler in self.handlers.values()) / deleted if deleted else 0.0
+
+    def __repr__(self):
+        return (
+            f'ProcessingStats(events={self.events}, deleted={self.deleted}, queries={self.queries}, '
+            f'duration={self.duration:.4f}, events_per_second={self.events_per_second:.1f})'
+        )
+
+    def handler(self, name: str) -> HandlerStats:
+        if name not in self.handlers:
+            self.handlers[name] = HandlerStats()
+        return self.handlers[name]
+
+    def fetched(self, events: List[model.misc.Event]):
+        self.events = len(events)
+        if events:
+            self.oldest_event_age = max(0.0, time.time() - min(event.time for event in events))
+
+    def applied(self, events: List[Tuple[str, float]]):
+        """ Records the end-to-end latency of the given (name, time) events, which have just been committed. """
+
+        now = time.time()
+        for name, event_time in events:
+            self.handler(name).applied(latency=max(0.0, now - event_time))
+
+    def to_dict(self) -> dict:
+        return dict(
+            started=self.started,
+            events=self.events,
+            deleted=self.deleted,
+            queries=self.queries,
+            duration=self.duration,
+            oldest_event_age=self.oldest_event_age,
+            latency_mean=self.latency_mean,
+            latency_max=self.latency_max,
+            handlers={name: handler.to_dict() for name, handler in self.handlers.items()},
+        )
+
+    @contextmanager
+    def measure(self):
+        """ Times the enclosed block and counts the queries it issues on the current thread. """
+
+        thread_id = threading.get_ident()
+
+        # noinspection PyUnusedLocal
+        def before_cursor_execute(*args, **kwargs):
+            if threading.get_ident() == thread_id:
+                self.queries += 1
+
+        engine = model.conn.raw_engine
+        sqla_event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        start_time = time.time()
+        try:
+            yield self
+        finally:
+            self.duration += time.time() - start_time
+            sqla_event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    @contextmanager
+    def measure_handler(self, name: str, events: List[model.misc.Event]):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            handler = self.handler(name)
+            handler.events += len(events)
+            handler.duration += time.time() - start_time
+
+
+def _resource_name(partition: int) -> str:
+    return f'{STATS_RESOURCE_NAME}.{partition}'
+
+
+def _resource_query(partition: int, resource_id: Optional[int]):
+    return model.misc.ResourceData.query().filter_by(
+        resource_type=model.misc.ResourceType.misc,
+        resource_id=resource_id,
+        name=_resource_name(partition),
+    )
+
+
+def _locked_resource(partition: int) -> model.misc.ResourceData:
+    """ Returns the partition's statistics row, locked until the session's transaction ends.
+
+    Rows are keyed by their partition, so that the unique constraint prevents concurrent processors
+    from creating duplicates. Rows recorded before they were keyed (with a null resource id) are
+    adopted in place.
+    """
+
+    resource = _resource_query(partition, resource_id=partition).with_for_update().first()
+    if resource is None:
+        resource = _resource_query(partition, resource_id=None).with_for_update().first()
+        if resource is not None:
+            resource.resource_id = partition
+    if resource is None:
+        resource = model.misc.ResourceData(
+            resource_type=model.misc.ResourceType.misc,
+            resource_id=partition,
+            name=_resource_name(partition),
+        )
+        model.conn.add(resource)
+    return resource
+
+
+def record(stats: ProcessingStats, partition: Optional[int] = None, attempts: int = 2):
+    """ Persists the given run's statistics alongside the running totals for its partition. """
+
+    partition = partition or 0
+    for attempt in range(attempts):
+        resource = _locked_resource(partition)
+        value = resource.value or {}
+        totals = {
+            handler_name: HandlerStats.from_dict(data) for handler_name, data in (value.get('totals') or {}).items()
+        }
+        for handler_name, handler in stats.handlers.items():
+            totals.setdefault(handler_name, HandlerStats()).merge(handler)
+
+        resource.value = dict(
+            runs=value.get('runs', 0) + 1,
+            totals={handler_name: handler.to_dict() for handler_name, handler in totals.items()},
+            history=(value.get('history') or [])[-(HISTORY_SIZE - 1):] + [stats.to_dict()],
+        )
+        try:
+            model.conn.commit()
+            return
+        except IntegrityError:
+            # another processor created the partition's row first
+            model.conn.rollback()
+            if attempt == attempts - 1:
+                raise
+
+
+def pending() -> dict:
+    """ Returns the number of events in the event table and the age of the oldest. """
+
+    count, oldest = model.conn.query(func.count(model.misc.Event.id), func.min(model.misc.Event.time)).one()
+    return dict(count=count, oldest_event_age=max(0.0, time.time() - oldest) if oldest is not None else 0.0)
+
+
+def summary() -> dict:
+    """ Returns the recorded event processing statistics, merged across partitions.
+
+    The returned dict contains:
+        runs:    total number of recorded runs
+        pending: live count and oldest-event age of the event table
+        totals:  per-handler totals (events, deleted, duration, latency_total, latency_max)
+        last:    the most recent run of each partition, keyed by partition
+    """
+
+    resources = model.misc.ResourceData.query().filter(
+        model.misc.ResourceData.resource_type == model.misc.ResourceType.misc,
+        model.misc.ResourceData.name.like(f'{STATS_RESOURCE_NAME}.%'),
+    ).all()
+
+    runs, totals, last = 0, {}, {}
+    for resource in resources:
+        value = resource.value or {}
+        runs += value.get('runs', 0)
+        for handler_name, data in (value.get('totals') or {}).items():
+            totals.setdefault(handler_name, HandlerStats()).merge(HandlerStats.from_dict(data))
+        if value.get('history'):
+            last[resource.name[len(STATS_RESOURCE_NAME) + 1:]] = value['history'][-1]
+
+    return dict(
+        runs=runs,
+        pending=pending(),
+        totals={handler_name: handler.to_dict() for handler_name, handler in totals.items()},
+        last=last,
+    )
+
+
+def history(partition: Optional[int] = None) -> List[dict]:
+    """ Returns up to the last `HISTORY_SIZE` recorded runs for the given partition, oldest first. """
+
+    partition = partition or 0
+    resource = _resource_query(partition, resource_id=partition).first() or \
+        _resource_query(partition, resource_id=None).first()
+    return list((resource.value or {}).get('history') or []) if resource else []
+
+
+def to_prometheus(stats_summary: dict) -> str:
+    """ Renders the given summary in the Prometheus text exposition format. """
+
+    lines = []
+
+    def metric(name, metric_type, help_text, samples):
+        lines.append(f'# HELP riberry_events_{name} {help_text}')
+        lines.append(f'# TYPE riberry_events_{name} {metric_type}')
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f'riberry_events_{name}{{{label_text}}} {value}' if label_text
+                         else f'riberry_events_{name} {value}')
+
+    totals, last = stats_summary['totals'], stats_summary['last']
+    metric('pending', 'gauge', 'Number of events waiting to be processed.',
+           [({}, stats_summary['pending']['count'])])
+    metric('oldest_pending_age_seconds', 'gauge', 'Age of the oldest event waiting to be processed.',
+           [({}, stats_summary['pending']['oldest_event_age'])])
+    metric('runs_total', 'counter', 'Number of processing runs.', [({}, stats_summary['runs'])])
+    metric('handled_total', 'counter', 'Number of events passed to each handler.',
+           [({'handler': name}, data['events']) for name, data in totals.items()])
+    metric('deleted_total', 'counter', 'Number of events applied and removed by each handler.',
+           [({'handler': name}, data['deleted']) for name, data in totals.items()])
+    metric('handler_seconds_total', 'counter', 'Time spent within each handler.',
+           [({'handler': name}, data['duration']) for name, data in totals.items()])
+    metric('latency_seconds_total', 'counter', 'Sum of the time from event creation until it was applied.',
+           [({'handler': name}, data['latency_total']) for name, data in totals.items()])
+    metric('last_run_batch_size', 'gauge', 'Number of events fetched by the last run.',
+           [({'partition': partition}, run['events']) for partition, run in last.items()])
+    metric('last_run_duration_seconds', 'gauge', 'Duration of the last run.',
+           [({'partition': partition}, run['duration']) for partition, run in last.items()])
+    metric('last_run_latency_max_seconds', 'gauge', 'Maximum latency of the events applied by the last run.',
+           [({'partition': partition}, run['latency_max']) for partition, run in last.items()])
+    return '\n'.join(lines) + '\n'
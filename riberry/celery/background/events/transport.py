@@ -0,0 +1,357 @@
+import time
+import zlib
+from typing import List, Dict, Iterable, Optional
+
+import redis
+from celery.utils.log import logger
+from sqlalchemy.orm import Query
+
+from riberry import model, config
+from . import wakeup
+from .claim import EventClaim
+from .index import chunks
+
+
+def delete_events(event_ids: List[int], chunk_size: int) -> int:
+    """ Deletes the given events using set-based DELETE statements of at most `chunk_size` ids. """
+
+    deleted = 0
+    for event_ids_chunk in chunks(event_ids, chunk_size):
+        deleted += model.misc.Event.query().filter(
+            model.misc.Event.id.in_(event_ids_chunk)
+        ).delete(synchronize_session=False)
+    return deleted
+
+
+class EventConsumer:
+    """ Reads events from a transport on behalf of a single event processor. """
+
+    def fetch(self, limit: Optional[int] = None, query_extension=None) -> List[model.misc.Event]:
+        raise NotImplementedError
+
+    def chunks(self, events: List[model.misc.Event], size: int) -> Iterable[List[model.misc.Event]]:
+        return chunks(events, size)
+
+    def acquire(self, events: List[model.misc.Event]) -> List[model.misc.Event]:
+        """ Claims the given events before they are applied. """
+        return events
+
+    def acknowledge(self, events: List[model.misc.Event], chunk_size: int) -> int:
+        """ Marks the given events as processed within the current database transaction. """
+        raise NotImplementedError
+
+    def commit(self):
+        """ Called once the database transaction containing the acknowledged events has been committed. """
+        pass
+
+
+class EventTransport:
+    """ Carries events from the workers which create them to the background event processor. """
+
+    name = None
+
+    def __init__(self, config_dict=None):
+        self.raw_config = config_dict or {}
+
+    def publish(self, events: List[dict]):
+        """ Publishes the given events, each a dict of `model.misc.Event` column values. """
+        raise NotImplementedError
+
+    def consumer(self, partition=None, partitions=None, claim=None) -> EventConsumer:
+        raise NotImplementedError
+
+
+class SqlEventConsumer(EventConsumer):
+
+    def __init__(self, claim: EventClaim):
+        self.claim = claim
+
+    def fetch(self, limit: Optional[int] = None, query_extension=None) -> List[model.misc.Event]:
+        query: Query = model.misc.Event.query().order_by(model.misc.Event.time.asc(), model.misc.Event.id.asc())
+        query = self.claim.filter(query)
+        if limit:
+            query = query.limit(limit)
+        if callable(query_extension):
+            query = query_extension(query)
+        return query.all()
+
+    def chunks(self, events: List[model.misc.Event], size: int) -> Iterable[List[model.misc.Event]]:
+        return self.claim.chunks(events, size)
+
+    def acquire(self, events: List[model.misc.Event]) -> List[model.misc.Event]:
+        return self.claim.acquire(events)
+
+    def acknowledge(self, events: List[model.misc.Event], chunk_size: int) -> int:
+        return delete_events(event_ids=[event.id for event in events], chunk_size=chunk_size)
+
+
+class SqlEventTransport(EventTransport):
+    """ Stores events in the `event` table, from which they are deleted once processed. """
+
+    name = 'sql'
+
+    def publish(self, events: List[dict]):
+        model.conn.execute(model.misc.Event.__table__.insert(), events)
+        wakeup.notify()
+        model.conn.commit()
+
+    def consumer(self, partition=None, partitions=None, claim=None) -> EventConsumer:
+        return SqlEventConsumer(claim=EventClaim(partition=partition, partitions=partitions, mode=claim))
+
+
+class MergedEventConsumer(EventConsumer):
+    """ Reads the events of several consumers in a single pass, ordered by their time.
+
+    When a consumer returns a full batch, only the events up to its latest event are returned, as
+    its remaining events may be older than those of the other consumers. The rest are left for the
+    next fetch.
+    """
+
+    def __init__(self, consumers: List[EventConsumer]):
+        self.consumers = consumers
+        self.sources: Dict[model.misc.Event, EventConsumer] = {}
+
+    def fetch(self, limit: Optional[int] = None, query_extension=None) -> List[model.misc.Event]:
+        self.sources, cutoff = {}, None
+        for consumer in self.consumers:
+            events = consumer.fetch(limit=limit, query_extension=query_extension)
+            if limit and len(events) >= limit:
+                cutoff = min(events[-1].time, cutoff if cutoff is not None else events[-1].time)
+            self.sources.update(dict.fromkeys(events, consumer))
+
+        return sorted(
+            (event for event in self.sources if cutoff is None or event.time <= cutoff),
+            key=lambda e: e.time,
+        )
+
+    def _by_source(self, events: List[model.misc.Event]) -> Dict[EventConsumer, List[model.misc.Event]]:
+        by_source = {consumer: [] for consumer in self.consumers}
+        for event in events:
+            by_source[self.sources[event]].append(event)
+        return by_source
+
+    def acquire(self, events: List[model.misc.Event]) -> List[model.misc.Event]:
+        acquired = []
+        for consumer, source_events in self._by_source(events).items():
+            acquired += consumer.acquire(source_events) if source_events else []
+        return sorted(acquired, key=lambda e: e.time)
+
+    def acknowledge(self, events: List[model.misc.Event], chunk_size: int) -> int:
+        return sum(
+            consumer.acknowledge(source_events, chunk_size=chunk_size)
+            for consumer, source_events in self._by_source(events).items()
+            if source_events
+        )
+
+    def commit(self):
+        for consumer in self.consumers:
+            consumer.commit()
+
+
+class FallbackEventConsumer(SqlEventConsumer):
+    """ Reads the events stored in the event table after they could not be published to Redis.
+
+    The events are split across partitions in the same way as the Redis streams, so that the
+    events of an execution are read by the same processor from both.
+    """
+
+    def __init__(self, transport: 'RedisEventTransport', partition: int, partitions: int):
+        super().__init__(claim=EventClaim())
+        self.transport = transport
+        self.partition = partition
+        self.partitions = partitions
+
+    def fetch(self, limit: Optional[int] = None, query_extension=None) -> List[model.misc.Event]:
+        return [
+            event for event in super().fetch(limit=limit, query_extension=query_extension)
+            if self.transport.partition(event.root_id, self.partitions) == self.partition
+        ]
+
+
+class RedisEventConsumer(EventConsumer):
+
+    def __init__(self, transport: 'RedisEventTransport', stream: str, consumer_name: str):
+        self.transport = transport
+        self.stream = stream
+        self.consumer_name = consumer_name
+        self.message_ids: Dict[model.misc.Event, bytes] = {}
+        self.acknowledged: List[bytes] = []
+
+    def fetch(self, limit: Optional[int] = None, query_extension=None) -> List[model.misc.Event]:
+        """ Reads some of this consumer's pending (previously unacknowledged) messages followed by new messages.
+
+        At most `pending_read_count` pending messages are re-read per fetch, resuming after the last
+        one re-read, so that messages which keep failing can't prevent new messages from being read.
+        """
+
+        self.transport.ensure_group(self.stream)
+        limit = limit or self.transport.read_count
+        pending_limit = min(limit, self.transport.pending_read_count)
+        cursor = self.transport.pending_cursors.get(self.stream, b'0')
+        messages = self._read(cursor, pending_limit) if pending_limit else []
+        self.transport.pending_cursors[self.stream] = (
+            messages[-1][0] if messages and len(messages) == pending_limit else b'0'
+        )
+        if len(messages) < limit:
+            messages += self._read('>', limit - len(messages))
+
+        self.message_ids = {}
+        for message_id, fields in messages:
+            if not fields:
+                # deleted whilst pending
+                self.acknowledged.append(message_id)
+                continue
+            self.message_ids[self.transport.decode(fields)] = message_id
+
+        self.commit()
+        return sorted(self.message_ids, key=lambda e: e.time)
+
+    def _read(self, message_id, count):
+        response = self.transport.connection.xreadgroup(
+            groupname=self.transport.group,
+            consumername=self.consumer_name,
+            streams={self.stream: message_id},
+            count=count,
+        )
+        return [message for _, stream_messages in response for message in stream_messages]
+
+    def acknowledge(self, events: List[model.misc.Event], chunk_size: int) -> int:
+        self.acknowledged += [self.message_ids[event] for event in events]
+        return len(events)
+
+    def commit(self):
+        if not self.acknowledged:
+            return
+
+        with self.transport.connection.pipeline(transaction=False) as pipeline:
+            for message_ids_chunk in chunks(self.acknowledged, self.transport.read_count):
+                pipeline.xack(self.stream, self.transport.group, *message_ids_chunk)
+                pipeline.xdel(self.stream, *message_ids_chunk)
+            pipeline.execute()
+        self.acknowledged = []
+
+
+class RedisEventTransport(EventTransport):
+    """ Publishes events to Redis Streams, which the event processor reads via a consumer group.
+
+    Events are spread across partitioned streams by their `root_id` so that each partition, and
+    therefore each execution, is read by a single consumer in order. The processors record the
+    number of partitions they read in Redis, which publishers follow (falling back to their own
+    `background.events.partitions` until it has been recorded). Messages are acknowledged and
+    deleted once the changes they produced have been committed, so a crashed processor re-reads
+    its pending messages on its next run.
+
+    Events which could not be published are stored in the event table, which the processors read
+    in the same pass as their stream.
+    """
+
+    name = 'redis'
+
+    TEXT_FIELDS = ('name', 'root_id', 'task_id', 'data')
+
+    def __init__(self, config_dict=None, connection: Optional[redis.Redis] = None):
+        super().__init__(config_dict=config_dict)
+        self.url = self.raw_config.get('url') or config.config.celery.get('broker_url') or 'redis://'
+        self.stream = self.raw_config.get('stream', 'riberry:events')
+        self.group = self.raw_config.get('group', 'riberry.background.events')
+        self.max_length = self.raw_config.get('maxLength')
+        self.read_count = self.raw_config.get('readCount', 1000)
+        self.pending_read_count = self.raw_config.get('pendingReadCount', max(self.read_count // 10, 1))
+        self.pending_cursors: Dict[str, bytes] = {}
+        self.partitions_ttl = self.raw_config.get('partitionsTtl', 10.0)
+        self._connection = connection
+        self._groups = set()
+        self._partitions = None
+
+    @property
+    def connection(self) -> redis.Redis:
+        if self._connection is None:
+            self._connection = redis.Redis.from_url(self.url)
+        return self._connection
+
+    def stream_name(self, partition: int, partitions: int) -> str:
+        return self.stream if partitions <= 1 else f'{self.stream}:{partition}'
+
+    def partition(self, root_id: str, partitions: int) -> int:
+        return zlib.crc32(root_id.encode()) % partitions if partitions > 1 else 0
+
+    @property
+    def partitions_key(self) -> str:
+        return f'{self.stream}:partitions'
+
+    def register_partitions(self, partitions: int):
+        """ Records the number of partitions read by the processors, which publishers follow. """
+
+        previous = self.connection.getset(self.partitions_key, partitions)
+        if previous is not None and int(previous) != partitions:
+            logger.warn(f'RedisEventTransport:: events repartitioned from {int(previous)} to {partitions} '
+                        f'partitions, events left in the streams of the previous partitions are not read')
+
+    def published_partitions(self) -> int:
+        """ Returns the number of partitions recorded by the processors, re-read every `partitions_ttl` seconds. """
+
+        now = time.time()
+        if self._partitions is not None and now - self._partitions[1] < self.partitions_ttl:
+            return self._partitions[0]
+
+        configured = config.config.background.events.partitions
+        recorded = self.connection.get(self.partitions_key)
+        partitions = int(recorded) if recorded is not None else configured
+        if partitions != configured and (self._partitions is None or self._partitions[0] != partitions):
+            logger.warn(f'RedisEventTransport:: publishing to the {partitions} partitions read by the event '
+                        f'processors rather than the configured {configured}')
+        self._partitions = partitions, now
+        return partitions
+
+    def ensure_group(self, stream: str):
+        if stream in self._groups:
+            return
+        try:
+            self.connection.xgroup_create(name=stream, groupname=self.group, id='0', mkstream=True)
+        except redis.ResponseError as exc:
+            if 'BUSYGROUP' not in str(exc):
+                raise
+        self._groups.add(stream)
+
+    @classmethod
+    def encode(cls, event: dict) -> dict:
+        fields = {key: event[key] for key in cls.TEXT_FIELDS if event.get(key) is not None}
+        fields['time'] = repr(float(event['time']))
+        if event.get('binary') is not None:
+            fields['binary'] = event['binary']
+        return fields
+
+    @classmethod
+    def decode(cls, fields: dict) -> model.misc.Event:
+        fields = {key.decode(): value for key, value in fields.items()}
+        return model.misc.Event(
+            time=float(fields['time']),
+            binary=fields.get('binary'),
+            **{key: fields[key].decode() for key in cls.TEXT_FIELDS if key in fields},
+        )
+
+    def publish(self, events: List[dict]):
+        partitions = self.published_partitions()
+        with self.connection.pipeline(transaction=False) as pipeline:
+            for event in events:
+                stream = self.stream_name(self.partition(event['root_id'], partitions), partitions)
+                pipeline.xadd(stream, self.encode(event), maxlen=self.max_length, approximate=True)
+            pipeline.execute()
+
+    def consumer(self, partition=None, partitions=None, claim=None) -> EventConsumer:
+        partition, partitions = partition or 0, partitions or 1
+        self.register_partitions(partitions)
+        return MergedEventConsumer([
+            RedisEventConsumer(
+                transport=self,
+                stream=self.stream_name(partition, partitions),
+                consumer_name=f'processor-{partition}',
+            ),
+            FallbackEventConsumer(transport=self, partition=partition, partitions=partitions),
+        ])
+
+
+transports = {
+    SqlEventTransport.name: SqlEventTransport,
+    RedisEventTransport.name: RedisEventTransport,
+}
@@ -0,0 +1,154 @@
+import select
+import socket
+from typing import Optional
+
+from celery.utils.log import logger
+from sqlalchemy import text
+
+from riberry import model, config
+
+NOTIFY_CHANNEL = 'riberry_events'
+
+# publishers don't know how many partitions the daemons were started with, so notify at least this many
+MIN_NOTIFY_PARTITIONS = 16
+
+
+class Wakeup:
+    """ Wakes idle event daemons as soon as new events are published. """
+
+    def notify(self):
+        """ Signals that events have been published, called within the publishing transaction. """
+        pass
+
+    def wait(self, timeout: float) -> bool:
+        """ Blocks for up to `timeout` seconds, returning True if woken by a notification. """
+        select.select([], [], [], timeout)
+        return False
+
+    def close(self):
+        pass
+
+
+class SocketWakeup(Wakeup):
+    """ Wakes daemons running on the local host via UDP datagrams, one port per partition. """
+
+    def __init__(self, port: int, partition: Optional[int] = None, partitions: Optional[int] = None):
+        self.port = port
+        self.partition = partition or 0
+        self.partitions = partitions or 1
+        self._socket: Optional[socket.socket] = None
+        self._sender: Optional[socket.socket] = None
+
+    @property
+    def address(self):
+        return '127.0.0.1', self.port + self.partition
+
+    def notify(self):
+        if self._sender is None:
+            self._sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sender.setblocking(False)
+        for partition in range(self.partitions):
+            try:
+                self._sender.sendto(b'\x01', ('127.0.0.1', self.port + partition))
+            except OSError:
+                pass
+
+    def wait(self, timeout: float) -> bool:
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.bind(self.address)
+            self._socket.setblocking(False)
+
+        readable, _, _ = select.select([self._socket], [], [], timeout)
+        if not readable:
+            return False
+        self._drain()
+        return True
+
+    def _drain(self):
+        while True:
+            try:
+                self._socket.recv(64)
+            except (BlockingIOError, InterruptedError):
+                return
+
+    def close(self):
+        for sock in (self._socket, self._sender):
+            if sock is not None:
+                sock.close()
+        self._socket = self._sender = None
+
+
+class PostgresWakeup(Wakeup):
+    """ Wakes daemons via LISTEN/NOTIFY, delivered once the publishing transaction commits. """
+
+    def __init__(self, channel: str = NOTIFY_CHANNEL):
+        self.channel = channel
+        self._connection = None
+
+    def notify(self):
+        model.conn.execute(text(f'NOTIFY {self.channel}'))
+
+    def wait(self, timeout: float) -> bool:
+        if self._connection is None:
+            # a dedicated connection, as switching a pooled connection to autocommit would leak into later sessions
+            self._connection = model.conn.raw_engine.pool._creator()
+            self._connection.set_isolation_level(0)
+            cursor = self._connection.cursor()
+            cursor.execute(f'LISTEN {self.channel}')
+            cursor.close()
+
+        connection = self._connection
+        if not connection.notifies:
+            readable, _, _ = select.select([connection], [], [], timeout)
+            if not readable:
+                return False
+            connection.poll()
+        notified = bool(connection.notifies)
+        connection.notifies.clear()
+        return notified
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                logger.exception('PostgresWakeup:: failed to close listening connection')
+            self._connection = None
+
+
+def create(partition: Optional[int] = None, partitions: Optional[int] = None, publisher: bool = False) -> Wakeup:
+    """ Returns the wakeup mechanism suited to the configured database and transport.
+
+    Publishers notify regardless of whether the daemon is enabled in their own config, as the
+    daemons may have been enabled on the command line (e.g. `riberry run core --event-daemon`).
+    """
+
+    daemon_config = config.config.background.events.daemon
+    if not (daemon_config.enabled or publisher) or not daemon_config.notify or \
+            config.config.events.transport.type != 'sql':
+        return Wakeup()
+
+    dialect = model.conn.raw_engine.dialect
+    if dialect.name == 'postgresql' and dialect.driver == 'psycopg2':
+        return PostgresWakeup()
+    if dialect.name == 'sqlite':
+        partitions = partitions or config.config.background.events.partitions
+        return SocketWakeup(
+            port=daemon_config.notify_port,
+            partition=partition,
+            partitions=max(partitions, MIN_NOTIFY_PARTITIONS) if publisher else partitions,
+        )
+    return Wakeup()
+
+
+_publisher: Optional[Wakeup] = None
+
+
+def notify():
+    """ Notifies event daemons of newly published events, if enabled. """
+
+    global _publisher
+    if _publisher is None:
+        _publisher = create(publisher=True)
+    _publisher.notify()
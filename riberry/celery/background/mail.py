@@ -0,0 +1,233 @@
+import json
+import smtplib
+import traceback
+from collections import OrderedDict
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import List, Optional, Callable
+
+import pendulum
+from celery.utils.log import logger
+
+from riberry import model, config
+
+DIGEST_KINDS = ('workflow_started', 'workflow_complete')
+MAX_RETRY_DELAY = 3600
+
+
+def enqueue(
+        body: str,
+        mime_type: str,
+        subject: str,
+        sender: str,
+        recipients: List[str],
+        kind: str = 'custom',
+        user: Optional['model.auth.User'] = None,
+) -> Optional[model.misc.OutboundEmail]:
+    """ Queues an email to be sent by the background mail sender within the current transaction.
+
+    Subjects longer than the `outbound_email` column are truncated. Emails whose sender or recipients
+    don't fit are logged and dropped rather than failing the transaction they're queued in.
+    """
+
+    if not recipients:
+        logger.warn('Attempted to send email notification with no recipients provided.')
+        return None
+
+    columns = model.misc.OutboundEmail.__table__.c
+    raw_recipients = json.dumps(list(recipients))
+    if len(sender) > columns.sender.type.length or len(raw_recipients) > columns.recipients.type.length:
+        logger.error(f'Dropping email {subject!r}: its sender or recipients exceed '
+                     f'{columns.sender.type.length} or {columns.recipients.type.length} characters')
+        return None
+    if len(subject) > columns.subject.type.length:
+        logger.warn(f'Truncating subject of email {subject!r} to {columns.subject.type.length} characters')
+        subject = subject[:columns.subject.type.length - 3] + '...'
+
+    email = model.misc.OutboundEmail(
+        kind=kind,
+        user=user,
+        sender=sender,
+        recipients=recipients,
+        subject=subject,
+        body=body,
+        mime_type=mime_type,
+    )
+    model.conn.add(email)
+    return email
+
+
+class OutgoingMessage:
+    """ A single message to send, made up of one or more (digested) queued emails. """
+
+    def __init__(self, emails: List[model.misc.OutboundEmail], subject: str, body: str, mime_type: str):
+        self.emails = emails
+        self.sender = emails[0].sender
+        self.recipients = emails[0].recipients
+        self.subject = subject
+        self.body = body
+        self.mime_type = mime_type
+
+    @classmethod
+    def single(cls, email: model.misc.OutboundEmail) -> 'OutgoingMessage':
+        return cls(emails=[email], subject=email.subject, body=email.body, mime_type=email.mime_type)
+
+    @classmethod
+    def digest(cls, emails: List[model.misc.OutboundEmail]) -> 'OutgoingMessage':
+        if len(emails) == 1:
+            return cls.single(emails[0])
+        return cls(
+            emails=emails,
+            subject=f'Riberry / {len(emails)} execution updates',
+            body='\n'.join(email.body for email in emails),
+            mime_type='plain',
+        )
+
+    def as_string(self) -> str:
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = self.subject
+        msg['From'] = self.sender
+        msg['To'] = ', '.join(self.recipients)
+        msg.attach(MIMEText(self.body, self.mime_type))
+        return msg.as_string()
+
+
+class MailSender:
+    """ Sends queued emails, reusing each SMTP connection for up to `batch_size` messages.
+
+    Messages which fail to send are retried with exponential backoff, starting at `retry_delay`
+    seconds, and marked as FAILED after `max_attempts` attempts. If `digest` is enabled,
+    pending workflow started/complete emails for the same user are combined into one message.
+    """
+
+    def __init__(
+            self,
+            host: str,
+            batch_size: int = 50,
+            max_attempts: int = 5,
+            retry_delay: float = 30,
+            digest: bool = False,
+            smtp_factory: Callable[[str], smtplib.SMTP] = smtplib.SMTP,
+    ):
+        self.host = host
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.digest = digest
+        self.smtp_factory = smtp_factory
+
+    @classmethod
+    def from_config(cls, email_config: 'config.EmailNotificationConfig', **kwargs) -> 'MailSender':
+        return cls(
+            host=email_config.smtp_server,
+            batch_size=email_config.batch_size,
+            max_attempts=email_config.max_attempts,
+            retry_delay=email_config.retry_delay,
+            digest=email_config.digest,
+            **kwargs,
+        )
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.retry_delay * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+    def due(self, limit: Optional[int] = None) -> List[model.misc.OutboundEmail]:
+        query = model.misc.OutboundEmail.query().filter(
+            model.misc.OutboundEmail.status == 'PENDING',
+            model.misc.OutboundEmail.next_attempt <= pendulum.DateTime.utcnow(),
+        ).order_by(model.misc.OutboundEmail.id.asc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
+    def messages(self, emails: List[model.misc.OutboundEmail]) -> List[OutgoingMessage]:
+        if not self.digest:
+            return [OutgoingMessage.single(email) for email in emails]
+
+        messages, digests = [], OrderedDict()
+        for email in emails:
+            if email.kind in DIGEST_KINDS and email.user_id is not None:
+                digests.setdefault((email.user_id, email.sender, email.raw_recipients), []).append(email)
+            else:
+                messages.append(OutgoingMessage.single(email))
+        return [OutgoingMessage.digest(digest_emails) for digest_emails in digests.values()] + messages
+
+    def send(self, limit: Optional[int] = None) -> int:
+        """ Sends the emails which are due and returns the number of messages sent. """
+
+        messages = self.messages(self.due(limit=limit))
+        sent, connection, connection_sent = 0, None, 0
+
+        try:
+            for index, message in enumerate(messages):
+                try:
+                    if connection is None or connection_sent >= self.batch_size:
+                        self._close(connection)
+                        connection, connection_sent = None, 0
+                        try:
+                            connection = self.smtp_factory(self.host)
+                        except Exception:
+                            # the server is unreachable, so don't pay the connect timeout for every message
+                            self._failed(message, traceback.format_exc())
+                            self._deferred(messages[index + 1:])
+                            model.conn.commit()
+                            break
+                    connection.sendmail(message.sender, message.recipients, message.as_string())
+                    connection_sent += 1
+                except Exception:
+                    self._close(connection)
+                    connection = None
+                    self._failed(message, traceback.format_exc())
+                else:
+                    sent += 1
+                    for email in message.emails:
+                        model.conn.delete(email)
+                model.conn.commit()
+        finally:
+            self._close(connection)
+
+        if messages:
+            logger.info(f'Sent {sent} of {len(messages)} queued email messages')
+        return sent
+
+    def _failed(self, message: OutgoingMessage, error: str):
+        for email in message.emails:
+            email.attempts += 1
+            email.error = error[-1024:]
+            if email.attempts >= self.max_attempts:
+                email.status = 'FAILED'
+                logger.error(f'Giving up on email {email.subject!r} after {email.attempts} attempts: {error}')
+            else:
+                email.next_attempt = pendulum.DateTime.utcnow().add(seconds=self.backoff(email.attempts))
+                logger.warn(f'Failed to send email {email.subject!r} (attempt {email.attempts}), '
+                            f'retrying in {self.backoff(email.attempts)}s: {error}')
+
+    def _deferred(self, messages: List[OutgoingMessage]):
+        """ Postpones the given messages by `retry_delay` seconds, without counting an attempt. """
+
+        if not messages:
+            return
+
+        next_attempt = pendulum.DateTime.utcnow().add(seconds=self.retry_delay)
+        for message in messages:
+            for email in message.emails:
+                email.next_attempt = next_attempt
+        logger.warn(f'Could not connect to {self.host}, deferring {len(messages)} email messages '
+                    f'by {self.retry_delay}s')
+
+    @staticmethod
+    def _close(connection: Optional[smtplib.SMTP]):
+        if connection is None:
+            return
+        try:
+            connection.quit()
+        except Exception:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+
+def send_queued(limit: Optional[int] = None, **kwargs) -> int:
+    if not config.config.email.enabled:
+        return 0
+    return MailSender.from_config(config.config.email, **kwargs).send(limit=limit)
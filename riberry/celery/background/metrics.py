@@ -1,13 +1,24 @@
-from collections import defaultdict, namedtuple
-from typing import List, DefaultDict
+import calendar
+from collections import namedtuple
+from datetime import datetime, timezone
+from typing import List, Dict, Optional, Iterable, Tuple
 
 import pendulum
-from sqlalchemy import func
-from sqlalchemy.orm import Query
+from sqlalchemy import func, or_, and_, Float, Integer
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Query, undefer
+from sqlalchemy.sql.expression import FunctionElement
 
 from celery.utils.log import logger
 import riberry
+from riberry.celery.background.events.index import chunks, IN_CLAUSE_LIMIT
 from riberry.model.job import JobExecutionMetric, JobExecutionStreamStep, JobExecutionStream, Job, JobExecution
+from riberry.util.sketch import LogHistogram
+
+WATERMARK_RESOURCE_NAME = 'riberry.background.metrics.watermark'
+
+ENGINE_PYTHON = 'python'
+ENGINE_SQL = 'sql'
 
 MetricKey = namedtuple('MetricKey', [
     'epoch_start',
@@ -17,26 +28,203 @@ MetricKey = namedtuple('MetricKey', [
     'step_name',
 ])
 
+StepRow = namedtuple('StepRow', [
+    'id',
+    'step_name',
+    'started',
+    'completed',
+    'stream_name',
+    'job_execution_id',
+    'form_id',
+])
+
+
+Aggregate = namedtuple('Aggregate', [
+    'form_id',
+    'count',
+    'sum_duration',
+    'min_duration',
+    'max_duration',
+    'last',
+    'sketch',
+])
+
+
+class epoch(FunctionElement):
+    """ The POSIX timestamp of the given datetime column. """
+    type = Float()
+    name = 'epoch'
+
+
+class epoch_bucket(FunctionElement):
+    """ The POSIX timestamp of the given datetime column, rounded down to a multiple of the given interval. """
+    type = Integer()
+    name = 'epoch_bucket'
+
+    def __init__(self, column, interval: int):
+        self.interval = int(interval)
+        super().__init__(column)
+
+
+@compiles(epoch)
+def _compile_epoch(element, compiler, **kw):
+    return f'EXTRACT(EPOCH FROM {compiler.process(element.clauses, **kw)})'
+
+
+@compiles(epoch, 'sqlite')
+def _compile_epoch_sqlite(element, compiler, **kw):
+    # datetimes are stored as 'YYYY-MM-DD HH:MM:SS.ffffff' strings, the fraction is added separately to keep
+    # microsecond precision (julianday() loses precision)
+    column = compiler.process(element.clauses, **kw)
+    return f"(CAST(strftime('%s', {column}) AS INTEGER) + CAST(substr({column}, 20) AS REAL))"
+
+
+@compiles(epoch, 'mysql')
+def _compile_epoch_mysql(element, compiler, **kw):
+    return f'UNIX_TIMESTAMP({compiler.process(element.clauses, **kw)})'
+
+
+@compiles(epoch_bucket)
+def _compile_epoch_bucket(element, compiler, **kw):
+    return f'FLOOR(EXTRACT(EPOCH FROM {compiler.process(element.clauses, **kw)}) / {element.interval}) * {element.interval}'
+
+
+@compiles(epoch_bucket, 'sqlite')
+def _compile_epoch_bucket_sqlite(element, compiler, **kw):
+    column = compiler.process(element.clauses, **kw)
+    return f"(CAST(strftime('%s', {column}) AS INTEGER) / {element.interval}) * {element.interval}"
+
+
+@compiles(epoch_bucket, 'mysql')
+def _compile_epoch_bucket_mysql(element, compiler, **kw):
+    return f'FLOOR(UNIX_TIMESTAMP({compiler.process(element.clauses, **kw)}) / {element.interval}) * {element.interval}'
+
 
 def round_down(num: int, interval: int) -> int:
     """ Rounds down the given number to the nearest multiple of the given interval. """
     return int(num - (num % interval))
 
 
-def latest_query_steps(epoch_start: int, limit: int = None) -> Query:
-    """ Returns a query instance to retrieve the latest steps to process. """
+def to_timestamp(value: datetime) -> float:
+    """ Converts the given (naive UTC or timezone-aware) datetime to a POSIX timestamp. """
+    return calendar.timegm(value.utctimetuple()) + value.microsecond / 1_000_000
+
+
+def from_timestamp(value: float) -> datetime:
+    return datetime.fromtimestamp(value, tz=timezone.utc)
+
+
+class Watermark:
+    """ Tracks which completed steps have already been rolled up into metrics.
+
+    completed/step_id: the (completed, id) of the latest step processed in completion order
+    seen:              the ids of processed steps which completed within `lateness` seconds of
+                       the watermark, used to pick up steps which complete late (i.e. are
+                       persisted after later steps were already processed) exactly once. These
+                       are only tracked when `lateness` is set, and are stored as runs of
+                       consecutive ids.
+    """
+
+    def __init__(self, completed: float = 0.0, step_id: int = 0, seen: Optional[Dict[int, float]] = None):
+        self.completed = completed
+        self.step_id = step_id
+        self.seen: Dict[int, float] = seen or {}
+
+    @staticmethod
+    def _resource_query() -> Query:
+        return riberry.model.misc.ResourceData.query().filter_by(
+            resource_type=riberry.model.misc.ResourceType.misc,
+            resource_id=None,
+            name=WATERMARK_RESOURCE_NAME,
+        )
+
+    @classmethod
+    def load(cls, lateness: float) -> 'Watermark':
+        resource = cls._resource_query().first()
+        if resource is None or not resource.value:
+            return cls.initial(lateness=lateness)
+
+        value = resource.value
+        seen = {int(step_id): completed for step_id, completed in value.get('seen') or []}
+        for first_id, last_id, completed in value.get('seen_ranges') or []:
+            seen.update(dict.fromkeys(range(first_id, last_id + 1), completed))
+        return cls(completed=value['completed'], step_id=value['step_id'], seen=seen)
+
+    @classmethod
+    def initial(cls, lateness: float) -> 'Watermark':
+        """ Creates the watermark for metrics previously populated without one, using `epoch_last`. """
+
+        completed = riberry.model.conn.query(func.max(JobExecutionMetric.epoch_last)).scalar() or 0.0
+        watermark = cls(completed=completed)
+        if completed:
+            watermark.seen = {
+                step_id: to_timestamp(step_completed)
+                for step_id, step_completed in riberry.model.conn.query(
+                    JobExecutionStreamStep.id, JobExecutionStreamStep.completed,
+                ).filter(
+                    JobExecutionStreamStep.completed >= from_timestamp(completed - lateness),
+                    JobExecutionStreamStep.completed <= from_timestamp(completed),
+                )
+            }
+            watermark.step_id = max(
+                (step_id for step_id, step_completed in watermark.seen.items() if step_completed >= completed),
+                default=0,
+            )
+        return watermark
 
-    start_datetime = pendulum.from_timestamp(epoch_start, tz=pendulum.UTC)
-    query: Query = riberry.model.conn.query(
+    def save(self):
+        resource = self._resource_query().first()
+        if resource is None:
+            resource = riberry.model.misc.ResourceData(
+                resource_type=riberry.model.misc.ResourceType.misc,
+                name=WATERMARK_RESOURCE_NAME,
+            )
+            riberry.model.conn.add(resource)
+
+        resource.value = dict(
+            completed=self.completed,
+            step_id=self.step_id,
+            seen_ranges=self.seen_ranges(),
+        )
+
+    def seen_ranges(self) -> List[List]:
+        """ Collapses the seen steps into [first id, last id, latest completed] runs of consecutive ids. """
+
+        ranges = []
+        for step_id in sorted(self.seen):
+            completed = self.seen[step_id]
+            if ranges and ranges[-1][1] == step_id - 1:
+                ranges[-1][1:] = [step_id, max(ranges[-1][2], completed)]
+            else:
+                ranges.append([step_id, step_id, completed])
+        return ranges
+
+    def advance(self, steps: Iterable[Tuple[int, float]], lateness: float):
+        """ Marks the given (id, completed) steps as processed and drops seen steps which have left the
+        lateness window. """
+
+        for step_id, completed in steps:
+            if lateness:
+                self.seen[step_id] = completed
+            if (completed, step_id) > (self.completed, self.step_id):
+                self.completed, self.step_id = completed, step_id
+
+        cutoff = self.completed - lateness
+        self.seen = {step_id: completed for step_id, completed in self.seen.items() if completed >= cutoff}
+
+
+def query_steps() -> Query:
+    """ Returns a query instance to retrieve the fields of completed steps required to build metrics. """
+
+    return riberry.model.conn.query(
+        JobExecutionStreamStep.id,
         JobExecutionStreamStep.name,
         JobExecutionStreamStep.started,
         JobExecutionStreamStep.completed,
         JobExecutionStream.name,
         JobExecutionStream.job_execution_id,
         Job.form_id,
-    ).filter(
-        JobExecutionStreamStep.completed >= start_datetime
-    ).order_by(JobExecutionStreamStep.completed.asc()).join(
+    ).join(
         JobExecutionStream,
     ).join(
         JobExecution,
@@ -44,105 +232,348 @@ def latest_query_steps(epoch_start: int, limit: int = None) -> Query:
         Job,
     )
 
+
+def _step_rows(query: Query) -> Iterable[StepRow]:
+    for step_id, step_name, started, completed, stream_name, job_execution_id, form_id in query.yield_per(10_000):
+        yield StepRow(
+            id=step_id,
+            step_name=step_name,
+            started=to_timestamp(started),
+            completed=to_timestamp(completed),
+            stream_name=stream_name,
+            job_execution_id=job_execution_id,
+            form_id=form_id,
+        )
+
+
+def _after_watermark(watermark: Watermark):
+    completed = from_timestamp(watermark.completed)
+    return or_(
+        JobExecutionStreamStep.completed > completed,
+        and_(
+            JobExecutionStreamStep.completed == completed,
+            JobExecutionStreamStep.id > watermark.step_id,
+        ),
+    )
+
+
+def latest_steps(watermark: Watermark, limit: Optional[int] = None) -> List[StepRow]:
+    """ Returns up to `limit` steps completed after the watermark, in completion order. """
+
+    query = query_steps().filter(
+        JobExecutionStreamStep.started.isnot(None),
+        _after_watermark(watermark),
+    ).order_by(JobExecutionStreamStep.completed.asc(), JobExecutionStreamStep.id.asc())
+
     if limit:
         query = query.limit(limit)
 
-    return query
+    return [step for step in _step_rows(query) if step.id not in watermark.seen]
 
 
-def retrieve_latest_epoch_start() -> int:
-    """ Retrieves the max processed epoch start value. """
-    return riberry.model.conn.query(func.max(JobExecutionMetric.epoch_start)).first()[0] or 0
+def late_step_ids(watermark: Watermark, lateness: float) -> List[int]:
+    """ Returns the ids of the unprocessed steps which completed within `lateness` seconds before the watermark. """
 
+    if not watermark.completed or not lateness:
+        return []
 
-def updated_metrics(time_interval: int, limit: int) -> List[JobExecutionMetric]:
-    """ Updates/creates and returns metrics for the latest created steps. """
+    return [
+        step_id for step_id, in riberry.model.conn.query(JobExecutionStreamStep.id).filter(
+            JobExecutionStreamStep.started.isnot(None),
+            JobExecutionStreamStep.completed >= from_timestamp(watermark.completed - lateness),
+            ~_after_watermark(watermark),
+        )
+        if step_id not in watermark.seen
+    ]
 
-    updated: List[JobExecutionMetric] = []
-    mapping_metrics: DefaultDict[MetricKey, JobExecutionMetric] = defaultdict(lambda: JobExecutionMetric(
-        count=0,
-        max_duration=0,
-        min_duration=None,
-        sum_duration=0,
-    ))
-    mapping_max_epoch_ends: DefaultDict[MetricKey, int] = defaultdict(lambda: 0)
-
-    latest_epoch_start = retrieve_latest_epoch_start()
-
-    # retrieve all metrics which may still have steps to be updated and populate our mapping
-    metrics: List[JobExecutionMetric] = riberry.model.conn.query(JobExecutionMetric).filter_by(
-        epoch_start=latest_epoch_start
-    ).all()
-
-    for metric in metrics:
-        key = MetricKey(
-            epoch_start=metric.epoch_start,
-            epoch_end=metric.epoch_end,
-            job_execution_id=metric.job_execution_id,
-            stream_name=metric.stream_name,
-            step_name=metric.step_name,
+
+def late_steps(watermark: Watermark, lateness: float) -> List[StepRow]:
+    """ Returns the unprocessed steps which completed within `lateness` seconds before the watermark. """
+
+    steps = []
+    for step_ids_chunk in chunks(late_step_ids(watermark, lateness=lateness), IN_CLAUSE_LIMIT):
+        steps += _step_rows(query_steps().filter(JobExecutionStreamStep.id.in_(step_ids_chunk)))
+    return steps
+
+
+def metric_key(step: StepRow, time_interval: int) -> MetricKey:
+    return MetricKey(
+        epoch_start=round_down(step.completed, time_interval),
+        epoch_end=round_down(step.completed + time_interval, time_interval),
+        job_execution_id=step.job_execution_id,
+        stream_name=step.stream_name,
+        step_name=step.step_name,
+    )
+
+
+def load_metrics(keys: Iterable[MetricKey]) -> Dict[MetricKey, JobExecutionMetric]:
+    """ Loads the existing metrics for the given keys, using one query per chunk of bucket start values. """
+
+    keys = set(keys)
+    execution_ids = {key.job_execution_id for key in keys}
+    loaded = {}
+    for epoch_starts_chunk in chunks({key.epoch_start for key in keys}, IN_CLAUSE_LIMIT):
+        for execution_ids_chunk in chunks(execution_ids, IN_CLAUSE_LIMIT):
+            for metric in JobExecutionMetric.query().options(undefer('raw_sketch')).filter(
+                JobExecutionMetric.epoch_start.in_(epoch_starts_chunk),
+                JobExecutionMetric.job_execution_id.in_(execution_ids_chunk),
+            ):
+                key = MetricKey(
+                    epoch_start=metric.epoch_start,
+                    epoch_end=metric.epoch_end,
+                    job_execution_id=metric.job_execution_id,
+                    stream_name=metric.stream_name,
+                    step_name=metric.step_name,
+                )
+                if key in keys:
+                    loaded[key] = metric
+    return loaded
+
+
+def merge_aggregate(aggregated: Dict[MetricKey, Aggregate], key: MetricKey, aggregate: Aggregate):
+    current = aggregated.get(key)
+    if current is None:
+        aggregated[key] = aggregate
+    else:
+        aggregated[key] = Aggregate(
+            form_id=current.form_id,
+            count=current.count + aggregate.count,
+            sum_duration=current.sum_duration + aggregate.sum_duration,
+            min_duration=min(current.min_duration, aggregate.min_duration),
+            max_duration=max(current.max_duration, aggregate.max_duration),
+            last=max(current.last, aggregate.last),
+            sketch=current.sketch.merge(aggregate.sketch) if current.sketch and aggregate.sketch else (
+                current.sketch or aggregate.sketch
+            ),
         )
-        mapping_metrics[key] = metric
 
-    query_steps = latest_query_steps(epoch_start=latest_epoch_start, limit=limit)
-    for step_data in query_steps.yield_per(10_000):
-        step_name, step_dt_start, step_dt_completed, stream_name, job_execution_id, form_id = step_data
 
-        # Convert the step's start and completed date-times to timestamps
-        epoch_start = pendulum.UTC.convert(pendulum.instance(step_dt_start)).timestamp()
-        epoch_end = pendulum.UTC.convert(pendulum.instance(step_dt_completed)).timestamp()
+class PythonMetricEngine:
+    """ Loads the new steps and aggregates their durations in Python, including duration sketches. """
 
-        # Find the duration of the step + its epoch range, rounded up/down with the given interval
-        range_start = round_down(epoch_end, time_interval)
-        range_end = round_down(epoch_end + time_interval, time_interval)
+    name = ENGINE_PYTHON
 
-        key = MetricKey(
-            epoch_start=range_start,
-            epoch_end=range_end,
-            job_execution_id=job_execution_id,
-            stream_name=stream_name,
-            step_name=step_name,
+    def aggregate(
+            self,
+            watermark: Watermark,
+            time_interval: int,
+            limit: int,
+            lateness: float,
+    ) -> Tuple[Dict[MetricKey, Aggregate], List[Tuple[int, float]]]:
+        steps = late_steps(watermark, lateness=lateness)
+        step_ids = {step.id for step in steps}
+        steps += [step for step in latest_steps(watermark, limit=limit) if step.id not in step_ids]
+
+        sketches: Dict[MetricKey, Tuple[int, float, LogHistogram]] = {}
+        for step in steps:
+            key = metric_key(step, time_interval)
+            current = sketches.get(key)
+            if current is None:
+                current = sketches[key] = (step.form_id, step.completed, LogHistogram())
+            elif step.completed > current[1]:
+                current = sketches[key] = (current[0], step.completed, current[2])
+            current[2].add(step.completed - step.started)
+
+        aggregated = {
+            key: Aggregate(
+                form_id=form_id,
+                count=sketch.count,
+                sum_duration=sketch.sum,
+                min_duration=sketch.min,
+                max_duration=sketch.max,
+                last=last,
+                sketch=sketch,
+            )
+            for key, (form_id, last, sketch) in sketches.items()
+        }
+        return aggregated, [(step.id, step.completed) for step in steps]
+
+
+class SqlMetricEngine:
+    """ Aggregates the new steps with a single GROUP BY per range of steps, without loading them.
+
+    Duration sketches require the individual durations and are not populated by this engine. The
+    sketches of existing metrics are kept, but no longer cover all of their steps (see
+    `JobExecutionMetric.sketch_partial`).
+    """
+
+    name = ENGINE_SQL
+
+    @staticmethod
+    def upper_bound(watermark: Watermark, limit: Optional[int]):
+        """ Returns the (completed, id) of the `limit`-th step after the watermark, if there are that many. """
+
+        if not limit:
+            return None
+        return riberry.model.conn.query(JobExecutionStreamStep.completed, JobExecutionStreamStep.id).filter(
+            JobExecutionStreamStep.started.isnot(None),
+            _after_watermark(watermark),
+        ).order_by(
+            JobExecutionStreamStep.completed.asc(), JobExecutionStreamStep.id.asc(),
+        ).offset(limit - 1).limit(1).first()
+
+    @staticmethod
+    def group(condition, time_interval: int) -> Dict[MetricKey, Aggregate]:
+        bucket = epoch_bucket(JobExecutionStreamStep.completed, time_interval)
+        duration = epoch(JobExecutionStreamStep.completed) - epoch(JobExecutionStreamStep.started)
+        query = riberry.model.conn.query(
+            bucket,
+            JobExecutionStream.job_execution_id,
+            JobExecutionStream.name,
+            JobExecutionStreamStep.name,
+            Job.form_id,
+            func.count(JobExecutionStreamStep.id),
+            func.sum(duration),
+            func.min(duration),
+            func.max(duration),
+            func.max(epoch(JobExecutionStreamStep.completed)),
+        ).select_from(JobExecutionStreamStep).join(
+            JobExecutionStream,
+        ).join(
+            JobExecution,
+        ).join(
+            Job,
+        ).filter(
+            JobExecutionStreamStep.started.isnot(None),
+            condition,
+        ).group_by(
+            bucket,
+            JobExecutionStream.job_execution_id,
+            JobExecutionStream.name,
+            JobExecutionStreamStep.name,
+            Job.form_id,
         )
-        metric = mapping_metrics[key]
-
-        # Avoid re-processing the same step by comparing the last epoch value to populate the metric
-        if metric.epoch_last and epoch_end <= metric.epoch_last:
-            continue
-
-        # Update the max epoch end for each metric
-        mapping_max_epoch_ends[key] = max(mapping_max_epoch_ends[key], epoch_end)
-
-        # Populate the metric's attributes
-        metric.epoch_start = range_start
-        metric.epoch_end = range_end
-        metric.form_id = form_id
-        metric.job_execution_id = job_execution_id
-        metric.stream_name = stream_name
-        metric.step_name = step_name
-        metric.count += 1
-        duration = epoch_end - epoch_start
-        metric.sum_duration += duration
-
-        if duration > metric.max_duration:
-            metric.max_duration = max(metric.max_duration, duration)
-        if metric.min_duration is None or duration < metric.min_duration:
-            metric.min_duration = min(metric.min_duration or duration, duration)
-
-    # Collect all update metrics and updated the "updated" timestamp
+
+        aggregated = {}
+        for epoch_start, job_execution_id, stream_name, step_name, form_id, count, sum_duration, min_duration, \
+                max_duration, last in query:
+            epoch_start = int(epoch_start)
+            key = MetricKey(
+                epoch_start=epoch_start,
+                epoch_end=epoch_start + time_interval,
+                job_execution_id=job_execution_id,
+                stream_name=stream_name,
+                step_name=step_name,
+            )
+            aggregated[key] = Aggregate(
+                form_id=form_id,
+                count=count,
+                sum_duration=float(sum_duration),
+                min_duration=float(min_duration),
+                max_duration=float(max_duration),
+                last=float(last),
+                sketch=None,
+            )
+        return aggregated
+
+    def aggregate(
+            self,
+            watermark: Watermark,
+            time_interval: int,
+            limit: int,
+            lateness: float,
+    ) -> Tuple[Dict[MetricKey, Aggregate], List[Tuple[int, float]]]:
+        late_ids = late_step_ids(watermark, lateness=lateness)
+        upper = self.upper_bound(watermark, limit=limit)
+        condition = _after_watermark(watermark)
+        if upper is not None:
+            upper_completed, upper_id = upper
+            condition = and_(condition, or_(
+                JobExecutionStreamStep.completed < upper_completed,
+                and_(JobExecutionStreamStep.completed == upper_completed, JobExecutionStreamStep.id <= upper_id),
+            ))
+
+        aggregated = self.group(condition, time_interval)
+        for late_ids_chunk in chunks(late_ids, IN_CLAUSE_LIMIT):
+            for key, aggregate in self.group(JobExecutionStreamStep.id.in_(late_ids_chunk), time_interval).items():
+                merge_aggregate(aggregated, key, aggregate)
+
+        # only the steps within the lateness window of the new watermark need to be remembered
+        processed = []
+        for step_id, completed in riberry.model.conn.query(
+                JobExecutionStreamStep.id, JobExecutionStreamStep.completed,
+        ).filter(
+            JobExecutionStreamStep.started.isnot(None),
+            condition,
+        ).order_by(JobExecutionStreamStep.completed.desc(), JobExecutionStreamStep.id.desc()).yield_per(10_000):
+            completed = to_timestamp(completed)
+            if processed and completed < processed[0][1] - lateness:
+                break
+            processed.append((step_id, completed))
+
+        for late_ids_chunk in chunks(late_ids, IN_CLAUSE_LIMIT):
+            processed += [
+                (step_id, to_timestamp(completed)) for step_id, completed in riberry.model.conn.query(
+                    JobExecutionStreamStep.id, JobExecutionStreamStep.completed,
+                ).filter(JobExecutionStreamStep.id.in_(late_ids_chunk))
+            ]
+        return aggregated, processed
+
+
+engines = {
+    PythonMetricEngine.name: PythonMetricEngine,
+    SqlMetricEngine.name: SqlMetricEngine,
+}
+
+
+def updated_metrics(
+        time_interval: int,
+        limit: int,
+        lateness: float = 0,
+        engine: str = ENGINE_PYTHON,
+) -> List[JobExecutionMetric]:
+    """ Updates/creates and returns metrics for the steps completed since the last run. """
+
+    if engine not in engines:
+        raise ValueError(f'Metric engine must be one of {", ".join(engines)} (received {engine!r})')
+
+    watermark = Watermark.load(lateness=lateness)
+    aggregated, processed = engines[engine]().aggregate(
+        watermark, time_interval=time_interval, limit=limit, lateness=lateness,
+    )
+    if not aggregated:
+        return []
+
+    existing = load_metrics(aggregated)
+
+    updated: List[JobExecutionMetric] = []
     updated_timestamp = pendulum.DateTime.utcnow()
-    for key, max_epoch in mapping_max_epoch_ends.items():
-        metric = mapping_metrics[key]
-        metric.epoch_last = max_epoch
+    for key, aggregate in aggregated.items():
+        metric = existing.get(key)
+        if metric is None:
+            metric = JobExecutionMetric(
+                epoch_start=key.epoch_start,
+                epoch_end=key.epoch_end,
+                job_execution_id=key.job_execution_id,
+                stream_name=key.stream_name,
+                step_name=key.step_name,
+                form_id=aggregate.form_id,
+                count=0,
+                sum_duration=0,
+                max_duration=aggregate.max_duration,
+                min_duration=aggregate.min_duration,
+                epoch_last=0,
+            )
+
+        metric.count += aggregate.count
+        metric.sum_duration += aggregate.sum_duration
+        metric.max_duration = max(metric.max_duration, aggregate.max_duration)
+        metric.min_duration = min(metric.min_duration, aggregate.min_duration)
+        metric.epoch_last = max(metric.epoch_last or 0, aggregate.last)
+        if aggregate.sketch is not None:
+            metric.sketch = metric.sketch.merge(aggregate.sketch)
         metric.updated = updated_timestamp
         updated.append(metric)
 
+    watermark.advance(processed, lateness=lateness)
+    watermark.save()
     return updated
 
 
-def process_metrics(time_interval: int, limit: int):
+def process_metrics(time_interval: int, limit: int, lateness: float = 0, engine: str = ENGINE_PYTHON):
     """ Updates all metrics with the latest steps for the given interval. """
 
-    updated = updated_metrics(time_interval=time_interval, limit=limit)
+    updated = updated_metrics(time_interval=time_interval, limit=limit, lateness=lateness, engine=engine)
     if updated:
         logger.info(f'Updated {len(updated)} metric instances')
         riberry.model.conn.bulk_save_objects(updated)
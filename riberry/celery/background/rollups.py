@@ -0,0 +1,277 @@
+import time
+from collections import namedtuple
+from typing import List, Dict, Optional, Iterable, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import undefer
+
+from celery.utils.log import logger
+import riberry
+from riberry import config
+from riberry.celery.background.metrics import round_down, Watermark, WATERMARK_RESOURCE_NAME
+from riberry.model.job import JobExecutionMetric, JobExecutionMetricRollup
+from riberry.util.sketch import LogHistogram
+
+ROLLUP_RESOURCE_NAME = 'riberry.background.metrics.rollup'
+MAX_BUCKETS_PER_RUN = 1000
+DEFAULT_MAX_POINTS = 500
+
+Tier = namedtuple('Tier', ['resolution', 'retention', 'base'])
+Tier.__new__.__defaults__ = (False,)
+
+Point = namedtuple('Point', [
+    'form_id',
+    'stream_name',
+    'step_name',
+    'epoch_start',
+    'epoch_end',
+    'count',
+    'sum_duration',
+    'min_duration',
+    'max_duration',
+    'sketch',
+])
+
+
+def base_tier() -> Tier:
+    """ The tier of the metrics recorded directly from steps (`job_execution_metric`). """
+    return Tier(
+        resolution=config.config.background.metrics.time_interval,
+        retention=config.config.background.rollups.retention,
+        base=True,
+    )
+
+
+def tiers() -> List[Tier]:
+    """ Returns the configured rollup tiers, finest first. """
+    return [Tier(resolution, retention) for resolution, retention in config.config.background.rollups.tiers]
+
+
+def _resource_query(resolution: int):
+    return riberry.model.misc.ResourceData.query().filter_by(
+        resource_type=riberry.model.misc.ResourceType.misc,
+        resource_id=None,
+        name=f'{ROLLUP_RESOURCE_NAME}.{resolution}',
+    )
+
+
+def rolled_up_until(resolution: int) -> int:
+    """ Returns the epoch up to which the given tier has been rolled up. """
+    resource = _resource_query(resolution).first()
+    return (resource.value or {}).get('epoch', 0) if resource else 0
+
+
+def _set_rolled_up_until(resolution: int, epoch: int):
+    resource = _resource_query(resolution).first()
+    if resource is None:
+        resource = riberry.model.misc.ResourceData(
+            resource_type=riberry.model.misc.ResourceType.misc,
+            name=f'{ROLLUP_RESOURCE_NAME}.{resolution}',
+        )
+        riberry.model.conn.add(resource)
+    resource.value = {'epoch': epoch}
+
+
+def closed_until(source: Tier, lateness: float) -> int:
+    """ Returns the epoch before which the source tier's buckets will no longer change. """
+
+    if source.base:
+        has_watermark = riberry.model.misc.ResourceData.query().filter_by(
+            resource_type=riberry.model.misc.ResourceType.misc,
+            resource_id=None,
+            name=WATERMARK_RESOURCE_NAME,
+        ).count()
+        return int(Watermark.load(lateness=lateness).completed - lateness) if has_watermark else 0
+    return rolled_up_until(source.resolution)
+
+
+def _base_points(epoch_start: int, epoch_end: int, form_id=None) -> Iterable[Point]:
+    query = JobExecutionMetric.query().options(undefer('raw_sketch')).filter(
+        JobExecutionMetric.epoch_start >= epoch_start,
+        JobExecutionMetric.epoch_start < epoch_end,
+    )
+    if form_id is not None:
+        query = query.filter(JobExecutionMetric.form_id == form_id)
+    for metric in query.yield_per(10_000):
+        yield _point(metric)
+
+
+def _rollup_points(resolution: int, epoch_start: int, epoch_end: int, form_id=None) -> Iterable[Point]:
+    query = JobExecutionMetricRollup.query().options(undefer('raw_sketch')).filter(
+        JobExecutionMetricRollup.resolution == resolution,
+        JobExecutionMetricRollup.epoch_start >= epoch_start,
+        JobExecutionMetricRollup.epoch_start < epoch_end,
+    )
+    if form_id is not None:
+        query = query.filter(JobExecutionMetricRollup.form_id == form_id)
+    for rollup in query.yield_per(10_000):
+        yield _point(rollup)
+
+
+def _point(metric) -> Point:
+    return Point(
+        form_id=metric.form_id,
+        stream_name=metric.stream_name,
+        step_name=metric.step_name,
+        epoch_start=metric.epoch_start,
+        epoch_end=metric.epoch_end,
+        count=metric.count,
+        sum_duration=metric.sum_duration,
+        min_duration=metric.min_duration,
+        max_duration=metric.max_duration,
+        sketch=metric.sketch,
+    )
+
+
+def downsample(points: Iterable[Point], resolution: int) -> List[Point]:
+    """ Merges the given points into buckets of the given resolution per form, stream and step. """
+
+    merged: Dict[Tuple, Point] = {}
+    for point in points:
+        epoch_start = round_down(point.epoch_start, resolution)
+        key = (point.form_id, point.stream_name, point.step_name, epoch_start)
+        current = merged.get(key)
+        if current is None:
+            merged[key] = point._replace(
+                epoch_start=epoch_start,
+                epoch_end=epoch_start + resolution,
+                sketch=LogHistogram().merge(point.sketch),
+            )
+        else:
+            merged[key] = current._replace(
+                count=current.count + point.count,
+                sum_duration=current.sum_duration + point.sum_duration,
+                min_duration=min(current.min_duration, point.min_duration),
+                max_duration=max(current.max_duration, point.max_duration),
+                sketch=current.sketch.merge(point.sketch),
+            )
+    return sorted(merged.values(), key=lambda p: (p.epoch_start, p.form_id, p.stream_name, p.step_name))
+
+
+def rollup_tier(tier: Tier, source: Tier, lateness: float) -> int:
+    """ Rolls up the closed buckets of the source tier into the given tier, returning the number of rows created. """
+
+    start = rolled_up_until(tier.resolution)
+    if not start:
+        if source.base:
+            first = riberry.model.conn.query(func.min(JobExecutionMetric.epoch_start)).scalar()
+        else:
+            first = riberry.model.conn.query(func.min(JobExecutionMetricRollup.epoch_start)).filter(
+                JobExecutionMetricRollup.resolution == source.resolution
+            ).scalar()
+        if first is None:
+            return 0
+        start = round_down(first, tier.resolution)
+
+    end = min(
+        round_down(closed_until(source, lateness=lateness), tier.resolution),
+        start + tier.resolution * MAX_BUCKETS_PER_RUN,
+    )
+    if end <= start:
+        return 0
+
+    if source.base:
+        points = _base_points(start, end)
+    else:
+        points = _rollup_points(source.resolution, start, end)
+
+    rollups = [
+        JobExecutionMetricRollup(
+            form_id=point.form_id,
+            resolution=tier.resolution,
+            epoch_start=point.epoch_start,
+            epoch_end=point.epoch_end,
+            stream_name=point.stream_name,
+            step_name=point.step_name,
+            count=point.count,
+            sum_duration=point.sum_duration,
+            min_duration=point.min_duration,
+            max_duration=point.max_duration,
+            raw_sketch=point.sketch.to_bytes() if point.sketch.count else None,
+        )
+        for point in downsample(points, tier.resolution)
+    ]
+    riberry.model.conn.bulk_save_objects(rollups)
+    _set_rolled_up_until(tier.resolution, end)
+    riberry.model.conn.commit()
+    return len(rollups)
+
+
+def apply_retention(now: Optional[float] = None) -> int:
+    """ Deletes the rows of each tier which are older than its retention and have been rolled up further. """
+
+    now = now or time.time()
+    levels = [base_tier()] + tiers()
+    deleted = 0
+    for level, coarser in zip(levels, levels[1:] + [None]):
+        if not level.retention:
+            continue
+        cutoff = int(now - level.retention)
+        if coarser is not None:
+            cutoff = min(cutoff, rolled_up_until(coarser.resolution))
+
+        if level.base:
+            query = JobExecutionMetric.query().filter(JobExecutionMetric.epoch_end <= cutoff)
+        else:
+            query = JobExecutionMetricRollup.query().filter(
+                JobExecutionMetricRollup.resolution == level.resolution,
+                JobExecutionMetricRollup.epoch_end <= cutoff,
+            )
+        deleted += query.delete(synchronize_session=False)
+    riberry.model.conn.commit()
+    return deleted
+
+
+def process_rollups(lateness: float = 0, now: Optional[float] = None):
+    """ Rolls up each tier from the next finer tier and applies the retention policies. """
+
+    levels = [base_tier()] + tiers()
+    for source, tier in zip(levels, levels[1:]):
+        created = rollup_tier(tier, source, lateness=lateness)
+        if created:
+            logger.info(f'Created {created} metric rollups with a resolution of {tier.resolution}s')
+
+    deleted = apply_retention(now=now)
+    if deleted:
+        logger.info(f'Deleted {deleted} expired metric rows')
+
+
+def select_tier(epoch_start: int, epoch_end: int, resolution: Optional[int] = None,
+                max_points: int = DEFAULT_MAX_POINTS, now: Optional[float] = None) -> Tier:
+    """ Returns the coarsest tier which still holds data for `epoch_start` at the requested resolution.
+
+    If no resolution is given, the finest resolution yielding at most `max_points` buckets is requested.
+    """
+
+    now = now or time.time()
+    levels = [base_tier()] + tiers()
+    requested = max(resolution or (epoch_end - epoch_start) / max_points, levels[0].resolution)
+    covering = [level for level in levels if not level.retention or epoch_start >= now - level.retention]
+    if not covering:
+        return levels[-1]
+    usable = [level for level in covering if level.resolution <= requested]
+    return usable[-1] if usable else covering[0]
+
+
+def _points(levels: List[Tier], form_id, epoch_start: int, epoch_end: int) -> List[Point]:
+    level = levels[-1]
+    if len(levels) == 1:
+        return list(_base_points(epoch_start, epoch_end, form_id=form_id))
+
+    until = rolled_up_until(level.resolution)
+    points = list(_rollup_points(level.resolution, epoch_start, min(epoch_end, until), form_id=form_id))
+    if epoch_end > until:
+        points += _points(levels[:-1], form_id, max(epoch_start, until), epoch_end)
+    return points
+
+
+def query(form_id, epoch_start: int, epoch_end: int, resolution: Optional[int] = None,
+          max_points: int = DEFAULT_MAX_POINTS, now: Optional[float] = None) -> Tuple[int, List[Point]]:
+    """ Returns the resolution and the form's metric points within the given range, read from the coarsest
+    suitable tier. Buckets which have not been rolled up yet are read from finer tiers and downsampled. """
+
+    tier = select_tier(epoch_start, epoch_end, resolution=resolution, max_points=max_points, now=now)
+    levels = [base_tier()] + tiers()
+    levels = levels[:levels.index(tier) + 1]
+    points = _points(levels, form_id, round_down(epoch_start, tier.resolution), epoch_end)
+    return tier.resolution, downsample(points, tier.resolution)
@@ -1,16 +1,16 @@
 import importlib
 
 from riberry import model
-from riberry.celery.background import capacity_config
+from riberry.celery.background import capacity_config, mail, rollups
 from riberry.celery.background.events import events
 from riberry.celery.background.metrics import process_metrics
 from . import app
 
 
 @app.task(ignore_result=True)
-def process_events(event_limit=None):
+def process_events(event_limit=None, partition=None, partitions=None):
     with model.conn:
-        events.process(event_limit)
+        events.process(event_limit, partition=partition, partitions=partitions)
 
 
 @app.task(ignore_result=True)
@@ -43,9 +43,21 @@ def update_capacity_parameters():
 
 
 @app.task(ignore_result=True)
-def update_execution_metrics(time_interval: int, step_limit: int):
+def send_mail(limit=None):
     with model.conn:
-        process_metrics(time_interval=time_interval, limit=step_limit)
+        mail.send_queued(limit=limit)
+
+
+@app.task(ignore_result=True)
+def update_execution_metrics(time_interval: int, step_limit: int, lateness: float = 0, engine: str = 'python'):
+    with model.conn:
+        process_metrics(time_interval=time_interval, limit=step_limit, lateness=lateness, engine=engine)
+
+
+@app.task(ignore_result=True)
+def update_metric_rollups(lateness: float = 0):
+    with model.conn:
+        rollups.process_rollups(lateness=lateness)
 
 
 @app.task(ignore_result=True)
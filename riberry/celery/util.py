@@ -1,10 +1,134 @@
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
 from urllib.parse import urlparse
 
 import redis
 from celery import current_app
+from celery.utils.log import logger as log
 
 
-def celery_redis_instance():
-    broker_uri = current_app.connection().as_uri(include_password=True)
-    url = urlparse(broker_uri)
-    return redis.Redis(host=url.hostname, port=url.port, password=url.password)
+class CountingPipeline(redis.client.Pipeline):
+    """ Pipeline which records the commands it executes against its manager's subsystem counter. """
+
+    counter: Counter = None
+
+    def execute(self, raise_on_error=True):
+        if self.counter is not None:
+            self.counter['PIPELINE'] += 1
+            for args, _ in self.command_stack:
+                self.counter[str(args[0]).upper()] += 1
+        return super().execute(raise_on_error=raise_on_error)
+
+
+class CountingRedis(redis.Redis):
+    """ Redis client which records the commands it issues against its manager's subsystem counter. """
+
+    counter: Counter = None
+
+    def execute_command(self, *args, **options):
+        if self.counter is not None:
+            self.counter[str(args[0]).upper()] += 1
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipeline = CountingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipeline.counter = self.counter
+        return pipeline
+
+
+class RedisManager:
+    """ Process-wide Redis clients for the Celery broker.
+
+    Clients share a single connection pool, which is re-created when the process is forked. The
+    commands issued by each client are counted per subsystem (e.g. `scale`, `capacity`).
+    """
+
+    def __init__(self, report_interval: float = 60.0):
+        self.report_interval = report_interval
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._pool: Optional[redis.ConnectionPool] = None
+        self._pool_app = None
+        self._counters: Dict[str, Counter] = defaultdict(Counter)
+        self._reported = time.time()
+
+    def _check_pid(self):
+        """ Drops the connection pool inherited from the parent process. """
+
+        current_pid = os.getpid()
+        if self._pid != current_pid:
+            log.debug(f'RedisManager:: Process forked from pid {self._pid}, re-creating connection pool')
+            self._pid = current_pid
+            self._pool = None
+            self._counters = defaultdict(Counter)
+            self._reported = time.time()
+
+    @staticmethod
+    def _create_pool() -> redis.ConnectionPool:
+        broker_uri = current_app.connection().as_uri(include_password=True)
+        url = urlparse(broker_uri)
+        return redis.ConnectionPool(host=url.hostname, port=url.port or 6379, password=url.password)
+
+    @property
+    def pool(self) -> redis.ConnectionPool:
+        with self._lock:
+            self._check_pid()
+            app = current_app._get_current_object()
+            if self._pool is None or self._pool_app is not app:
+                if self._pool is not None:
+                    self._pool.disconnect()
+                self._pool = self._create_pool()
+                self._pool_app = app
+            return self._pool
+
+    def client(self, subsystem: str = 'default') -> CountingRedis:
+        """ Returns a client using the shared connection pool, counting its commands under `subsystem`. """
+
+        client = CountingRedis(connection_pool=self.pool)
+        client.counter = self._counters[subsystem]
+        return client
+
+    def read_many(self, commands: Iterable[Tuple], subsystem: str = 'default') -> List:
+        """ Issues the given read commands, e.g. `('llen', key)`, in a single non-transactional pipeline.
+
+        Failed commands return their exception rather than raising.
+        """
+
+        pipe = self.client(subsystem=subsystem).pipeline(transaction=False)
+        for name, *args in commands:
+            getattr(pipe, name)(*args)
+        return pipe.execute(raise_on_error=False)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """ Returns the number of commands issued by each subsystem, by command name. """
+        return {subsystem: dict(counter) for subsystem, counter in self._counters.items()}
+
+    def reset_stats(self):
+        for counter in self._counters.values():
+            counter.clear()
+        self._reported = time.time()
+
+    def report(self, now: Optional[float] = None):
+        """ Logs the command rate of each subsystem, at most once per `report_interval`. """
+
+        now = now or time.time()
+        elapsed = now - self._reported
+        if elapsed < self.report_interval:
+            return
+
+        rates = ', '.join(
+            f'{subsystem}: {sum(counter.values()) / elapsed:.1f}/s'
+            for subsystem, counter in sorted(self._counters.items())
+        )
+        log.info(f'RedisManager:: commands issued over the last {elapsed:.0f}s ({rates or "none"})')
+        self.reset_stats()
+
+
+redis_manager = RedisManager()
+
+
+def celery_redis_instance(subsystem: str = 'default') -> redis.Redis:
+    return redis_manager.client(subsystem=subsystem)
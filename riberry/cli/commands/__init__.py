@@ -1 +1 @@
-from . import conf, run, admin
+from . import conf, run, admin, events, capacity
@@ -2,6 +2,7 @@ import json
 
 import click
 
+import riberry
 from riberry.util import config_importer
 from .base import admin
 
@@ -21,4 +22,10 @@ def importer(config_path, commit, apps):
     print(json.dumps(changes, indent=2))
 
 
+@model.command('upgrade', help='Adds the nullable columns missing from existing tables. '
+                               'Run once, with the workers stopped, after upgrading Riberry.')
+def upgrade():
+    riberry.model.add_missing_columns(riberry.model.conn.raw_engine)
+
+
 admin.add_command(model)
@@ -0,0 +1,99 @@
+import json
+
+import click
+import redis
+
+from riberry import model
+from ..root import cli
+
+
+def _parse_pairs(values, option):
+    pairs = []
+    for value in values:
+        name, sep, number = value.rpartition('=')
+        if not sep or not name or not number.isdigit():
+            raise click.BadParameter(f'expected NAME=NUMBER, received {value!r}', param_hint=option)
+        pairs.append((name, int(number)))
+    return pairs
+
+
+@click.group(help='Collection of capacity distribution functions')
+def capacity():
+    pass
+
+
+@capacity.command('simulate', help='Simulates the distribution of capacity between weighted consumers')
+@click.option('--producer', '-p', 'producers', multiple=True, required=True, metavar='NAME=CAPACITY',
+              help='Capacity producer and its capacity, may be repeated')
+@click.option('--consumer', '-c', 'consumers', multiple=True, metavar='NAME=WEIGHT',
+              help='Capacity consumer and its weight, may be repeated')
+@click.option('--weight-parameter', '-w', default=None,
+              help='Reads the consumer weights from the instance schedules of the given parameter')
+@click.option('--strategy', '-s', type=click.Choice([s.value for s in model.application.CapacityDistributionStrategy]),
+              default=model.application.CapacityDistributionStrategy.binpack.value, help='Distribution strategy')
+@click.option('--duration', '-d', type=float, default=3600.0, help='Simulated seconds of execution arrivals')
+@click.option('--arrival-rate', type=float, default=0.1, help='Executions arriving per second for each consumer')
+@click.option('--mean-duration', type=float, default=30.0, help='Mean execution duration in seconds')
+@click.option('--tick', type=float, default=5.0, help='Seconds between capacity re-allocations')
+@click.option('--seed', type=int, default=None, help='Random seed')
+@click.option('--redis-url', default=None, help='Redis instance to simulate against (defaults to an in-memory fake)')
+@click.option('--format', '-f', 'output_format', type=click.Choice(['text', 'json']), default='text',
+              help='Output format')
+def simulate(producers, consumers, weight_parameter, strategy, duration, arrival_rate, mean_duration, tick, seed,
+             redis_url, output_format):
+    from riberry.celery.background import capacity_simulator
+
+    if consumers:
+        weights = dict(_parse_pairs(consumers, '--consumer'))
+    elif weight_parameter:
+        with model.conn:
+            weights = capacity_simulator.weights_from_schedules(parameter_name=weight_parameter)
+    else:
+        raise click.UsageError('Either --consumer or --weight-parameter is required')
+
+    if not weights:
+        raise click.UsageError('No consumers to simulate')
+
+    if redis_url:
+        connection = redis.Redis.from_url(redis_url)
+    else:
+        try:
+            import fakeredis
+        except ImportError:
+            raise click.UsageError('fakeredis is required to simulate without --redis-url, '
+                                   'install riberry with the "simulation" extra')
+        connection = fakeredis.FakeRedis()
+
+    report = capacity_simulator.simulate(
+        producers=_parse_pairs(producers, '--producer'),
+        weights=weights,
+        distribution_strategy=model.application.CapacityDistributionStrategy(strategy),
+        duration=duration,
+        connection=connection,
+        arrival_rate=arrival_rate,
+        mean_duration=mean_duration,
+        tick=tick,
+        seed=seed,
+    )
+
+    result = report.to_dict()
+    if output_format == 'json':
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f'Executions:        {result["arrived"]} arrived, {result["completed"]} completed, '
+          f'{result["unserved"]} unserved')
+    print(f'Utilization:       {result["utilization"]:.1%} of {result["total_capacity"]} units')
+    print(f'Queueing delay:    mean={result["delay_mean"]:.1f}s p95={result["delay_p95"]:.1f}s '
+          f'max={result["delay_max"]:.1f}s')
+    print(f'Fairness:          {result["fairness"]:.3f}')
+    print(f'Re-allocations:    {result["reallocations"]}')
+    print(f'Redis operations:  {sum(result["redis_commands"].values())} '
+          f'({result["redis_ops_per_second"]:.2f}/s simulated, run in {result["wall_time"]:.2f}s)')
+    print()
+    print(f'{"producer":<20} {"peak load":>10}')
+    for name, load in result['producer_load'].items():
+        print(f'{name:<20} {load:>10.1%}')
+
+
+cli.add_command(capacity)
@@ -0,0 +1,60 @@
+import json
+
+import click
+
+from riberry import model
+from riberry.celery.background.events import stats as event_stats
+from ..root import cli
+
+
+@click.group(help='Collection of event processing functions')
+def events():
+    pass
+
+
+@events.command('stats', help='Shows the lag and throughput of the background event processor')
+@click.option('--format', '-f', 'output_format', type=click.Choice(['text', 'json', 'prometheus']), default='text',
+              help='Output format')
+@click.option('--partition', '-p', type=int, default=None,
+              help='Shows the recorded run history of the given partition instead of the summary')
+def stats(output_format, partition):
+    with model.conn:
+        if partition is not None:
+            runs = event_stats.history(partition=partition)
+            if output_format == 'json':
+                print(json.dumps(runs, indent=2))
+            else:
+                for run in runs:
+                    print(
+                        f'events={run["events"]} deleted={run["deleted"]} duration={run["duration"]:.3f}s '
+                        f'oldest={run["oldest_event_age"]:.1f}s latency_max={run["latency_max"]:.1f}s'
+                    )
+            return
+
+        summary = event_stats.summary()
+
+    if output_format == 'json':
+        print(json.dumps(summary, indent=2))
+    elif output_format == 'prometheus':
+        print(event_stats.to_prometheus(summary), end='')
+    else:
+        print(f'Pending events:    {summary["pending"]["count"]}')
+        print(f'Oldest pending:    {summary["pending"]["oldest_event_age"]:.1f}s')
+        print(f'Recorded runs:     {summary["runs"]}')
+        for partition_name, run in sorted(summary['last'].items()):
+            print(
+                f'Last run (partition {partition_name}): events={run["events"]} deleted={run["deleted"]} '
+                f'duration={run["duration"]:.3f}s latency_mean={run["latency_mean"]:.1f}s '
+                f'latency_max={run["latency_max"]:.1f}s'
+            )
+        print()
+        print(f'{"handler":<10} {"events":>10} {"deleted":>10} {"time (s)":>10} {"mean lat (s)":>13} {"max lat (s)":>12}')
+        for handler_name, totals in summary['totals'].items():
+            handler = event_stats.HandlerStats.from_dict(totals)
+            print(
+                f'{handler_name:<10} {handler.events:>10} {handler.deleted:>10} {handler.duration:>10.3f} '
+                f'{handler.latency_mean:>13.2f} {handler.latency_max:>12.2f}'
+            )
+
+
+cli.add_command(events)
@@ -1,4 +1,4 @@
-from . import core, pool, web
+from . import core, events, pool, web
 from .base import run
 from ...root import cli
 
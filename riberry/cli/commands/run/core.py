@@ -1,9 +1,10 @@
 import atexit
+import os
 import subprocess
 
 import click
 
-from riberry import log
+from riberry import log, config
 from .base import run
 
 log = log.make(__name__)
@@ -20,30 +21,93 @@ def _kill(processes):
 
 @run.command(help='Start Riberry\'s core background celery app')
 @click.option('--log-level', '-l', default='ERROR', help='Log level')
-def core(log_level):
+@click.option('--event-partitions', '-p', type=int, default=None,
+              help='Number of parallel event processors (defaults to background.events.partitions)')
+@click.option('--event-claim', type=click.Choice(['partition', 'skip-locked']), default=None,
+              help='How event processors claim events (defaults to background.events.claim)')
+@click.option('--event-daemon/--no-event-daemon', default=None,
+              help='Process events with streaming daemons instead of the beat schedule '
+                   '(defaults to background.events.daemon.enabled)')
+def core(log_level, event_partitions, event_claim, event_daemon):
+    from riberry.celery.background.events import claim
+
+    if event_partitions is not None:
+        os.environ['RIBERRY_EVENT_PARTITIONS'] = str(event_partitions)
+    if event_claim is not None:
+        os.environ['RIBERRY_EVENT_CLAIM'] = event_claim
+    if event_daemon is not None:
+        os.environ['RIBERRY_EVENT_DAEMON'] = '1' if event_daemon else ''
+        config.config.background.events.daemon.enabled = event_daemon
+
+    partitions = event_partitions or config.config.background.events.partitions
+    claim_mode = claim.effective_mode(event_claim)
+
     process_beat = subprocess.Popen([
         'celery', 'beat',
         '-A', 'riberry.celery.background',
         '-l', log_level.lower(),
     ])
 
+    daemon = config.config.background.events.daemon.enabled
+
+    queues = ['riberry.background.custom', 'riberry.background.schedules', 'riberry.background.metrics']
+    if partitions <= 1 and not daemon:
+        queues.insert(2, claim.EVENT_QUEUE)
+
     process_background = subprocess.Popen([
         'celery', 'worker',
         '-A', 'riberry.celery.background',
         '-l', log_level.lower(),
         '-c', '1',
-        '-Q', 'riberry.background.custom,'
-              'riberry.background.schedules,'
-              'riberry.background.events,'
-              'riberry.background.metrics',
+        '-Q', ','.join(queues),
+    ])
+
+    process_mail = subprocess.Popen([
+        'celery', 'worker',
+        '-A', 'riberry.celery.background',
+        '-l', log_level.lower(),
+        '-n', 'mail@%h',
+        '-c', '1',
+        '-Q', 'riberry.background.mail',
     ])
 
-    processes = process_background, process_beat
+    if partitions <= 1 or daemon:
+        event_workers = []
+    elif claim_mode == claim.CLAIM_SKIP_LOCKED:
+        event_workers = [(claim.EVENT_QUEUE, partitions)]
+    else:
+        event_workers = [(claim.queue_name(partition, partitions, claim_mode), 1) for partition in range(partitions)]
+
+    processes_events = [
+        subprocess.Popen([
+            'celery', 'worker',
+            '-A', 'riberry.celery.background',
+            '-l', log_level.lower(),
+            '-n', f'events-{idx}@%h',
+            '-c', str(concurrency),
+            '-Q', queue,
+        ])
+        for idx, (queue, concurrency) in enumerate(event_workers)
+    ]
+
+    if daemon:
+        processes_events += [
+            subprocess.Popen([
+                'riberry', 'run', 'events',
+                '-l', log_level,
+                '--partition', str(partition),
+                '--partitions', str(partitions),
+                '--event-claim', claim_mode,
+            ])
+            for partition in range(partitions)
+        ]
+
+    processes = (process_background, process_beat, process_mail, *processes_events)
 
     atexit.register(lambda: _kill(processes=processes))
 
     try:
-        process_background.wait()
-        process_beat.wait()
+        for process in processes:
+            process.wait()
     except KeyboardInterrupt:
         log.info('Exiting riberry core...')
@@ -0,0 +1,27 @@
+import os
+
+import click
+
+from riberry import config
+from .base import run
+
+
+@run.command('events', help='Start Riberry\'s streaming event processor')
+@click.option('--log-level', '-l', default='ERROR', help='Log level')
+@click.option('--partition', type=int, default=None, help='Event partition to process')
+@click.option('--partitions', '-p', type=int, default=None,
+              help='Number of event partitions (defaults to background.events.partitions)')
+@click.option('--event-claim', type=click.Choice(['partition', 'skip-locked']), default=None,
+              help='How event processors claim events (defaults to background.events.claim)')
+def run_events(log_level, partition, partitions, event_claim):
+    from celery.utils.log import logger
+    from riberry.celery.background.events.daemon import EventDaemon
+
+    os.environ['RIBERRY_EVENT_DAEMON'] = '1'
+    config.config.background.events.daemon.enabled = True
+    logger.setLevel(log_level.upper())
+
+    partitions = partitions or config.config.background.events.partitions
+    daemon = EventDaemon.from_config(partition=partition, partitions=partitions, claim=event_claim)
+    daemon.install_signal_handlers()
+    daemon.run()
@@ -6,6 +6,7 @@ import click
 import riberry
 from riberry.app.backends.impl.pool.base import RiberryPoolBackend
 from riberry.app.backends.impl.pool.log import configure as log_configure
+from riberry.app.backends.impl.pool.tasks import executors
 from .base import run
 
 
@@ -14,7 +15,10 @@ from .base import run
 @click.option('--instance', '-i', help='Riberry application instance to run')
 @click.option('--log-level', '-l', default='ERROR', help='Log level')
 @click.option('--concurrency', '-c', default=None, help='Task concurrency', type=int)
-def pool(module, instance, log_level, concurrency):
+@click.option('--mode', default='thread', type=click.Choice(list(executors)), help='Execute tasks in threads or processes')
+@click.option('--max-tasks-per-child', default=None, help='Tasks executed by a child process before it is replaced', type=int)
+@click.option('--max-memory-per-child', default=None, help='Memory (KiB) of a child process before it is replaced', type=int)
+def pool(module, instance, log_level, concurrency, mode, max_tasks_per_child, max_memory_per_child):
     if instance is not None:
         os.environ['RIBERRY_INSTANCE'] = instance
 
@@ -22,4 +26,10 @@ def pool(module, instance, log_level, concurrency):
     importlib.import_module(module)
     backend: RiberryPoolBackend = riberry.app.current_riberry_app.backend
     backend.task_queue.limit = concurrency
+    if mode == 'process':
+        backend.executor = executors[mode](
+            task_queue=backend.task_queue,
+            max_tasks_per_child=max_tasks_per_child,
+            max_memory_per_child=max_memory_per_child,
+        )
     backend.start()
@@ -2,6 +2,7 @@ import binascii
 import os
 import pathlib
 import warnings
+from typing import List, Tuple
 
 import toml
 from appdirs import AppDirs
@@ -18,10 +19,50 @@ APP_DIR_USER_CONF.mkdir(parents=True, exist_ok=True)
 CONF_DEFAULT_BG_SCHED_INTERVAL = 10
 CONF_DEFAULT_BG_EVENT_INTERVAL = 2
 CONF_DEFAULT_BG_EVENT_PROCESS_LIMIT = 1000
+CONF_DEFAULT_BG_EVENT_COMMIT_SIZE = 250
+CONF_DEFAULT_BG_EVENT_DELETE_CHUNK_SIZE = 500
+CONF_DEFAULT_BG_EVENT_PARTITIONS = 1
+CONF_DEFAULT_BG_EVENT_CLAIM = 'partition'
+CONF_DEFAULT_BG_EVENT_DAEMON_MIN_BATCH = 100
+CONF_DEFAULT_BG_EVENT_DAEMON_MAX_BATCH = 10_000
+CONF_DEFAULT_BG_EVENT_DAEMON_MIN_IDLE = 0.05
+CONF_DEFAULT_BG_EVENT_DAEMON_MAX_IDLE = 2.0
+CONF_DEFAULT_BG_EVENT_DAEMON_NOTIFY_PORT = 5446
 CONF_DEFAULT_BG_CAPACITY_INTERVAL = 5
 CONF_DEFAULT_BG_METRIC_INTERVAL = 5
 CONF_DEFAULT_BG_METRIC_TIME_INTERVAL = 15
 CONF_DEFAULT_BG_METRIC_STEP_LIMIT = 25_000
+CONF_DEFAULT_BG_METRIC_LATENESS = 60
+CONF_DEFAULT_BG_METRIC_ENGINE = 'python'
+CONF_DEFAULT_BG_ROLLUP_INTERVAL = 60
+# seconds to keep the per-execution metrics (`job_execution_metric`) after they are rolled up. The rollup
+# tiers only keep form-level aggregates, so per-execution metrics deleted by a retention are lost for good.
+# 0 keeps them indefinitely.
+CONF_DEFAULT_BG_ROLLUP_RETENTION = 0
+CONF_DEFAULT_BG_ROLLUP_TIERS = [
+    {'resolution': 60, 'retention': 30 * 86400},
+    {'resolution': 3600, 'retention': 365 * 86400},
+    {'resolution': 86400, 'retention': 0},
+]
+CONF_DEFAULT_BG_MAIL_INTERVAL = 5
+CONF_DEFAULT_BG_MAIL_LIMIT = 500
+
+CONF_DEFAULT_EMAIL_BATCH_SIZE = 50
+CONF_DEFAULT_EMAIL_MAX_ATTEMPTS = 5
+CONF_DEFAULT_EMAIL_RETRY_DELAY = 30
+
+CONF_DEFAULT_EVENT_BUFFER_SIZE = 100
+CONF_DEFAULT_EVENT_BUFFER_AGE = 1.0
+CONF_DEFAULT_EVENT_BUFFER_CAPACITY = 10_000
+CONF_DEFAULT_EVENT_BUFFER_DURABILITY = 'task'
+CONF_DEFAULT_EVENT_TRANSPORT = 'sql'
+CONF_DEFAULT_EVENT_ENCODING = 'json'
+
+CONF_DEFAULT_INSTANCE_CACHE_TTL = 30
+CONF_DEFAULT_INSTANCE_CACHE_CHECK_INTERVAL = 1.0
+
+CONF_DEFAULT_BLOB_STORE = 'database'
+CONF_DEFAULT_BLOB_STORE_PATH = APP_DIR_USER_DATA / 'blobs'
 
 CONF_DEFAULT_DB_CONN_PATH = APP_DIR_USER_DATA / 'model.db'
 CONF_DEFAULT_DB_CONN_URL = f'sqlite:///{CONF_DEFAULT_DB_CONN_PATH}'
@@ -162,6 +203,10 @@ class EmailNotificationConfig:
         self._enabled = config_dict.get('enabled', False)
         self.smtp_server = config_dict.get('smtpServer')
         self.sender = config_dict.get('sender')
+        self.batch_size = config_dict.get('batchSize', CONF_DEFAULT_EMAIL_BATCH_SIZE)
+        self.max_attempts = config_dict.get('maxAttempts', CONF_DEFAULT_EMAIL_MAX_ATTEMPTS)
+        self.retry_delay = config_dict.get('retryDelay', CONF_DEFAULT_EMAIL_RETRY_DELAY)
+        self.digest = config_dict.get('digest', False)
 
     @property
     def enabled(self):
@@ -176,6 +221,8 @@ class BackgroundTaskConfig:
         self.schedules = BackgroundTaskScheduleConfig(self.raw_config.get('schedules') or {})
         self.capacity = BackgroundTaskCapacityConfig(self.raw_config.get('capacity') or {})
         self.metrics = BackgroundTaskMetricConfig(self.raw_config.get('metrics') or {})
+        self.mail = BackgroundTaskMailConfig(self.raw_config.get('mail') or {})
+        self.rollups = BackgroundTaskRollupConfig(self.raw_config.get('rollups') or {})
 
 
 class BackgroundTaskEventsConfig:
@@ -184,6 +231,26 @@ class BackgroundTaskEventsConfig:
         self.raw_config = config_dict or {}
         self.interval = config_dict.get('interval', CONF_DEFAULT_BG_EVENT_INTERVAL)
         self.processing_limit = config_dict.get('limit', CONF_DEFAULT_BG_EVENT_PROCESS_LIMIT)
+        self.commit_size = config_dict.get('commitSize', CONF_DEFAULT_BG_EVENT_COMMIT_SIZE)
+        self.delete_chunk_size = config_dict.get('deleteChunkSize', CONF_DEFAULT_BG_EVENT_DELETE_CHUNK_SIZE)
+        self.partitions = int(
+            os.getenv('RIBERRY_EVENT_PARTITIONS') or config_dict.get('partitions', CONF_DEFAULT_BG_EVENT_PARTITIONS)
+        )
+        self.claim = os.getenv('RIBERRY_EVENT_CLAIM') or config_dict.get('claim', CONF_DEFAULT_BG_EVENT_CLAIM)
+        self.daemon = BackgroundTaskEventsDaemonConfig(config_dict.get('daemon') or {})
+
+
+class BackgroundTaskEventsDaemonConfig:
+
+    def __init__(self, config_dict):
+        self.raw_config = config_dict or {}
+        self.enabled: bool = bool(os.getenv('RIBERRY_EVENT_DAEMON') or config_dict.get('enabled', False))
+        self.min_batch: int = config_dict.get('minBatch', CONF_DEFAULT_BG_EVENT_DAEMON_MIN_BATCH)
+        self.max_batch: int = config_dict.get('maxBatch', CONF_DEFAULT_BG_EVENT_DAEMON_MAX_BATCH)
+        self.min_idle: float = config_dict.get('minIdle', CONF_DEFAULT_BG_EVENT_DAEMON_MIN_IDLE)
+        self.max_idle: float = config_dict.get('maxIdle', CONF_DEFAULT_BG_EVENT_DAEMON_MAX_IDLE)
+        self.notify: bool = bool(config_dict.get('notify', True))
+        self.notify_port: int = config_dict.get('notifyPort', CONF_DEFAULT_BG_EVENT_DAEMON_NOTIFY_PORT)
 
 
 class BackgroundTaskScheduleConfig:
@@ -207,6 +274,107 @@ class BackgroundTaskMetricConfig:
         self.interval: int = config_dict.get('interval', CONF_DEFAULT_BG_METRIC_INTERVAL)
         self.time_interval: int = config_dict.get('timeInterval', CONF_DEFAULT_BG_METRIC_TIME_INTERVAL)
         self.step_limit: int = config_dict.get('stepLimit', CONF_DEFAULT_BG_METRIC_STEP_LIMIT)
+        self.lateness: float = config_dict.get('lateness', CONF_DEFAULT_BG_METRIC_LATENESS)
+        self.engine: str = config_dict.get('engine', CONF_DEFAULT_BG_METRIC_ENGINE)
+
+
+class BackgroundTaskRollupConfig:
+
+    def __init__(self, config_dict):
+        self.raw_config = config_dict or {}
+        self.interval = config_dict.get('interval', CONF_DEFAULT_BG_ROLLUP_INTERVAL)
+        self.retention: int = config_dict.get('retention', CONF_DEFAULT_BG_ROLLUP_RETENTION)
+        self.tiers: List[Tuple[int, int]] = sorted(
+            (int(tier['resolution']), int(tier.get('retention', 0)))
+            for tier in config_dict.get('tiers', CONF_DEFAULT_BG_ROLLUP_TIERS)
+        )
+
+
+class BackgroundTaskMailConfig:
+
+    def __init__(self, config_dict):
+        self.raw_config = config_dict or {}
+        self.interval = config_dict.get('interval', CONF_DEFAULT_BG_MAIL_INTERVAL)
+        self.limit = config_dict.get('limit', CONF_DEFAULT_BG_MAIL_LIMIT)
+
+
+class EventBufferConfig:
+
+    def __init__(self, config_dict):
+        self.raw_config = config_dict or {}
+        self.enabled: bool = bool(config_dict.get('enabled', False))
+        self.size: int = config_dict.get('size', CONF_DEFAULT_EVENT_BUFFER_SIZE)
+        self.age: float = config_dict.get('age', CONF_DEFAULT_EVENT_BUFFER_AGE)
+        self.capacity: int = config_dict.get('capacity', CONF_DEFAULT_EVENT_BUFFER_CAPACITY)
+        self.durability: str = config_dict.get('durability', CONF_DEFAULT_EVENT_BUFFER_DURABILITY)
+
+
+class EventTransportConfig:
+
+    def __init__(self, config_dict):
+        self.raw_config = config_dict or {}
+        self.type = self.raw_config.get('type') or CONF_DEFAULT_EVENT_TRANSPORT
+        self._instance = None
+
+    @property
+    def instance(self):
+        if self._instance is None:
+            from riberry.celery.background.events.transport import transports
+            if self.type not in transports:
+                raise ValueError(f'EventTransportConfig.instance:: '
+                                 f'could not find event transport {self.type!r}')
+            self._instance = transports[self.type](self.raw_config)
+        return self._instance
+
+
+class EventsConfig:
+
+    def __init__(self, config_dict):
+        self.raw_config = config_dict or {}
+        self.buffer = EventBufferConfig(self.raw_config.get('buffer') or {})
+        self.transport = EventTransportConfig(self.raw_config.get('transport') or {})
+        self.encoding = self.raw_config.get('encoding') or CONF_DEFAULT_EVENT_ENCODING
+
+
+class InstanceCacheConfig:
+
+    def __init__(self, config_dict):
+        self.raw_config = config_dict or {}
+        self.enabled: bool = bool(self.raw_config.get('enabled', True))
+        self.ttl: float = self.raw_config.get('ttl', CONF_DEFAULT_INSTANCE_CACHE_TTL)
+        self.check_interval: float = self.raw_config.get('checkInterval', CONF_DEFAULT_INSTANCE_CACHE_CHECK_INTERVAL)
+
+
+class InstancesConfig:
+
+    def __init__(self, config_dict):
+        self.raw_config = config_dict or {}
+        self.cache = InstanceCacheConfig(self.raw_config.get('cache') or {})
+
+
+class BlobStoreConfig:
+
+    def __init__(self, config_dict):
+        self.raw_config = config_dict or {}
+        self.type = self.raw_config.get('type') or CONF_DEFAULT_BLOB_STORE
+        self._instance = None
+
+    @property
+    def instance(self):
+        if self._instance is None:
+            from riberry.blob import stores
+            if self.type not in stores:
+                raise ValueError(f'BlobStoreConfig.instance:: '
+                                 f'could not find artifact blob store {self.type!r}')
+            self._instance = stores[self.type](self.raw_config)
+        return self._instance
+
+
+class ArtifactsConfig:
+
+    def __init__(self, config_dict):
+        self.raw_config = config_dict or {}
+        self.store = BlobStoreConfig(self.raw_config.get('store') or {})
 
 
 class RiberryConfig:
@@ -223,6 +391,9 @@ class RiberryConfig:
 
         self.email = EmailNotificationConfig(email_config)
         self.background = BackgroundTaskConfig(self.raw_config.get('background') or {})
+        self.events = EventsConfig(self.raw_config.get('events') or {})
+        self.artifacts = ArtifactsConfig(self.raw_config.get('artifacts') or {})
+        self.instances = InstancesConfig(self.raw_config.get('instances') or {})
 
     @property
     def celery(self):
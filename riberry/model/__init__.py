@@ -1,9 +1,11 @@
 import os
-from typing import Union, Any
+from typing import Union, Any, Optional
 import sqlalchemy
 import sqlalchemy.orm
 import sqlalchemy.pool
 import sqlalchemy.engine
+import sqlalchemy.exc
+import sqlalchemy.schema
 
 from . import misc, application, group, auth, interface, job, base
 from ..util.misc import import_from_string
@@ -17,7 +19,9 @@ ScopedSessionExt = Union[sqlalchemy.orm.Session, sqlalchemy.orm.scoping.ScopedSe
 class __ModelProxy:
     raw_session: ScopedSessionExt = None
     raw_engine: sqlalchemy.engine.Engine = None
+    engine_config: dict = None
     _pid_created_in: int = os.getpid()
+    _detached_pools: list = []
 
     def _check_pid(self):
         """ Disposes SQLAlchemy engine if current process is a fork. """
@@ -50,6 +54,14 @@ class __ModelProxy:
         except:
             log.exception('riberry.model.conn:: Encountered an error while disposing current sqla engine')
 
+    def detach_engine(self):
+        """ Replaces the engine's connection pool in a forked process without closing the connections
+        inherited from the parent process, which are still in use there. """
+        self._pid_created_in = os.getpid()
+        self.raw_session.registry.clear()
+        self._detached_pools.append(self.raw_engine.pool)
+        self.raw_engine.pool = self.raw_engine.pool.recreate()
+
     def dispose_session(self):
         """ Disposes of the current SQLAlchemy session. """
         try:
@@ -61,7 +73,7 @@ class __ModelProxy:
 conn: Union[ScopedSessionExt, __ModelProxy] = __ModelProxy()
 
 
-def init(url='sqlite://', engine_settings=None, connection_arguments=None):
+def _create_engine(url, engine_settings, connection_arguments) -> sqlalchemy.engine.Engine:
     engine_defaults = dict(
         poolclass='sqlalchemy.pool:QueuePool',
         pool_use_lifo=True,
@@ -72,10 +84,81 @@ def init(url='sqlite://', engine_settings=None, connection_arguments=None):
     engine_settings['poolclass'] = import_from_string(engine_settings.pop('poolclass') or 'sqlalchemy.pool:QueuePool')
     connection_arguments = connection_arguments or {}
 
-    __ModelProxy.raw_engine = sqlalchemy.create_engine(
+    return sqlalchemy.create_engine(
         url,
         **engine_settings,
         connect_args=connection_arguments,
     )
+
+
+def init(url='sqlite://', engine_settings=None, connection_arguments=None):
+    __ModelProxy.engine_config = dict(
+        url=url,
+        engine_settings=engine_settings or {},
+        connection_arguments=connection_arguments or {},
+    )
+    __ModelProxy.raw_engine = _create_engine(**__ModelProxy.engine_config)
     __ModelProxy.raw_session = sqlalchemy.orm.scoped_session(sqlalchemy.orm.sessionmaker(bind=__ModelProxy.raw_engine))
     base.Base.metadata.create_all(__ModelProxy.raw_engine)
+
+
+def add_missing_columns(engine: sqlalchemy.engine.Engine):
+    """ Adds the nullable columns missing from existing tables.
+
+    `create_all` only creates missing tables, so columns added to an existing model (e.g.
+    `job_artifact_binary.store`) are added here with `ALTER TABLE ... ADD`. This is run
+    explicitly via `riberry admin model upgrade` rather than on `init`, so that workers
+    never alter the schema concurrently.
+    """
+
+    inspector = sqlalchemy.inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in base.Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            if not column.nullable:
+                log.warning(f'riberry.model:: Column {table.name}.{column.name} is missing and must be added manually')
+                continue
+
+            column_ddl = sqlalchemy.schema.CreateColumn(column).compile(dialect=engine.dialect)
+            try:
+                engine.execute(f'ALTER TABLE {table.name} ADD {column_ddl}')
+                log.info(f'riberry.model:: Added column {table.name}.{column.name}')
+            except sqlalchemy.exc.DBAPIError:
+                # another process may have added the column concurrently
+                log.exception(f'riberry.model:: Failed to add column {table.name}.{column.name}')
+
+
+def size_pool(pool_size: int, max_overflow: Optional[int] = None):
+    """ Re-creates the engine with a connection pool of the given size.
+
+    The pool's overflow is kept at the configured (or SQLAlchemy's default) `max_overflow` unless given.
+    Has no effect if the engine doesn't use a `QueuePool`, or if its pool size is configured explicitly.
+    """
+
+    engine = __ModelProxy.raw_engine
+    engine_settings = __ModelProxy.engine_config['engine_settings']
+    if not isinstance(engine.pool, sqlalchemy.pool.QueuePool) or 'pool_size' in engine_settings:
+        return
+    if engine.pool.size() == pool_size:
+        return
+
+    pool_settings = {'pool_size': pool_size}
+    if max_overflow is not None:
+        pool_settings['max_overflow'] = max_overflow
+
+    log.debug(f'riberry.model.conn:: Resizing connection pool to {pool_size} (overflow: {max_overflow})')
+    # sessions keep the bind they were created with, so the current session must not outlive the old engine
+    conn.dispose_session()
+    conn.dispose_engine()
+    __ModelProxy.raw_engine = _create_engine(
+        url=__ModelProxy.engine_config['url'],
+        engine_settings={**pool_settings, **engine_settings},
+        connection_arguments=__ModelProxy.engine_config['connection_arguments'],
+    )
+    __ModelProxy.raw_session.configure(bind=__ModelProxy.raw_engine)
@@ -62,6 +62,11 @@ class Form(base.Base):
         order_by=lambda: asc(model.job.JobExecutionMetric.epoch_end),
         back_populates='form',
     )
+    metric_rollups: List['model.job.JobExecutionMetricRollup'] = relationship(
+        'JobExecutionMetricRollup',
+        cascade='save-update, merge, delete, delete-orphan',
+        back_populates='form',
+    )
     document: 'model.misc.Document' = relationship(
         'Document',
         cascade='save-update, merge, delete, delete-orphan',
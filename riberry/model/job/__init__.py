@@ -3,7 +3,7 @@ import functools
 import json
 import mimetypes
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Iterator
 
 import pendulum
 from croniter import croniter
@@ -15,6 +15,7 @@ from sqlalchemy.orm import relationship, deferred, validates, foreign, remote
 
 from riberry import model
 from riberry.model import base
+from riberry.util.sketch import LogHistogram
 
 
 class ArtifactType(enum.Enum):
@@ -298,11 +299,70 @@ class JobExecutionMetric(base.Base):
     sum_duration: float = Column(Float, default=0, nullable=False)
     max_duration: float = Column(Float, default=0, nullable=False)
     min_duration: float = Column(Float, default=0, nullable=False)
+    raw_sketch: bytes = deferred(Column('sketch', Binary, nullable=True))
 
     # associations
     job_execution: 'JobExecution' = relationship('JobExecution', back_populates='metrics')
     form: 'model.interface.Form' = relationship('Form', back_populates='metrics')
 
+    @property
+    def sketch(self) -> LogHistogram:
+        """ Duration sketch of the steps within this metric (empty for metrics recorded before sketches). """
+        return LogHistogram.from_bytes(self.raw_sketch)
+
+    @sketch.setter
+    def sketch(self, value: LogHistogram):
+        self.raw_sketch = value.to_bytes()
+
+    @property
+    def sketch_partial(self) -> bool:
+        """ Whether the sketch only covers some of the metric's steps, e.g. after steps were aggregated
+        by the `sql` metric engine. """
+        return bool(self.raw_sketch) and self.sketch.count < self.count
+
+    @staticmethod
+    def merge_sketches(metrics: List['JobExecutionMetric']) -> LogHistogram:
+        sketch = LogHistogram()
+        for metric in metrics:
+            sketch.merge(metric.sketch)
+        return sketch
+
+
+class JobExecutionMetricRollup(base.Base):
+    """ Step duration metrics of a form, downsampled to a coarser `resolution` (in seconds) across executions. """
+
+    __tablename__ = 'job_execution_metric_rollup'
+    __reprattrs__ = ['form_id', 'resolution', 'stream_name', 'step_name']
+    __table_args__ = (
+        Index('j_e_m_r__idx_form_id', 'form_id', 'resolution', 'epoch_start'),
+        Index('j_e_m_r__idx_resolution', 'resolution', 'epoch_end'),
+    )
+
+    # columns
+    id = base.id_builder.build()
+    form_id = Column(base.id_builder.type, ForeignKey('form.id'), nullable=False)
+    resolution: int = Column(Integer, nullable=False)
+    epoch_start: int = Column(Integer, nullable=False)
+    epoch_end: int = Column(Integer, nullable=False)
+    stream_name: str = Column(String(64), nullable=False)
+    step_name: str = Column(String(64), nullable=False)
+    count: int = Column(Integer, default=0, nullable=False)
+    sum_duration: float = Column(Float, default=0, nullable=False)
+    max_duration: float = Column(Float, default=0, nullable=False)
+    min_duration: float = Column(Float, default=0, nullable=False)
+    raw_sketch: bytes = deferred(Column('sketch', Binary, nullable=True))
+
+    # associations
+    form: 'model.interface.Form' = relationship('Form', back_populates='metric_rollups')
+
+    @property
+    def sketch(self) -> LogHistogram:
+        return LogHistogram.from_bytes(self.raw_sketch)
+
+    @sketch.setter
+    def sketch(self, value: LogHistogram):
+        self.raw_sketch = value.to_bytes()
+
 
 class JobExecutionStream(base.Base):
     __tablename__ = 'job_stream'
@@ -350,6 +410,7 @@ class JobExecutionStreamStep(base.Base):
     __table_args__ = (
         Index('j_s_s__idx_stream_id', 'stream_id'),
         Index('j_s_s__idx_task_id', 'task_id'),
+        Index('j_s_s__idx_completed', 'completed'),
     )
 
     # columns
@@ -427,10 +488,21 @@ class JobExecutionArtifactBinary(base.Base):
     id = base.id_builder.build()
     binary: bytes = deferred(Column(Binary, nullable=True))
     artifact_id = Column(base.id_builder.type, ForeignKey('job_artifact.id'), nullable=False)
+    store: str = Column(String(32), nullable=True, comment='The blob store holding the content (NULL for legacy inline content).')
+    digest: str = Column(String(64), nullable=True, comment='The SHA-256 digest of the content.')
 
     # associations
     artifact: 'JobExecutionArtifact' = relationship('JobExecutionArtifact', back_populates='binary')
 
+    def chunks(self, chunk_size: Optional[int] = None) -> Iterator[bytes]:
+        """ Yields the content in chunks rather than loading it all at once. """
+
+        from riberry import blob
+        return blob.store(self.store or blob.DatabaseBlobStore.name).chunks(self, chunk_size or blob.CHUNK_SIZE)
+
+    def read(self) -> bytes:
+        return b''.join(self.chunks())
+
 
 class JobExecutionExternalTask(base.Base):
     __tablename__ = 'job_external_task'
@@ -3,12 +3,14 @@ import json
 from datetime import datetime
 from typing import List, Optional
 
-from sqlalchemy import Binary, String, Column, Float, ForeignKey, Boolean, DateTime, Index, Enum, UniqueConstraint, sql
+from sqlalchemy import Binary, String, Column, Float, ForeignKey, Boolean, DateTime, Index, Enum, UniqueConstraint, sql, \
+    Integer
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 
 from riberry import model
 from riberry.model import base
+from . import codec
 
 
 class ResourceType(enum.Enum):
@@ -45,6 +47,15 @@ class Event(base.Base):
     data: str = Column(String(1024))
     binary: bytes = Column(Binary)
 
+    _payload = None
+
+    @property
+    def payload(self):
+        """ The decoded event data (compact or legacy JSON), cached after the first access. """
+        if self._payload is None and self.data:
+            self._payload = codec.decode(self.data)
+        return self._payload
+
 
 class NotificationType(enum.Enum):
     info = 'info'
@@ -99,6 +110,48 @@ class NotificationTarget(base.Base):
     notification: 'Notification' = relationship('Notification', back_populates='targets')
 
 
+class OutboundEmail(base.Base):
+    __tablename__ = 'outbound_email'
+    __reprattrs__ = ['kind', 'subject', 'status']
+    __table_args__ = (
+        Index('o_e__idx_status_next_attempt', 'status', 'next_attempt'),
+    )
+
+    # columns
+    id = base.id_builder.build()
+    user_id = Column(base.id_builder.type, ForeignKey('users.id'), nullable=True)
+    kind: str = Column(String(32), nullable=False, default='custom')
+    sender: str = Column(String(256), nullable=False)
+    raw_recipients: str = Column('recipients', String(1024), nullable=False)
+    subject: str = Column(String(256), nullable=False)
+    raw_body: bytes = Column('body', Binary, nullable=False)
+    mime_type: str = Column(String(32), nullable=False, default='plain')
+    status: str = Column(String(24), nullable=False, default='PENDING')
+    attempts: int = Column(Integer, nullable=False, default=0)
+    created: datetime = Column(DateTime(timezone=True), default=base.utc_now, nullable=False)
+    next_attempt: datetime = Column(DateTime(timezone=True), default=base.utc_now, nullable=False)
+    error: Optional[str] = Column(String(1024), nullable=True)
+
+    # associations
+    user: 'model.auth.User' = relationship('User')
+
+    @property
+    def recipients(self) -> List[str]:
+        return json.loads(self.raw_recipients)
+
+    @recipients.setter
+    def recipients(self, value: List[str]):
+        self.raw_recipients = json.dumps(list(value))
+
+    @property
+    def body(self) -> str:
+        return self.raw_body.decode()
+
+    @body.setter
+    def body(self, value: str):
+        self.raw_body = value.encode()
+
+
 class MenuItem(base.Base):
     __tablename__ = 'menu_item'
 
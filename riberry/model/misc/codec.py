@@ -0,0 +1,113 @@
+""" Encoding of `Event.data`.
+
+Events are encoded either as legacy JSON or in the compact format below, and both are
+decoded transparently. Legacy JSON is the default; the compact format is enabled via the
+`events.encoding` config once every worker and the background processor can decode it.
+
+Compact format (version 1):
+
+    \\x01 <stream> \\x1f <step> \\x1f <state> \\x1f <tail>
+
+The fixed fields hold the `stream`, `step` and `state` keys when their values are plain
+strings (\\x1e otherwise). Well-known states are stored as a single character. All remaining
+keys are JSON-encoded into the tail, which is zlib-compressed and base85-encoded (prefixed
+with `z:`) if the encoded data would otherwise exceed `DATA_LIMIT` characters. Payloads
+which are not dicts fall back to legacy JSON.
+"""
+
+import base64
+import json
+import zlib
+from typing import Optional
+
+ENCODING_JSON = 'json'
+ENCODING_COMPACT = 'compact'
+ENCODINGS = (ENCODING_JSON, ENCODING_COMPACT)
+
+DATA_LIMIT = 1024
+
+VERSION_1 = '\x01'
+SEPARATOR = '\x1f'
+ABSENT = '\x1e'
+COMPRESSED_PREFIX = 'z:'
+FIXED_FIELDS = ('stream', 'step', 'state')
+
+STATE_CODES = {
+    'QUEUED': 'Q',
+    'ACTIVE': 'A',
+    'SUCCESS': 'S',
+    'FAILURE': 'F',
+    'RETRY': 'R',
+    'IGNORED': 'I',
+}
+STATES = {code: state for state, code in STATE_CODES.items()}
+
+_MISSING = object()
+
+
+class EventDataTooLarge(ValueError):
+    pass
+
+
+def _field(key: str, value) -> Optional[str]:
+    if value is _MISSING:
+        return ABSENT
+    if not isinstance(value, str) or SEPARATOR in value or ABSENT in value:
+        return None
+    if key == 'state':
+        if value in STATE_CODES:
+            return STATE_CODES[value]
+        if len(value) <= 1:
+            return None
+    return value
+
+
+def encode(payload, encoding: str = ENCODING_COMPACT) -> str:
+    """ Encodes the given event payload, raising `EventDataTooLarge` if it exceeds `DATA_LIMIT`. """
+
+    if encoding not in ENCODINGS:
+        raise ValueError(f'Event data encoding must be one of {", ".join(ENCODINGS)} (received {encoding!r})')
+
+    data = None
+    if encoding == ENCODING_COMPACT and isinstance(payload, dict):
+        tail, fields = dict(payload), []
+        for key in FIXED_FIELDS:
+            value = _field(key, tail.pop(key, _MISSING))
+            if value is None:
+                value, tail[key] = ABSENT, payload[key]
+            fields.append(value)
+
+        tail_data = json.dumps(tail, separators=(',', ':')) if tail else ''
+        data = VERSION_1 + SEPARATOR.join(fields + [tail_data])
+        if len(data) > DATA_LIMIT:
+            compressed = COMPRESSED_PREFIX + base64.b85encode(zlib.compress(tail_data.encode())).decode()
+            data = VERSION_1 + SEPARATOR.join(fields + [compressed])
+
+    if data is None:
+        data = json.dumps(payload)
+
+    if len(data) > DATA_LIMIT:
+        raise EventDataTooLarge(f'Encoded event data is {len(data)} characters, exceeding the limit of {DATA_LIMIT}')
+    return data
+
+
+def decode(data: Optional[str]):
+    """ Decodes event data in either the compact or legacy JSON format. """
+
+    if not data:
+        return None
+    if data[0] != VERSION_1:
+        return json.loads(data)
+
+    stream, step, state, tail = data[1:].split(SEPARATOR, 3)
+    if tail.startswith(COMPRESSED_PREFIX):
+        tail = zlib.decompress(base64.b85decode(tail[len(COMPRESSED_PREFIX):])).decode()
+
+    payload = json.loads(tail) if tail else {}
+    if stream != ABSENT:
+        payload['stream'] = stream
+    if step != ABSENT:
+        payload['step'] = step
+    if state != ABSENT:
+        payload['state'] = STATES.get(state, state)
+    return payload
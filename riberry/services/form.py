@@ -1,6 +1,7 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Iterable, Tuple
 
 from sqlalchemy import desc
+from sqlalchemy.orm import undefer
 
 from riberry import model, policy
 from riberry import services
@@ -97,3 +98,51 @@ def job_executions_by_id(form_id, limit=50):
         (model.job.JobExecution.job_id == model.job.Job.id) &
         (model.job.Job.form_id == form.id)
     ).order_by(desc(model.job.JobExecution.updated)).limit(limit).all()
+
+
+def step_duration_percentiles(
+        form_id,
+        epoch_start: Optional[int] = None,
+        epoch_end: Optional[int] = None,
+        quantiles: Iterable[float] = (0.5, 0.95, 0.99),
+) -> Dict[Tuple[str, str], Dict[float, Optional[float]]]:
+    """ Returns the step duration percentiles of the given form per (stream, step), merged across executions.
+
+    If a range is given, the metrics are read from the coarsest rollup tier which holds the range. Metrics
+    aggregated by the `sql` engine only contribute the steps their sketches cover.
+    """
+
+    from riberry.celery.background import rollups
+
+    form = form_by_id(form_id=form_id)
+    if epoch_start is not None and epoch_end is not None:
+        metrics = rollups.query(
+            form_id=form.id, epoch_start=epoch_start, epoch_end=epoch_end, resolution=epoch_end - epoch_start,
+        )[1]
+    else:
+        metric = model.job.JobExecutionMetric
+        metrics = metric.query().options(undefer('raw_sketch')).filter(metric.form_id == form.id)
+        if epoch_start is not None:
+            metrics = metrics.filter(metric.epoch_end > epoch_start)
+        if epoch_end is not None:
+            metrics = metrics.filter(metric.epoch_start < epoch_end)
+
+    grouped = {}
+    for job_metric in metrics:
+        grouped.setdefault((job_metric.stream_name, job_metric.step_name), []).append(job_metric)
+
+    quantiles = list(quantiles)
+    return {
+        key: model.job.JobExecutionMetric.merge_sketches(key_metrics).quantiles(quantiles)
+        for key, key_metrics in grouped.items()
+    }
+
+
+def form_metrics(form_id, epoch_start: int, epoch_end: int, resolution: Optional[int] = None):
+    """ Returns the resolution and step duration metric points of the given form, read from the coarsest
+    rollup tier suitable for the requested range. """
+
+    from riberry.celery.background import rollups
+
+    form = form_by_id(form_id=form_id)
+    return rollups.query(form_id=form.id, epoch_start=epoch_start, epoch_end=epoch_end, resolution=resolution)
@@ -1,5 +1,5 @@
 import riberry
-from riberry import model, policy
+from riberry import model, policy, blob
 
 
 @policy.context.post_authorize(action='view')
@@ -49,7 +49,7 @@ def cancel_job_execution(execution):
         category='Fatal',
         filename='fatal.log',
         size=len(message),
-        binary=model.job.JobExecutionArtifactBinary(binary=message),
+        binary=blob.store().create(message),
     )
     model.conn.add(artifact)
 
@@ -0,0 +1,192 @@
+""" Mergeable quantile sketch for step durations.
+
+`LogHistogram` counts values in logarithmically sized buckets (in the style of DDSketch), so that
+any quantile it reports is within `RELATIVE_ACCURACY` of the true value. Two sketches are merged
+by adding their bucket counts, which makes them suitable for combining metrics across buckets
+and executions at query time. The count, sum, min and max are tracked exactly.
+
+Serialized format (version 1, all integers as unsigned LEB128 varints):
+
+    \\x01 <count> <zero_count> <sum:f64> <min:f64> <max:f64> <buckets> (<index delta> <count>)*
+
+Bucket indices are zigzag-encoded deltas from the previous index.
+"""
+
+import math
+import struct
+from typing import Dict, Iterable, Optional, Tuple
+
+RELATIVE_ACCURACY = 0.01
+MIN_VALUE = 1e-3
+MAX_BUCKETS = 2048
+VERSION_1 = 1
+
+_DOUBLES = struct.Struct('<3d')
+
+
+def _write_varint(buffer: bytearray, value: int):
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            buffer.append(byte | 0x80)
+        else:
+            buffer.append(byte)
+            return
+
+
+def _read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    value, shift = 0, 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value // 2 if not value & 1 else -(value + 1) // 2
+
+
+class LogHistogram:
+    """ Quantile sketch with logarithmic buckets of relative width `RELATIVE_ACCURACY`. """
+
+    gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    _log_gamma = math.log(gamma)
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def __len__(self):
+        return self.count
+
+    def __eq__(self, other):
+        return isinstance(other, LogHistogram) and (
+            self.buckets, self.zero_count, self.count, self.sum, self.min, self.max
+        ) == (other.buckets, other.zero_count, other.count, other.sum, other.min, other.max)
+
+    def __repr__(self):
+        return f'LogHistogram(count={self.count}, min={self.min}, max={self.max})'
+
+    @classmethod
+    def of(cls, values: Iterable[float]) -> 'LogHistogram':
+        sketch = cls()
+        for value in values:
+            sketch.add(value)
+        return sketch
+
+    def index(self, value: float) -> int:
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def add(self, value: float, count: int = 1):
+        if value <= MIN_VALUE:
+            self.zero_count += count
+        else:
+            index = self.index(value)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+            if len(self.buckets) > MAX_BUCKETS:
+                self._collapse()
+
+        self.count += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: 'LogHistogram') -> 'LogHistogram':
+        """ Adds the counts of the other sketch to this sketch. """
+
+        if not other.count:
+            return self
+
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > MAX_BUCKETS:
+            self._collapse()
+
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def _collapse(self):
+        """ Merges the lowest buckets so that at most `MAX_BUCKETS` remain, trading accuracy for small values. """
+
+        indices = sorted(self.buckets)
+        excess = indices[:len(indices) - MAX_BUCKETS + 1]
+        target = indices[len(excess)]
+        self.buckets[target] += sum(self.buckets.pop(index) for index in excess)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """ Returns the approximate value at the given quantile (0 <= q <= 1), or None if empty. """
+
+        if not self.count:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return self.min
+
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def quantiles(self, qs: Iterable[float]) -> Dict[float, Optional[float]]:
+        return {q: self.quantile(q) for q in qs}
+
+    def to_bytes(self) -> bytes:
+        buffer = bytearray([VERSION_1])
+        _write_varint(buffer, self.count)
+        _write_varint(buffer, self.zero_count)
+        buffer += _DOUBLES.pack(self.sum, self.min or 0.0, self.max or 0.0)
+        _write_varint(buffer, len(self.buckets))
+        previous = 0
+        for index in sorted(self.buckets):
+            _write_varint(buffer, _zigzag(index - previous))
+            _write_varint(buffer, self.buckets[index])
+            previous = index
+        return bytes(buffer)
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]) -> 'LogHistogram':
+        sketch = cls()
+        if not data:
+            return sketch
+        if data[0] != VERSION_1:
+            raise ValueError(f'Unsupported sketch version {data[0]}')
+
+        sketch.count, offset = _read_varint(data, 1)
+        sketch.zero_count, offset = _read_varint(data, offset)
+        sketch.sum, min_value, max_value = _DOUBLES.unpack_from(data, offset)
+        offset += _DOUBLES.size
+        if sketch.count:
+            sketch.min, sketch.max = min_value, max_value
+
+        num_buckets, offset = _read_varint(data, offset)
+        index = 0
+        for _ in range(num_buckets):
+            delta, offset = _read_varint(data, offset)
+            count, offset = _read_varint(data, offset)
+            index += _unzigzag(delta)
+            sketch.buckets[index] = count
+        return sketch
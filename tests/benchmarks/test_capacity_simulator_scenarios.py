@@ -0,0 +1,64 @@
+""" Capacity distribution scenarios, run through the capacity simulator.
+
+Run with `RIBERRY_BENCHMARK=1 pytest -s tests/benchmarks`. Each scenario reports the utilization,
+queueing delay, fairness and Redis operations per second of both distribution strategies. The
+scenarios run against `RIBERRY_TEST_REDIS_URL` if reachable, otherwise an in-memory fake Redis.
+"""
+
+import json
+import os
+
+import pytest
+import redis
+
+from riberry.celery.background import capacity_simulator
+from riberry.model.application import CapacityDistributionStrategy
+
+pytestmark = pytest.mark.skipif(not os.getenv('RIBERRY_BENCHMARK'), reason='RIBERRY_BENCHMARK not set')
+
+DURATION = 3600
+
+SCENARIOS = {
+    'balanced': dict(
+        producers=[('db', 8), ('api', 8)],
+        weights={f'instance-{num}': 1 for num in range(4)},
+        arrival_rate=0.1,
+        mean_duration=30,
+    ),
+    'skewed': dict(
+        producers=[('db', 20), ('api', 4)],
+        weights={'heavy': 10, 'medium': 3, 'light': 1},
+        arrival_rate=0.2,
+        mean_duration=45,
+    ),
+    'many-consumers': dict(
+        producers=[(f'producer-{num}', 10) for num in range(10)],
+        weights={f'instance-{num}': num % 5 + 1 for num in range(50)},
+        arrival_rate=0.02,
+        mean_duration=60,
+    ),
+}
+
+
+def _connection():
+    try:
+        connection = redis.Redis.from_url(os.getenv('RIBERRY_TEST_REDIS_URL', 'redis://localhost'))
+        connection.ping()
+        return connection
+    except redis.ConnectionError:
+        return None
+
+
+@pytest.mark.parametrize('distribution_strategy', list(CapacityDistributionStrategy))
+@pytest.mark.parametrize('scenario', sorted(SCENARIOS))
+def test_capacity_scenario(scenario, distribution_strategy):
+    report = capacity_simulator.simulate(
+        distribution_strategy=distribution_strategy,
+        duration=DURATION,
+        connection=_connection(),
+        seed=1,
+        **SCENARIOS[scenario],
+    )
+    result = report.to_dict()
+    print(f'\n{scenario} ({distribution_strategy.value}): {json.dumps(result, indent=2)}')
+    assert result['arrived'] == result['completed']
@@ -0,0 +1,79 @@
+""" Throughput comparison of the event transports.
+
+Run with `RIBERRY_BENCHMARK=1 pytest -s tests/benchmarks`. The Redis transport is benchmarked
+against `RIBERRY_TEST_REDIS_URL` (default redis://localhost).
+"""
+
+import json
+import os
+import time
+
+import pytest
+import redis
+
+from riberry.celery.background.events import events, transport
+from riberry.model import misc
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+pytestmark = pytest.mark.skipif(not os.getenv('RIBERRY_BENCHMARK'), reason='RIBERRY_BENCHMARK not set')
+
+EVENT_COUNT = 10_000
+BATCH_SIZE = 100
+
+
+def _events():
+    yield dict(
+        name='stream', time=0.0, root_id='root', task_id='stream-task', binary=None,
+        data=json.dumps(dict(stream='Stream', state='ACTIVE')),
+    )
+    for num in range(1, EVENT_COUNT):
+        yield dict(
+            name='step', time=float(num), root_id='root', task_id=f'step-{num % 500}', binary=None,
+            data=json.dumps(dict(stream='Stream', step='step', state='ACTIVE')),
+        )
+
+
+def _benchmark(event_transport: transport.EventTransport):
+    rows = list(_events())
+
+    start = time.time()
+    for idx in range(0, len(rows), BATCH_SIZE):
+        event_transport.publish(rows[idx:idx + BATCH_SIZE])
+    publish_duration = time.time() - start
+
+    processed, process_duration = 0, 0.0
+    while True:
+        stats = events.process(event_limit=1000, transport=event_transport)
+        if not stats:
+            break
+        processed += stats.deleted
+        process_duration += stats.duration
+
+    print(
+        f'\n{event_transport.name}: published {len(rows)} events at {len(rows) / publish_duration:.0f} events/s, '
+        f'processed {processed} events at {processed / process_duration:.0f} events/s'
+    )
+    assert processed == len(rows)
+
+
+@pytest.mark.usefixtures('dummy_execution')
+class TestEventTransportThroughput:
+
+    def test_sql(self):
+        _benchmark(transport.SqlEventTransport())
+
+    def test_redis(self):
+        connection = redis.Redis.from_url(os.getenv('RIBERRY_TEST_REDIS_URL', 'redis://localhost'))
+        try:
+            connection.ping()
+        except redis.ConnectionError:
+            pytest.skip('Redis server not available')
+
+        redis_transport = transport.RedisEventTransport({'stream': 'riberry:benchmark:events'}, connection=connection)
+        connection.delete(redis_transport.stream)
+        try:
+            _benchmark(redis_transport)
+            assert misc.Event.query().count() == 0
+        finally:
+            connection.delete(redis_transport.stream)
@@ -0,0 +1,84 @@
+""" Throughput comparison of the metric engines.
+
+Run with `RIBERRY_BENCHMARK=1 pytest -s tests/benchmarks`. The number of steps defaults to one
+million and can be changed with `RIBERRY_BENCHMARK_STEPS`.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from riberry.celery.background import metrics
+from riberry.model import conn, job
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+pytestmark = pytest.mark.skipif(not os.getenv('RIBERRY_BENCHMARK'), reason='RIBERRY_BENCHMARK not set')
+
+STEP_COUNT = int(os.getenv('RIBERRY_BENCHMARK_STEPS', 1_000_000))
+STEP_LIMIT = 25_000
+INSERT_BATCH_SIZE = 50_000
+
+
+@pytest.fixture
+def steps(dummy_execution):
+    streams = [
+        job.JobExecutionStream(job_execution=dummy_execution, name=f'Stream {num}', task_id=f'stream-{num}')
+        for num in range(10)
+    ]
+    conn.add_all(streams)
+    conn.commit()
+
+    base = datetime(2020, 1, 1)
+    rows = (
+        dict(
+            stream_id=streams[num % len(streams)].id,
+            task_id=f'step-{num}',
+            name=f'step-{num % 20}',
+            status='SUCCESS',
+            created=base,
+            updated=base,
+            started=base + timedelta(milliseconds=num * 10),
+            completed=base + timedelta(milliseconds=num * 10 + num % 5000),
+        )
+        for num in range(STEP_COUNT)
+    )
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == INSERT_BATCH_SIZE:
+            conn.execute(job.JobExecutionStreamStep.__table__.insert(), batch)
+            batch = []
+    if batch:
+        conn.execute(job.JobExecutionStreamStep.__table__.insert(), batch)
+    conn.commit()
+
+
+def _benchmark(engine: str):
+    conn.query(job.JobExecutionMetric).delete()
+    metrics.Watermark().save()
+    conn.commit()
+
+    start = time.time()
+    runs = 0
+    while runs * STEP_LIMIT < STEP_COUNT:
+        metrics.process_metrics(time_interval=15, limit=STEP_LIMIT, lateness=60, engine=engine)
+        runs += 1
+    duration = time.time() - start
+
+    total = conn.query(job.JobExecutionMetric.count).all()
+    print(f'\n{engine}: aggregated {STEP_COUNT} steps in {duration:.2f}s ({STEP_COUNT / duration:.0f} steps/s)')
+    assert sum(count for count, in total) == STEP_COUNT
+
+
+@pytest.mark.usefixtures('steps')
+class TestMetricEngineThroughput:
+
+    def test_python(self):
+        _benchmark(metrics.ENGINE_PYTHON)
+
+    def test_sql(self):
+        _benchmark(metrics.ENGINE_SQL)
@@ -0,0 +1,196 @@
+import threading
+import time
+
+import pytest
+
+from riberry.app.backends.impl.celery.addons.capacity.priority_queue import PriorityQueue, LeaseRenewer
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')
+
+
+@pytest.fixture
+def connection():
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture
+def queue(connection):
+    queue = PriorityQueue(r=connection, key='test', blocking=False, lease_ttl=60)
+    queue.update({'a': 2, 'b': 1})
+    return queue
+
+
+def test_pop_leases_highest_score(queue):
+    lease = queue.pop()
+
+    assert (lease.member, lease.score, lease.version) == ('a', 1.0, 1)
+    assert dict(queue.items()) == {'a': 1.0, 'b': 1.0}
+    assert queue.leased_items() == [('a', 1.0)]
+
+
+def test_put_returns_lease(queue):
+    lease = queue.pop()
+
+    assert queue.put(member=lease.member, version=lease.version, token=lease.token)
+    assert not queue.put(member=lease.member, version=lease.version, token=lease.token)
+    assert queue.items() == [('a', 2.0), ('b', 1.0)]
+    assert queue.leased_items() == [('a', 0.0)]
+
+
+def test_put_without_token(queue):
+    lease = queue.pop()
+
+    assert queue.put(member=lease.member, version=lease.version)
+    assert queue.items() == [('a', 2.0), ('b', 1.0)]
+
+
+def test_expired_leases_reclaimed(queue, monkeypatch):
+    queue.pop()
+    queue.pop()
+    queue.pop()
+    assert dict(queue.items()) == {'a': 0.0, 'b': 0.0}
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    lease = queue.pop()
+
+    assert lease.member == 'a'
+    assert dict(queue.items()) == {'a': 1.0, 'b': 1.0}
+    assert dict(queue.leased_items()) == {'a': 1.0, 'b': 0.0}
+
+
+def test_empty_queue(connection):
+    queue = PriorityQueue(r=connection, key='empty', blocking=False)
+
+    with pytest.raises(ValueError):
+        queue.pop()
+    assert list(queue) == []
+
+
+def test_blocking_pop_woken_by_update(connection):
+    queue = PriorityQueue(r=connection, key='blocking', blocking=True, block_retry=5)
+    leases = []
+    thread = threading.Thread(target=lambda: leases.append(queue.pop()))
+    thread.start()
+
+    time.sleep(0.2)
+    start = time.time()
+    queue.update({'a': 1})
+    thread.join(timeout=5)
+
+    assert [lease.member for lease in leases] == ['a']
+    assert time.time() - start < 2
+
+
+def test_renew_extends_lease(queue, monkeypatch):
+    lease = queue.pop()
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 50)
+    assert queue.renew(lease)
+
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    queue.pop()
+    assert queue.put(member=lease.member, version=lease.version, token=lease.token)
+
+
+def test_renew_extends_superseded_version(queue, connection):
+    lease = queue.pop()
+    queue.update({'c': 3})
+    expiry_key = queue.generate_expiry_key(lease.version)
+    connection.pexpire(expiry_key, 100)
+    connection.pexpire(queue.generate_lease_key(lease.version), 100)
+
+    assert queue.renew(lease)
+    assert connection.pttl(expiry_key) > 100
+    assert connection.pttl(queue.generate_lease_key(lease.version)) > 100
+
+
+def test_stale_notifications_cleared(connection):
+    queue = PriorityQueue(r=connection, key='empty', blocking=False)
+    queue.update({})
+    assert connection.llen(queue.notify_key)
+
+    with pytest.raises(ValueError):
+        queue.pop()
+    assert not connection.llen(queue.notify_key)
+
+
+def test_renew_expired_lease(queue, monkeypatch):
+    lease = queue.pop()
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    queue.pop()
+
+    assert not queue.renew(lease)
+
+
+def test_multi_character_separator(connection):
+    queue = PriorityQueue(r=connection, key='test', sep='::', blocking=False)
+    queue.update({'a:b': 1})
+    lease = queue.pop()
+
+    assert lease.member == 'a:b'
+    assert queue.put(member=lease.member, version=lease.version, token=lease.token)
+    assert queue.items() == [('a:b', 1.0)]
+
+
+def test_pop_retries_after_update(queue, monkeypatch):
+    versions = iter([1])
+    monkeypatch.setattr(PriorityQueue, 'version', property(lambda self: next(versions, 2)))
+    queue.r.set(queue.version_key, 2)
+    queue.r.zadd(queue.generate_free_key(2), {'c': 1})
+
+    lease = queue.pop()
+    assert (lease.member, lease.version) == ('c', 2)
+
+
+def test_script_keys_hash_tagged(queue, connection):
+    queue.pop()
+    queue.update({'c': 3})
+
+    assert connection.keys('pq:test*') == []
+    assert all(k.startswith(b'pq:{test}:') for k in connection.keys('*'))
+
+
+def test_superseded_versions_collected(queue, connection):
+    lease = queue.pop()
+    queue.update({'c': 3})
+
+    assert sorted(k.decode() for k in connection.keys('pq:{test}:000000001:*')) == \
+        ['pq:{test}:000000001:expiry', 'pq:{test}:000000001:lease']
+
+    assert queue.put(member=lease.member, version=lease.version, token=lease.token)
+    assert connection.keys('pq:{test}:000000001:*') == []
+    assert queue.items() == [('c', 3.0)]
+
+
+def test_legacy_versions_collected(queue, connection):
+    connection.zadd('pq:{test}:000000000:free', {'x': 1})
+    connection.zadd('pq:{test}:000000000:lease', {'x': 1})
+    queue.update({'c': 3})
+    queue.collect_garbage()
+
+    assert sorted(k.decode() for k in connection.keys('pq:{test}:0*')) == ['pq:{test}:000000002:free']
+
+
+def test_untagged_versions_collected(queue, connection):
+    connection.set('pq:test:counter', 2)
+    for version in ('000000001', '000000002'):
+        connection.zadd(f'pq:test:{version}:free', {'x': 1})
+        connection.zadd(f'pq:test:{version}:lease', {'x': 1})
+    queue.collect_garbage()
+
+    assert sorted(k.decode() for k in connection.keys('pq:test:0*')) == \
+        ['pq:test:000000002:free', 'pq:test:000000002:lease']
+
+
+def test_lease_renewer(queue, connection):
+    lease = queue.pop()
+    expiry_key, lease_id = queue.generate_expiry_key(lease.version), f'{lease.token}:{lease.member}'
+    expiry = connection.zscore(expiry_key, lease_id)
+
+    with LeaseRenewer(queue=queue, lease=lease, interval=0.05):
+        time.sleep(0.2)
+
+    assert connection.zscore(expiry_key, lease_id) > expiry
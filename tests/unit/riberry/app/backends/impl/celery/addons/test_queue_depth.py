@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from riberry.app.backends.impl.celery.addons.queue_depth import QueueDepthSampler, PRIORITY_SEP
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture
+def connection():
+    connection = fakeredis.FakeRedis()
+    connection.rpush('celery', 'a', 'b')
+    connection.rpush(f'celery{PRIORITY_SEP}6', 'c')
+    connection.rpush('celery-other', 'd')
+    connection.set('default', 'not a list')
+    return connection
+
+
+@pytest.fixture
+def samples(monkeypatch):
+    sampled = []
+    sample = QueueDepthSampler.sample
+
+    def recording_sample(self, r, queue_names):
+        sampled.append(sorted(queue_names))
+        return sample(self, r, queue_names)
+
+    monkeypatch.setattr(QueueDepthSampler, 'sample', recording_sample)
+    return sampled
+
+
+def test_keys():
+    sampler = QueueDepthSampler(prefix='p:')
+    assert sampler.keys('celery') == ['p:celery'] + [f'p:celery{PRIORITY_SEP}{step}' for step in (3, 6, 9)]
+
+
+def test_from_transport_options():
+    sampler = QueueDepthSampler.from_transport_options({'priority_steps': list(range(10)), 'sep': ':'})
+    assert sampler.keys('q') == ['q'] + [f'q:{step}' for step in range(1, 10)]
+
+
+def test_sample(connection):
+    sampler = QueueDepthSampler()
+    assert sampler.sample(connection, ['celery', 'default', 'empty']) == {'celery': 3, 'default': 0, 'empty': 0}
+    assert not sampler.empty(connection, ['celery'])
+    assert sampler.empty(connection, ['default', 'empty'])
+
+
+def test_depths_cached(connection, samples):
+    sampler = QueueDepthSampler(cache_key='group:queue-depth', ttl=60)
+    other = QueueDepthSampler(cache_key='group:queue-depth', ttl=60)
+
+    assert sampler.depths(connection, ['celery']) == {'celery': 3}
+    connection.rpush('celery', 'e')
+    assert other.depths(connection, ['celery']) == {'celery': 3}
+    assert samples == [['celery']]
+
+    assert other.depths(connection, ['celery', 'celery-other']) == {'celery': 4, 'celery-other': 1}
+    assert samples == [['celery'], ['celery', 'celery-other']]
+
+
+def test_depths_expire(connection):
+    sampler = QueueDepthSampler(cache_key='group:queue-depth', ttl=0.01)
+
+    assert sampler.depths(connection, ['celery']) == {'celery': 3}
+    connection.rpush('celery', 'e')
+    time.sleep(0.02)
+    assert sampler.depths(connection, ['celery']) == {'celery': 4}
@@ -0,0 +1,91 @@
+import pytest
+
+from riberry.app.backends.impl.celery.addons import scale_policy
+from riberry.app.backends.impl.celery.addons.scale_policy import PredictiveScalePolicy, ScheduleScalePolicy
+from riberry.model import conn, job
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+NOW = 1_500_000_000
+
+
+def _add_metric(execution, epoch_start, count, sum_duration):
+    conn.add(job.JobExecutionMetric(
+        form_id=execution.job.form_id, job_execution=execution, stream_name='Stream', step_name='step',
+        epoch_start=epoch_start, epoch_end=epoch_start + 15, epoch_last=epoch_start,
+        count=count, sum_duration=sum_duration, min_duration=0, max_duration=sum_duration,
+    ))
+    conn.commit()
+
+
+def test_step_statistics(dummy_execution):
+    instance = dummy_execution.job.instance
+    assert scale_policy.step_statistics(instance.id, window=900, now=NOW) == (0.0, None)
+
+    _add_metric(dummy_execution, NOW - 60, count=60, sum_duration=300)
+    _add_metric(dummy_execution, NOW - 30, count=30, sum_duration=600)
+    _add_metric(dummy_execution, NOW - 3600, count=100, sum_duration=100)
+
+    rate, mean_duration = scale_policy.step_statistics(instance.id, window=900, now=NOW)
+    assert rate == pytest.approx(90 / 900)
+    assert mean_duration == pytest.approx(10)
+
+
+def test_schedule_policy():
+    assert ScheduleScalePolicy().group_concurrency(instance=None, limit=12, queue_depth=0) == 12
+    assert not ScheduleScalePolicy.uses_queue_depth
+    assert PredictiveScalePolicy.uses_queue_depth
+
+
+@pytest.fixture
+def policy(monkeypatch):
+    statistics = {'value': (0.5, 10.0)}
+    monkeypatch.setattr(scale_policy, 'step_statistics', lambda *_, **__: statistics['value'])
+    policy = PredictiveScalePolicy(drain_time=60, hysteresis=0.2, up_cooldown=5, down_cooldown=60, smoothing=1.0)
+    policy.statistics = statistics
+    return policy
+
+
+class _Instance:
+    id = 1
+
+
+def _concurrency(policy, queue_depth, now, limit=100):
+    return policy.group_concurrency(instance=_Instance(), limit=limit, queue_depth=queue_depth, now=now)
+
+
+def test_predictive_policy(policy):
+    # 0.5 steps/s * 10s + 120 queued * 10s / 60s
+    assert _concurrency(policy, queue_depth=120, now=NOW) == 25
+    assert _concurrency(policy, queue_depth=120, now=NOW, limit=10) == 10
+
+
+def test_predictive_policy_queue_growth(policy):
+    assert _concurrency(policy, queue_depth=0, now=NOW) == 5
+    # queue grew by 60 in 10s: (0.5 + 6) * 10 + 60 * 10 / 60
+    assert _concurrency(policy, queue_depth=60, now=NOW + 10) == 75
+
+
+def test_predictive_policy_without_history(policy):
+    policy.statistics['value'] = (0.0, None)
+    assert _concurrency(policy, queue_depth=10, now=NOW, limit=7) == 7
+
+
+def test_predictive_policy_hysteresis(policy):
+    assert _concurrency(policy, queue_depth=120, now=NOW) == 25
+
+    # within the hysteresis band or before the cooldown, the concurrency is kept
+    assert _concurrency(policy, queue_depth=120, now=NOW + 10) == 25
+    assert _concurrency(policy, queue_depth=100, now=NOW + 20) == 25
+    policy._queue_sample = None
+    assert _concurrency(policy, queue_depth=0, now=NOW + 50) == 25
+
+    policy._changed = NOW
+    assert _concurrency(policy, queue_depth=0, now=NOW + 61) == 5
+
+
+def test_predictive_policy_up_cooldown(policy):
+    assert _concurrency(policy, queue_depth=0, now=NOW) == 5
+    policy._queue_sample = None
+    assert _concurrency(policy, queue_depth=60, now=NOW + 1) == 5
+    assert _concurrency(policy, queue_depth=60, now=NOW + 6) == 15
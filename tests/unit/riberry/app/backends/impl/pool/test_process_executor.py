@@ -0,0 +1,87 @@
+import os
+import pickle
+
+import pytest
+
+from riberry.app import RiberryApplication
+from riberry.app.backends.impl.pool import RiberryPoolBackend
+from riberry.app.backends.impl.pool.task_queue import TaskQueue, Task, TaskDefinition
+from riberry.app.backends.impl.pool.task_queue.base import make_entry_task, make_receiver_task
+from riberry.app.backends.impl.pool.tasks import process
+from riberry.app.backends.impl.pool.tasks.process import ProcessTaskExecutor, TaskPayload
+from riberry.model import conn, job
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import dummy_user, dummy_execution, init_model
+
+
+def entry(): pass
+
+
+def receiver(_): pass
+
+
+def record_pid(payload: TaskPayload):
+    with open(os.environ['RIBERRY_TEST_PID_FILE'], 'a') as f:
+        f.write(f'{payload.task_id} {os.getpid()}\n')
+
+
+@pytest.fixture
+def app(dummy_execution, monkeypatch):
+    monkeypatch.setenv('RIBERRY_INSTANCE', 'instance')
+    app = RiberryApplication.__registered__.get('application') or RiberryApplication(
+        name='application', backend=RiberryPoolBackend())
+    app.entry_point('form', stream='Overall', step='Entry')(entry)
+    if 'receiver' not in app.backend.tasks:
+        app.register_task(receiver, name='receiver', stream='Overall', step='Receive', after='approval')
+    return app
+
+
+def round_trip(task: Task, backend) -> Task:
+    payload = pickle.loads(pickle.dumps(TaskPayload.from_task(task)))
+    return payload.to_task(backend=backend)
+
+
+def test_payload_entry_task(app, dummy_execution):
+    task = make_entry_task(execution_id=dummy_execution.id, root_id='root', entry_point=app.entry_points['form'])
+    resolved = round_trip(task, backend=app.backend)
+
+    assert (resolved.id, resolved.execution_id, resolved.root_id) == ('root', dummy_execution.id, 'root')
+    assert (resolved.definition.stream, resolved.definition.step) == ('Overall', 'Entry')
+    assert resolved.definition.func is entry
+
+
+def test_payload_receiver_task(app, dummy_execution):
+    external_task = job.JobExecutionExternalTask(job_execution=dummy_execution, name='approval', type='approval')
+    conn.add(external_task)
+    conn.commit()
+
+    task = make_receiver_task(backend=app.backend, external_task=external_task)
+    resolved = round_trip(task, backend=app.backend)
+
+    assert resolved.id == task.id
+    assert resolved.root_id == 'root'
+    assert (resolved.definition.stream, resolved.definition.step) == ('Overall', 'Receive')
+
+
+def test_recycles_children(tmp_path, monkeypatch):
+    pid_file = tmp_path / 'pids'
+    monkeypatch.setenv('RIBERRY_TEST_PID_FILE', str(pid_file))
+    monkeypatch.setattr(process, 'execute_payload', record_pid)
+
+    task_queue = TaskQueue(backend=None, limit=None)
+    executor = ProcessTaskExecutor(task_queue=task_queue, max_workers=1, max_tasks_per_child=1)
+    for i in range(3):
+        task_queue.counter.increment()
+        executor.submit(Task(
+            task_id=str(i),
+            execution_id=1,
+            definition=TaskDefinition(func=None, name=str(i), stream='stream', step=str(i), options={}),
+            origin=('entry', 'form'),
+        ))
+    executor.drain()
+
+    executed = dict(line.split() for line in pid_file.read_text().splitlines())
+    assert sorted(executed) == ['0', '1', '2']
+    assert len(set(executed.values())) == 3
+    assert os.getpid() not in map(int, executed.values())
+    assert task_queue.counter.value == 0
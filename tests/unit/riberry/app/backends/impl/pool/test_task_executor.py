@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+import riberry
+from riberry.app.backends.impl.pool.task_queue import TaskQueue, Task, TaskDefinition
+from riberry.app.backends.impl.pool.tasks import executor
+from riberry.app.backends.impl.pool.tasks.executor import TaskExecutor, execution_listener
+
+
+class Executed(list):
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+
+@pytest.fixture
+def executed(monkeypatch):
+    executed = Executed()
+
+    def execute_in_session(task):
+        executed.release.wait(timeout=5)
+        if task.definition.func is None:
+            raise ValueError(task.id)
+        executed.append((task.id, threading.current_thread().name, riberry.model.conn.raw_session()))
+
+    monkeypatch.setattr(executor, 'execute_in_session', execute_in_session)
+    return executed
+
+
+@pytest.fixture
+def task_queue():
+    return TaskQueue(backend=None, limit=None)
+
+
+def submit(task_queue, task_id, func=print):
+    task_queue.queue.put_nowait(Task(
+        task_id=task_id,
+        execution_id=1,
+        definition=TaskDefinition(func=func, name=task_id, stream='stream', step=task_id, options={}),
+    ))
+    task_queue.counter.increment()
+
+
+def test_bounded_workers(task_queue, executed):
+    task_executor = TaskExecutor(task_queue=task_queue, max_workers=2)
+    for i in range(6):
+        submit(task_queue, task_id=str(i))
+        execution_listener(task_queue, task_executor)
+
+    assert task_queue.queue.empty()
+    executed.release.set()
+    task_executor.drain()
+
+    assert sorted(task_id for task_id, _, _ in executed) == list(map(str, range(6)))
+    assert len({thread_name for _, thread_name, _ in executed}) <= 2
+    assert task_queue.counter.value == 0
+
+
+def test_session_per_task(task_queue, executed):
+    task_executor = TaskExecutor(task_queue=task_queue, max_workers=1)
+    for i in range(3):
+        submit(task_queue, task_id=str(i))
+    executed.release.set()
+    task_executor.drain()
+
+    assert len({id(session) for _, _, session in executed}) == 3
+
+
+def test_drain_runs_queued_tasks(task_queue, executed):
+    task_executor = TaskExecutor(task_queue=task_queue, max_workers=2)
+    submit(task_queue, task_id='failing', func=None)
+    submit(task_queue, task_id='queued')
+    executed.release.set()
+    task_executor.drain()
+
+    assert [task_id for task_id, _, _ in executed] == ['queued']
+    assert task_queue.counter.value == 0
+    assert task_executor._pool is None
@@ -0,0 +1,96 @@
+import pytest
+
+from riberry import config
+from riberry.app.util.events import EventBuffer, create_event
+from riberry.celery.background.events.transport import EventTransport
+from riberry.model import conn, misc, group as group_model
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model
+
+
+class FailingTransport(EventTransport):
+    name = 'failing'
+
+    def publish(self, events):
+        raise ConnectionError('transport unavailable')
+
+
+@pytest.fixture
+def failing_transport(monkeypatch):
+    monkeypatch.setattr(config.config.events.transport, '_instance', FailingTransport())
+
+
+def _event(num):
+    return dict(name='step', time=float(num), root_id='root', task_id=f'task-{num}', data='{}', binary=None)
+
+
+def _event_count():
+    conn.expire_all()
+    return misc.Event.query().count()
+
+
+class TestEventBuffer:
+
+    def test_events_held_until_size_reached(self):
+        buffer = EventBuffer(enabled=True, size=3, age=60)
+        buffer.add(_event(1))
+        buffer.add(_event(2))
+        assert _event_count() == 0
+        assert len(buffer) == 2
+
+        buffer.add(_event(3))
+        assert _event_count() == 3
+        assert len(buffer) == 0
+
+    def test_flush_preserves_order(self):
+        buffer = EventBuffer(enabled=True, size=10, age=60)
+        for num in range(5):
+            buffer.add(_event(num))
+        buffer.flush()
+
+        events = misc.Event.query().order_by(misc.Event.id.asc()).all()
+        assert [event.task_id for event in events] == [f'task-{num}' for num in range(5)]
+
+    def test_task_complete_flushes_in_task_mode(self):
+        buffer = EventBuffer(enabled=True, size=10, age=60, durability=EventBuffer.DURABILITY_TASK)
+        buffer.add(_event(1))
+        buffer.task_complete()
+        assert _event_count() == 1
+
+    def test_task_complete_ignored_in_lazy_mode(self):
+        buffer = EventBuffer(enabled=True, size=10, age=60, durability=EventBuffer.DURABILITY_LAZY)
+        buffer.add(_event(1))
+        buffer.task_complete()
+        assert _event_count() == 0
+
+    def test_failed_flush_is_bounded_by_capacity(self):
+        buffer = EventBuffer(enabled=True, size=10, age=60, capacity=3)
+        for num in range(5):
+            buffer.add({**_event(num), 'name': None})
+        buffer.flush()
+
+        assert _event_count() == 0
+        assert len(buffer) == 3
+
+    def test_task_complete_raises_on_failed_flush(self):
+        buffer = EventBuffer(enabled=True, size=10, age=60, durability=EventBuffer.DURABILITY_TASK)
+        buffer.add({**_event(1), 'name': None})
+
+        with pytest.raises(Exception):
+            buffer.task_complete()
+        assert len(buffer) == 1
+
+    def test_invalid_durability(self):
+        with pytest.raises(ValueError):
+            EventBuffer(durability='never')
+
+
+def test_failed_publish_falls_back_to_event_table(failing_transport):
+    group = group_model.Group(name='group')
+    conn.add(group)
+
+    create_event('step', root_id='root', task_id='task', data={})
+
+    conn.expire_all()
+    assert [event.task_id for event in misc.Event.query().all()] == ['task']
+    assert group_model.Group.query().filter_by(name='group').count() == 1
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event as sqla_event, inspect
+
+from riberry.app.util.instance_cache import InstanceCache
+from riberry.model import conn, application
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+NOW = 1_500_000_000
+
+
+@pytest.fixture
+def instance(dummy_execution):
+    instance = dummy_execution.job.instance
+    instance.heartbeat = application.Heartbeat(updated=datetime(2020, 1, 1))
+    conn.add(application.ApplicationInstanceSchedule(instance=instance, parameter='concurrency', value='4'))
+    conn.commit()
+    return instance
+
+
+@pytest.fixture
+def statements():
+    executed = []
+
+    def before_cursor_execute(*args):
+        executed.append(args[2])
+
+    sqla_event.listen(conn.raw_engine, 'before_cursor_execute', before_cursor_execute)
+    yield executed
+    sqla_event.remove(conn.raw_engine, 'before_cursor_execute', before_cursor_execute)
+
+
+class TestInstanceCache:
+
+    def test_snapshot_detached(self, instance):
+        snapshot = InstanceCache().get('instance', now=NOW)
+        conn.remove()
+
+        assert inspect(snapshot).detached
+        assert snapshot.application.internal_name == 'application'
+        assert snapshot.active_schedule_value('concurrency') == '4'
+        assert snapshot.heartbeat.updated == datetime(2020, 1, 1)
+
+    def test_snapshot_does_not_detach_session_instance(self, instance):
+        InstanceCache().get('instance', now=NOW)
+        assert inspect(instance).persistent
+
+    def test_cached_within_check_interval(self, instance, statements):
+        cache = InstanceCache(ttl=30, check_interval=1)
+        snapshot = cache.get('instance', now=NOW)
+        statements.clear()
+
+        assert cache.get('instance', now=NOW + 0.5) is snapshot
+        assert statements == []
+
+    def test_heartbeat_refreshed(self, instance, statements):
+        cache = InstanceCache(ttl=30, check_interval=1)
+        snapshot = cache.get('instance', now=NOW)
+
+        instance.heartbeat.updated = datetime(2020, 1, 1) + timedelta(seconds=5)
+        conn.commit()
+        statements.clear()
+
+        assert cache.get('instance', now=NOW + 1) is snapshot
+        assert len(statements) == 1
+        assert snapshot.heartbeat.updated == datetime(2020, 1, 1, 0, 0, 5)
+
+    def test_reloaded_on_schedule_change(self, instance):
+        cache = InstanceCache(ttl=30, check_interval=1)
+        snapshot = cache.get('instance', now=NOW)
+
+        conn.add(application.ApplicationInstanceSchedule(
+            instance=instance, parameter='concurrency', value='8', priority=100))
+        conn.commit()
+
+        assert cache.get('instance', now=NOW + 0.5) is snapshot
+        reloaded = cache.get('instance', now=NOW + 1)
+        assert reloaded is not snapshot
+        assert reloaded.active_schedule_value('concurrency') == '8'
+
+    def test_reloaded_after_ttl(self, instance):
+        cache = InstanceCache(ttl=30, check_interval=1)
+        snapshot = cache.get('instance', now=NOW)
+
+        assert cache.get('instance', now=NOW + 29) is snapshot
+        assert cache.get('instance', now=NOW + 30) is not snapshot
+
+    def test_invalidate(self, instance):
+        cache = InstanceCache()
+        snapshot = cache.get('instance', now=NOW)
+        cache.invalidate()
+
+        assert cache.get('instance', now=NOW) is not snapshot
+
+    def test_disabled(self, instance, monkeypatch):
+        monkeypatch.setenv('RIBERRY_INSTANCE', 'instance')
+        assert InstanceCache(enabled=False).get('instance') is instance
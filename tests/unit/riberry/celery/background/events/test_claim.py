@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from riberry.celery.background.events import claim, events
+from riberry.model import conn, misc, job
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+
+def _add_event(time, root_id, task_id=None):
+    data = json.dumps(dict(stream='Stream', state='QUEUED'))
+    conn.add(misc.Event(name='stream', time=time, root_id=root_id, task_id=task_id or f'{root_id}-stream', data=data))
+
+
+@pytest.fixture
+def executions(dummy_execution):
+    other = job.JobExecution(job=dummy_execution.job, creator=dummy_execution.creator, task_id='other')
+    conn.add(other)
+    conn.commit()
+    return {execution.id % 2: execution for execution in (dummy_execution, other)}
+
+
+def _remaining_root_ids():
+    conn.expire_all()
+    return {event.root_id for event in misc.Event.query()}
+
+
+class TestEventClaim:
+
+    def test_partitions_disjoint(self, executions):
+        for execution in executions.values():
+            _add_event(1, execution.task_id)
+        _add_event(2, 'unknown')
+        conn.commit()
+
+        events.process(partition=1, partitions=2)
+        assert _remaining_root_ids() == {executions[0].task_id, 'unknown'}
+
+        events.process(partition=0, partitions=2)
+        assert _remaining_root_ids() == set()
+        assert job.JobExecutionStream.query().count() == 2
+
+    def test_skip_locked_falls_back_on_sqlite(self, executions):
+        assert claim.effective_mode(claim.CLAIM_SKIP_LOCKED, dialect_name='sqlite') == claim.CLAIM_PARTITION
+        assert claim.effective_mode(claim.CLAIM_SKIP_LOCKED, dialect_name='postgresql') == claim.CLAIM_SKIP_LOCKED
+
+        for execution in executions.values():
+            _add_event(1, execution.task_id)
+        conn.commit()
+
+        events.process(partition=0, partitions=2, claim=claim.CLAIM_SKIP_LOCKED)
+        assert _remaining_root_ids() == {executions[1].task_id}
+
+    def test_invalid_partition(self, dummy_execution):
+        with pytest.raises(ValueError):
+            claim.EventClaim(partition=2, partitions=2)
+
+    def test_queue_names(self):
+        assert claim.queue_name(0, 1, claim.CLAIM_PARTITION) == claim.EVENT_QUEUE
+        assert claim.queue_name(1, 4, claim.CLAIM_PARTITION) == f'{claim.EVENT_QUEUE}.1'
+        assert claim.queue_name(1, 4, claim.CLAIM_SKIP_LOCKED) == claim.EVENT_QUEUE
+
+    def test_skip_locked_chunks_keep_executions_together(self, executions, monkeypatch):
+        monkeypatch.setattr(claim, 'effective_mode', lambda mode, dialect_name: claim.CLAIM_SKIP_LOCKED)
+        event_claim = claim.EventClaim()
+
+        for time in range(3):
+            _add_event(time * 2, executions[0].task_id, task_id=f'a-{time}')
+            _add_event(time * 2 + 1, executions[1].task_id, task_id=f'b-{time}')
+        conn.commit()
+        pending = misc.Event.query().order_by(misc.Event.time.asc()).all()
+
+        chunks = list(event_claim.chunks(pending, size=2))
+        assert [[event.task_id for event in chunk] for chunk in chunks] == [
+            ['a-0', 'a-1', 'a-2'],
+            ['b-0', 'b-1', 'b-2'],
+        ]
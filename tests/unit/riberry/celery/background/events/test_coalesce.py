@@ -0,0 +1,83 @@
+import json
+
+import pendulum
+import pytest
+
+from riberry.celery.background.events import events
+from riberry.celery.background.events.coalesce import StateTransition
+from riberry.model import conn, misc, job
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+
+def _add_events(stream, sequence):
+    for name, time, state in sequence:
+        data = dict(stream=stream, state=state, step='step')
+        task_id = f'{stream}-stream' if name == 'stream' else f'{stream}-step'
+        conn.add(misc.Event(name=name, time=time, root_id='root', task_id=task_id, data=json.dumps(data)))
+    conn.commit()
+
+
+def _process_individually():
+    while events.process(event_limit=1):
+        pass
+
+
+def _state(stream_name):
+    stream = job.JobExecutionStream.query().filter_by(name=stream_name).one()
+    step = job.JobExecutionStreamStep.query().filter_by(stream=stream).one()
+    return [
+        (entity.status, entity.created, entity.started, entity.completed, entity.updated)
+        for entity in (stream, step)
+    ]
+
+
+@pytest.mark.usefixtures('dummy_execution')
+class TestCoalesce:
+
+    first_run = [
+        ('stream', 10.0, 'QUEUED'),
+        ('stream', 11.0, 'ACTIVE'),
+        ('step', 12.0, 'QUEUED'),
+        ('step', 20.0, 'ACTIVE'),
+    ]
+
+    second_run = [
+        ('step', 15.5, 'SUCCESS'),
+        ('stream', 16.0, 'ACTIVE'),
+        ('step', 20.0, 'FAILURE'),
+        ('step', 21.000000_4, 'ACTIVE'),
+        ('step', 21.000000_1, 'SUCCESS'),
+        ('stream', 30.0, 'SUCCESS'),
+    ]
+
+    def test_coalesced_matches_sequential(self):
+        _add_events('sequential', self.first_run)
+        _process_individually()
+        _add_events('sequential', self.second_run)
+        _process_individually()
+
+        _add_events('coalesced', self.first_run)
+        events.process()
+        _add_events('coalesced', self.second_run)
+        assert events.process().deleted == len(self.second_run)
+
+        assert _state('coalesced') == _state('sequential')
+
+    def test_net_transition(self):
+        _add_events('stream', [('stream', 1.0, 'ACTIVE')])
+        _add_events('stream', [('step', 2.0, 'QUEUED'), ('step', 3.0, 'ACTIVE'), ('step', 4.0, 'SUCCESS')])
+        events.process()
+
+        step = job.JobExecutionStreamStep.query().one()
+        assert step.status == 'SUCCESS'
+        assert [pendulum.instance(value, tz='utc').timestamp() for value in (
+            step.created, step.started, step.completed, step.updated
+        )] == [2.0, 3.0, 4.0, 4.0]
+
+    def test_stale_events_ignored(self):
+        stale = misc.Event(name='step', time=1.0, data=json.dumps(dict(state='ACTIVE')))
+        transition = StateTransition.fold(
+            [stale], updated=pendulum.from_timestamp(2.0), started=None, keep_first_start=False,
+        )
+        assert transition.state is transition.started is transition.completed is None
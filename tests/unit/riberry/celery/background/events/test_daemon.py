@@ -0,0 +1,92 @@
+import json
+import socket
+
+from riberry import config
+from riberry.celery.background.events import daemon, transport, wakeup
+from riberry.model import conn, misc
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model
+
+
+class RecordingWakeup(wakeup.Wakeup):
+
+    def __init__(self):
+        self.timeouts = []
+
+    def wait(self, timeout):
+        self.timeouts.append(timeout)
+        return False
+
+
+def _add_events(count):
+    for num in range(count):
+        data = json.dumps(dict(stream='Stream', state='ACTIVE'))
+        conn.add(misc.Event(name='stream', time=float(num), root_id='unknown', task_id=f'task-{num}', data=data))
+    conn.commit()
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_adaptive_batch():
+    batch = daemon.AdaptiveBatch(minimum=10, maximum=50, initial=20)
+    assert [batch.update(fetched) for fetched in (20, 40, 40, 30, 5, 2, 0)] == [40, 50, 50, 50, 25, 12, 10]
+
+
+def test_backoff():
+    backoff = daemon.Backoff(minimum=0.5, maximum=3)
+    assert [backoff.next() for _ in range(5)] == [0.5, 1, 2, 3, 3]
+    backoff.reset()
+    assert backoff.next() == 0.5
+
+
+def test_backlog_processed_without_waiting():
+    _add_events(35)
+    recording_wakeup = RecordingWakeup()
+    event_daemon = daemon.EventDaemon(
+        batch=daemon.AdaptiveBatch(minimum=5, maximum=20),
+        backoff=daemon.Backoff(minimum=0.01, maximum=1),
+        wakeup=recording_wakeup,
+    )
+
+    event_daemon.run(iterations=3)
+    assert misc.Event.query().count() == 0
+    assert recording_wakeup.timeouts == []
+    assert event_daemon.batch.size == 20
+
+    event_daemon.run(iterations=2)
+    assert recording_wakeup.timeouts == [0.01, 0.02]
+    assert event_daemon.batch.size == 5
+
+
+def test_published_events_wake_daemon(monkeypatch):
+    port = _free_port()
+    monkeypatch.setattr(config.config.background.events.daemon, 'enabled', True)
+    monkeypatch.setattr(config.config.background.events.daemon, 'notify_port', port)
+    monkeypatch.setattr(wakeup, '_publisher', None)
+
+    listener = wakeup.create()
+    try:
+        assert isinstance(listener, wakeup.SocketWakeup)
+        assert listener.wait(0) is False
+
+        transport.SqlEventTransport().publish([dict(
+            name='stream', time=0.0, root_id='root', task_id='task', binary=None, data=None,
+        )])
+        assert listener.wait(5) is True
+        assert listener.wait(0) is False
+    finally:
+        listener.close()
+        wakeup._publisher.close()
+
+
+def test_publishers_notify_without_daemon_enabled(monkeypatch):
+    monkeypatch.setattr(config.config.background.events.daemon, 'enabled', False)
+
+    assert type(wakeup.create()) is wakeup.Wakeup
+    publisher = wakeup.create(publisher=True)
+    assert isinstance(publisher, wakeup.SocketWakeup)
+    assert publisher.partitions == wakeup.MIN_NOTIFY_PARTITIONS
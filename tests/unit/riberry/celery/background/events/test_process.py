@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from riberry.celery.background.events import events
+from riberry.model import conn, misc, job
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+
+def _add_event(name, time, task_id, root_id='root', **data):
+    conn.add(misc.Event(name=name, time=time, root_id=root_id, task_id=task_id, data=json.dumps(data)))
+
+
+def _add_step_events(stream, step, task_id, start_time):
+    for offset, state in enumerate(('QUEUED', 'ACTIVE', 'SUCCESS')):
+        _add_event('step', start_time + offset, task_id, stream=stream, step=step, state=state)
+
+
+@pytest.mark.usefixtures('dummy_execution')
+class TestProcess:
+
+    def test_streams_and_steps_applied(self):
+        _add_event('stream', 1, 'stream-task', stream='Stream', state='QUEUED')
+        _add_event('stream', 2, 'stream-task', stream='Stream', state='ACTIVE')
+        _add_step_events(stream='Stream', step='step', task_id='step-task', start_time=3)
+        _add_event('stream', 10, 'stream-task', stream='Stream', state='SUCCESS')
+        conn.commit()
+
+        events.process()
+
+        stream = job.JobExecutionStream.query().one()
+        step = job.JobExecutionStreamStep.query().one()
+        assert stream.status == 'SUCCESS'
+        assert stream.started and stream.completed
+        assert step.status == 'SUCCESS'
+        assert step.stream == stream
+        assert step.started and step.completed
+        assert misc.Event.query().count() == 0
+
+    def test_events_for_unknown_execution_removed(self):
+        _add_event('stream', 1, 'task', root_id='unknown', stream='Stream', state='QUEUED')
+        conn.commit()
+
+        events.process()
+
+        assert job.JobExecutionStream.query().count() == 0
+        assert misc.Event.query().count() == 0
+
+    def test_query_count_independent_of_batch_size(self):
+        _add_event('stream', 0, 'stream-task', stream='Stream', state='ACTIVE')
+        conn.commit()
+        events.process()
+
+        def queries_for(step_count, time_offset):
+            for num in range(step_count):
+                _add_event('step', time_offset, f'task-{time_offset}-{num}', stream='Stream', step='s', state='QUEUED')
+            conn.commit()
+            events.process()
+
+            for num in range(step_count):
+                _add_event('step', time_offset + 1, f'task-{time_offset}-{num}', stream='Stream', step='s', state='ACTIVE')
+            conn.commit()
+            return events.process().queries
+
+        assert queries_for(step_count=5, time_offset=100) == queries_for(step_count=50, time_offset=200)
+
+    def test_processed_in_chunks(self):
+        _add_event('stream', 0, 'stream-task', stream='Stream', state='ACTIVE')
+        for num in range(10):
+            _add_event('step', num + 1, f'task-{num}', stream='Stream', step='step', state='QUEUED')
+        conn.commit()
+
+        stats = events.process(commit_size=3, delete_chunk_size=2)
+
+        assert stats.events == stats.deleted == 11
+        assert job.JobExecutionStreamStep.query().count() == 10
+        assert misc.Event.query().count() == 0
+
+    def test_failing_event_isolated_from_chunk(self, monkeypatch):
+        handle_steps = events.handlers['step']
+
+        def failing_handle_steps(step_events, index):
+            if any(event.task_id == 'bad' for event in step_events):
+                raise ValueError('Invalid event')
+            return handle_steps(step_events, index)
+
+        monkeypatch.setitem(events.handlers, 'step', failing_handle_steps)
+
+        _add_event('stream', 0, 'stream-task', stream='Stream', state='ACTIVE')
+        _add_event('step', 1, 'good-1', stream='Stream', step='step', state='QUEUED')
+        _add_event('step', 2, 'bad', stream='Stream', step='step', state='QUEUED')
+        _add_event('step', 3, 'good-2', stream='Stream', step='step', state='QUEUED')
+        conn.commit()
+
+        stats = events.process()
+
+        assert stats.deleted == 3
+        assert {step.task_id for step in job.JobExecutionStreamStep.query()} == {'good-1', 'good-2'}
+        assert [event.task_id for event in misc.Event.query()] == ['bad']
@@ -0,0 +1,85 @@
+import json
+import time
+
+import pytest
+from click.testing import CliRunner
+
+from riberry.celery.background.events import events, stats
+from riberry.cli.commands.events import events as events_command
+from riberry.model import conn, misc
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+
+def _add_event(name, age, task_id, **data):
+    conn.add(misc.Event(name=name, time=time.time() - age, root_id='root', task_id=task_id, data=json.dumps(data)))
+
+
+@pytest.fixture
+def processed(dummy_execution):
+    _add_event('stream', 10, 'stream-task', stream='Stream', state='ACTIVE')
+    _add_event('step', 5, 'step-1', stream='Stream', step='step', state='QUEUED')
+    _add_event('step', 4, 'step-2', stream='Stream', step='step', state='QUEUED')
+    conn.commit()
+    return events.process()
+
+
+class TestEventStats:
+
+    def test_run_stats(self, processed):
+        assert processed.oldest_event_age >= 10
+        assert processed.handlers['stream'].events == processed.handlers['stream'].deleted == 1
+        assert processed.handlers['step'].events == processed.handlers['step'].deleted == 2
+        assert processed.handlers['step'].latency_max >= 5
+        assert processed.latency_max >= 10
+
+    def test_recorded_summary(self, processed):
+        _add_event('step', 1, 'step-3', stream='Stream', step='step', state='QUEUED')
+        conn.commit()
+        events.process()
+
+        summary = stats.summary()
+        assert summary['runs'] == 2
+        assert summary['pending']['count'] == 0
+        assert summary['totals']['step']['deleted'] == 3
+        assert summary['last']['0']['events'] == 1
+        assert len(stats.history(partition=0)) == 2
+
+    def test_recorded_per_partition(self, processed):
+        stats.record(stats.ProcessingStats(), partition=2)
+
+        resources = misc.ResourceData.query().filter(misc.ResourceData.name.like(f'{stats.STATS_RESOURCE_NAME}.%'))
+        assert sorted((resource.resource_id, resource.name) for resource in resources) == [
+            (0, f'{stats.STATS_RESOURCE_NAME}.0'),
+            (2, f'{stats.STATS_RESOURCE_NAME}.2'),
+        ]
+        assert stats.summary()['runs'] == 2
+
+    def test_unkeyed_resource_adopted(self):
+        resource = misc.ResourceData(resource_type=misc.ResourceType.misc, name=f'{stats.STATS_RESOURCE_NAME}.0')
+        resource.value = {'runs': 5, 'totals': {}, 'history': [{}]}
+        conn.add(resource)
+        conn.commit()
+        stats.record(stats.ProcessingStats())
+
+        conn.expire_all()
+        resource = misc.ResourceData.query().filter_by(name=f'{stats.STATS_RESOURCE_NAME}.0').one()
+        assert resource.resource_id == 0
+        assert resource.value['runs'] == 6
+        assert len(stats.history()) == 2
+
+    def test_pending(self, dummy_execution):
+        _add_event('step', 30, 'step-1', stream='Stream', step='step', state='QUEUED')
+        conn.commit()
+
+        pending = stats.pending()
+        assert pending['count'] == 1
+        assert pending['oldest_event_age'] >= 30
+
+    def test_prometheus_cli(self, processed):
+        result = CliRunner().invoke(events_command, ['stats', '--format', 'prometheus'])
+
+        assert result.exit_code == 0, result.output
+        assert '# TYPE riberry_events_deleted_total counter' in result.output
+        assert 'riberry_events_deleted_total{handler="step"} 2' in result.output
+        assert 'riberry_events_pending 0' in result.output
@@ -0,0 +1,172 @@
+import json
+import os
+
+import pytest
+import redis
+
+from riberry import config
+from riberry.celery.background.events import events, transport
+from riberry.model import misc, job
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+
+def _event(time, task_id, **data):
+    return dict(
+        name='step', time=float(time), root_id='root', task_id=task_id, binary=None,
+        data=json.dumps(dict(stream='Stream', step='step', **data)),
+    )
+
+
+def _stream_event():
+    return dict(
+        name='stream', time=0.0, root_id='root', task_id='stream-task', binary=None,
+        data=json.dumps(dict(stream='Stream', state='ACTIVE')),
+    )
+
+
+class ListConsumer(transport.EventConsumer):
+
+    def __init__(self, *events):
+        self.events = [misc.Event(**event) for event in events]
+        self.acknowledged = []
+
+    def fetch(self, limit=None, query_extension=None):
+        return self.events[:limit] if limit else list(self.events)
+
+    def acknowledge(self, events, chunk_size):
+        self.acknowledged += events
+        return len(events)
+
+
+@pytest.fixture
+def fake_redis_transport():
+    fakeredis = pytest.importorskip('fakeredis')
+    return transport.RedisEventTransport({'partitionsTtl': 0}, connection=fakeredis.FakeRedis())
+
+
+@pytest.fixture
+def redis_transport():
+    try:
+        connection = redis.Redis.from_url(os.getenv('RIBERRY_TEST_REDIS_URL', 'redis://localhost'))
+        connection.ping()
+    except redis.ConnectionError:
+        fakeredis = pytest.importorskip('fakeredis')
+        connection = fakeredis.FakeRedis()
+
+    redis_transport = transport.RedisEventTransport({'stream': 'riberry:test:events'}, connection=connection)
+    try:
+        connection.delete(redis_transport.stream)
+        connection.xadd(redis_transport.stream, {'probe': 1})
+        connection.delete(redis_transport.stream)
+    except redis.ResponseError:
+        pytest.skip('Redis server does not support streams')
+
+    yield redis_transport
+    connection.delete(redis_transport.stream)
+
+
+class TestSqlEventTransport:
+
+    def test_publish_and_process(self, dummy_execution):
+        transport.SqlEventTransport().publish([_stream_event(), _event(1, 'step-task', state='QUEUED')])
+        assert misc.Event.query().count() == 2
+
+        stats = events.process(transport=transport.SqlEventTransport())
+
+        assert stats.deleted == 2
+        assert job.JobExecutionStreamStep.query().one().status == 'QUEUED'
+        assert misc.Event.query().count() == 0
+
+
+class TestMergedEventConsumer:
+
+    def test_sources_processed_in_one_ordered_pass(self, dummy_execution):
+        transport.SqlEventTransport().publish([_stream_event()])
+        stream_consumer = ListConsumer(_event(1, 'step-task', state='QUEUED'))
+        consumer = transport.MergedEventConsumer([stream_consumer, transport.SqlEventTransport().consumer()])
+
+        events.process_chunk(consumer.fetch(), delete_chunk_size=100, consumer=consumer)
+
+        assert job.JobExecutionStreamStep.query().one().status == 'QUEUED'
+        assert [event.task_id for event in stream_consumer.acknowledged] == ['step-task']
+        assert misc.Event.query().count() == 0
+
+    def test_full_batches_cut_off_at_latest_event(self):
+        transport.SqlEventTransport().publish([_event(0.5, 'sql-1'), _event(3, 'sql-2')])
+        consumer = transport.MergedEventConsumer([
+            ListConsumer(_event(1, 'stream-1'), _event(2, 'stream-2'), _event(4, 'stream-3')),
+            transport.SqlEventTransport().consumer(),
+        ])
+
+        assert [event.task_id for event in consumer.fetch(limit=2)] == ['sql-1', 'stream-1', 'stream-2']
+        assert [event.task_id for event in consumer.fetch()] == ['sql-1', 'stream-1', 'stream-2', 'sql-2', 'stream-3']
+
+
+class TestRedisEventTransport:
+
+    def test_publishers_follow_recorded_partitions(self, fake_redis_transport, monkeypatch):
+        monkeypatch.setattr(config.config.background.events, 'partitions', 1)
+        assert fake_redis_transport.published_partitions() == 1
+
+        fake_redis_transport.register_partitions(4)
+        assert fake_redis_transport.published_partitions() == 4
+
+    def test_fallback_events_partitioned_by_root(self, fake_redis_transport):
+        roots = [f'root-{num}' for num in range(8)]
+        transport.SqlEventTransport().publish([{**_event(num, f'task-{num}'), 'root_id': root_id}
+                                               for num, root_id in enumerate(roots)])
+
+        read = [
+            [event.root_id for event in transport.FallbackEventConsumer(
+                fake_redis_transport, partition=partition, partitions=2).fetch()]
+            for partition in range(2)
+        ]
+        assert sorted(read[0] + read[1]) == roots
+        assert all(fake_redis_transport.partition(root_id, 2) == 1 for root_id in read[1])
+
+    def test_encode_decode(self):
+        event = {**_event(1.25, 'step-task', state='QUEUED'), 'binary': b'\x00\x01'}
+        fields = transport.RedisEventTransport.encode(event)
+        decoded = transport.RedisEventTransport.decode({
+            key.encode(): value if isinstance(value, bytes) else value.encode() for key, value in fields.items()
+        })
+
+        assert decoded.id is None
+        assert (decoded.name, decoded.time, decoded.root_id, decoded.task_id, decoded.binary) == \
+               ('step', 1.25, 'root', 'step-task', b'\x00\x01')
+        assert decoded.payload == json.loads(event['data'])
+
+    def test_publish_and_process(self, dummy_execution, redis_transport):
+        redis_transport.publish([_stream_event(), _event(1, 'step-task', state='QUEUED')])
+
+        stats = events.process(transport=redis_transport)
+
+        assert stats.deleted == 2
+        assert job.JobExecutionStreamStep.query().one().status == 'QUEUED'
+        assert misc.Event.query().count() == 0
+        assert redis_transport.connection.xlen(redis_transport.stream) == 0
+
+    def test_unprocessed_events_redelivered(self, dummy_execution, redis_transport, monkeypatch):
+        handle_steps = events.handlers['step']
+        monkeypatch.setitem(events.handlers, 'step', lambda *_: [])
+        redis_transport.publish([_stream_event(), _event(1, 'step-task', state='QUEUED')])
+
+        assert events.process(transport=redis_transport).deleted == 1
+        assert job.JobExecutionStreamStep.query().count() == 0
+
+        monkeypatch.setitem(events.handlers, 'step', handle_steps)
+        assert events.process(transport=redis_transport).deleted == 1
+        assert job.JobExecutionStreamStep.query().count() == 1
+        assert redis_transport.connection.xlen(redis_transport.stream) == 0
+
+    def test_pending_reads_capped(self, redis_transport):
+        redis_transport.pending_read_count = 1
+        redis_transport.publish([_event(i, f'task-{i}', state='QUEUED') for i in range(3)])
+        consumer = redis_transport.consumer()
+
+        assert [event.task_id for event in consumer.fetch(limit=2)] == ['task-0', 'task-1']
+
+        redis_transport.publish([_event(3, 'task-3', state='QUEUED')])
+        assert [event.task_id for event in consumer.fetch(limit=2)] == ['task-0', 'task-2']
+        assert [event.task_id for event in consumer.fetch(limit=2)] == ['task-1', 'task-3']
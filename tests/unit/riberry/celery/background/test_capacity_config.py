@@ -0,0 +1,111 @@
+import itertools
+import random
+from collections import Counter
+
+import pytest
+
+from riberry.celery.background import capacity_config
+from riberry.celery.background.capacity_config import CapacityConsumer, CapacityProducer, ConsumerStatus
+from riberry.model import conn, application, interface, job
+from riberry.model.application import CapacityDistributionStrategy
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+
+def _name_pool_allocations(producers, capacities, distribution_strategy):
+    """ Reference allocation, slicing a pool holding one name per unit of capacity. """
+
+    name_lists = sorted([[producer.name] * producer.capacity for producer in producers], key=len, reverse=True)
+    if distribution_strategy == CapacityDistributionStrategy.spread:
+        name_lists = [filter(None, name_list) for name_list in itertools.zip_longest(*name_lists)]
+    pool = list(itertools.chain.from_iterable(name_lists))
+
+    allocations = []
+    for capacity in capacities:
+        allocations.append(Counter(pool[:capacity]))
+        pool = pool[capacity:]
+    return allocations
+
+
+@pytest.mark.parametrize('distribution_strategy', list(CapacityDistributionStrategy))
+def test_producer_allocation_matches_name_pool(distribution_strategy):
+    rng = random.Random(42)
+    for _ in range(200):
+        producers = [CapacityProducer(f'p{num}', rng.randint(0, 12)) for num in range(rng.randint(0, 6))]
+        total = CapacityProducer.total_capacity(producers)
+        capacities = [rng.randint(0, max(total // 2, 1)) for _ in range(rng.randint(1, 5))]
+
+        assert CapacityProducer.allocate(producers, capacities, distribution_strategy) == \
+            _name_pool_allocations(producers, capacities, distribution_strategy)
+
+
+def test_consumer_allocation_uses_largest_remainder():
+    consumers = [
+        CapacityConsumer('a', ConsumerStatus.active, 1),
+        CapacityConsumer('b', ConsumerStatus.active, 1),
+        CapacityConsumer('c', ConsumerStatus.active, 1),
+        CapacityConsumer('d', ConsumerStatus.inactive, 5),
+    ]
+    allocation = CapacityConsumer.allocate(consumers, total_capacity=10)
+
+    assert {consumer.name: capacity for consumer, capacity in allocation.items()} == {'a': 4, 'b': 3, 'c': 3, 'd': 0}
+
+
+def test_consumer_allocation_inactive():
+    consumers = [CapacityConsumer('a', ConsumerStatus.inactive, 1)]
+    assert list(CapacityConsumer.allocate(consumers, total_capacity=10).values()) == [0]
+
+
+@pytest.fixture
+def instances(dummy_execution):
+    instance = dummy_execution.job.instance
+    instance.heartbeat = application.Heartbeat()
+    other = application.ApplicationInstance(
+        application=instance.application, name='Other', internal_name='other', heartbeat=application.Heartbeat())
+    other_form = interface.Form(application=instance.application, instance=other, name='Other', internal_name='other')
+    other_job = job.Job(form=other_form, creator=dummy_execution.creator, name='Other')
+    conn.add(job.JobExecution(job=other_job, creator=dummy_execution.creator, task_id='other', status='READY'))
+
+    for inst, weight in ((instance, 1), (other, 3)):
+        conn.add(application.ApplicationInstanceSchedule(instance=inst, parameter='weight', value=str(weight)))
+    conn.commit()
+    return instance, other
+
+
+def _update_capacities():
+    capacity_config.update_instance_capacities(
+        producers=[CapacityProducer('x', 6), CapacityProducer('y', 2)],
+        weight_parameter='weight',
+        capacity_parameter='capacity',
+        producer_parameter='producers',
+        distribution_strategy=CapacityDistributionStrategy.binpack,
+    )
+    conn.commit()
+
+
+def test_update_instance_capacities(instances):
+    instance, other = instances
+    _update_capacities()
+
+    assert instance.active_schedule_value('capacity') == '2'
+    assert instance.active_schedule_value('producers') == 'x|2'
+    assert other.active_schedule_value('capacity') == '6'
+    assert other.active_schedule_value('producers') == 'x|4 y|2'
+
+
+def test_update_instance_capacities_unchanged(instances):
+    _update_capacities()
+    schedule_ids = sorted(sched.id for sched in application.ApplicationInstanceSchedule.query().all())
+
+    _update_capacities()
+    assert sorted(sched.id for sched in application.ApplicationInstanceSchedule.query().all()) == schedule_ids
+
+
+def test_execution_count_for_instances(instances):
+    instance, other = instances
+    conn.add(job.JobExecution(job=instance.forms[0].jobs[0], creator=instance.forms[0].jobs[0].creator, status='SUCCESS'))
+    conn.commit()
+
+    assert dict(capacity_config.execution_count_for_instances([instance, other])) == {'instance': 1, 'other': 1}
+    assert dict(capacity_config.execution_count_for_instances([other])) == {'other': 1}
+    assert dict(capacity_config.execution_count_for_instances([])) == {}
@@ -0,0 +1,85 @@
+import pytest
+
+from riberry.celery.background import capacity_simulator
+from riberry.model import conn, application
+from riberry.model.application import CapacityDistributionStrategy
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')
+
+
+@pytest.mark.parametrize('distribution_strategy', list(CapacityDistributionStrategy))
+def test_simulate(distribution_strategy):
+    report = capacity_simulator.simulate(
+        producers=[('x', 3), ('y', 2)],
+        weights={'a': 1, 'b': 4},
+        distribution_strategy=distribution_strategy,
+        duration=600,
+        arrival_rate=0.05,
+        mean_duration=20,
+        seed=7,
+    )
+    result = report.to_dict()
+
+    assert result['arrived'] == result['completed'] > 0
+    assert result['unserved'] == 0
+    assert len(report.delays) == result['completed']
+    assert 0 < result['utilization'] <= 1
+    assert 0 < result['fairness'] <= 1
+    assert result['reallocations'] > 0
+    assert result['redis_commands']['EVALSHA'] >= 2 * result['completed']
+
+
+def test_simulate_without_capacity():
+    report = capacity_simulator.simulate(
+        producers=[('x', 0)],
+        weights={'a': 1},
+        distribution_strategy=CapacityDistributionStrategy.binpack,
+        duration=300,
+        arrival_rate=0.05,
+        seed=3,
+    )
+
+    assert report.arrived > 0
+    assert report.completed == 0
+    assert report.unserved == report.arrived
+
+
+def test_simulate_is_deterministic():
+    kwargs = dict(
+        producers=[('x', 2)], weights={'a': 1, 'b': 1}, distribution_strategy=CapacityDistributionStrategy.binpack,
+        duration=300, seed=3,
+    )
+    first, second = capacity_simulator.simulate(**kwargs), capacity_simulator.simulate(**kwargs)
+
+    assert first.delays == second.delays
+    assert first.busy_time == second.busy_time
+
+
+def test_fairness():
+    report = capacity_simulator.SimulationReport(duration=10, total_capacity=1)
+    report.weights = {'a': 1, 'b': 2}
+    report.served.update({'a': 5.0, 'b': 10.0})
+    assert report.fairness == pytest.approx(1.0)
+
+    report.served.update({'a': 10.0, 'b': 0.0})
+    assert report.fairness == pytest.approx(0.5)
+
+
+def test_redis_ops_per_simulated_second():
+    report = capacity_simulator.SimulationReport(duration=10, total_capacity=1)
+    report.redis_commands.update({'EVALSHA': 40, 'BLPOP': 10})
+    report.wall_time = 0.5
+
+    assert report.redis_ops_per_second == pytest.approx(5.0)
+
+
+def test_weights_from_schedules(dummy_execution):
+    instance = dummy_execution.job.instance
+    conn.add(application.ApplicationInstanceSchedule(instance=instance, parameter='weight', value='3'))
+    conn.commit()
+
+    assert capacity_simulator.weights_from_schedules('weight') == {'instance': 3}
+    assert capacity_simulator.weights_from_schedules('other') == {}
@@ -0,0 +1,149 @@
+import asyncore
+import json
+import smtplib
+import smtpd
+import threading
+
+import pytest
+
+from riberry import config
+from riberry.celery.background import mail
+from riberry.celery.background.events import events
+from riberry.model import conn, misc
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+
+class RecordingSMTPServer(smtpd.SMTPServer):
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), None)
+        self.messages = []
+        self.connections = 0
+
+    @property
+    def host(self):
+        return '{}:{}'.format(*self.socket.getsockname())
+
+    def handle_accepted(self, conn, addr):
+        self.connections += 1
+        super().handle_accepted(conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.messages.append((mailfrom, rcpttos, data))
+
+
+@pytest.fixture
+def smtp_server():
+    server = RecordingSMTPServer()
+    thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.close()
+    thread.join(timeout=1)
+
+
+def _enqueue(num, user=None, kind='custom'):
+    mail.enqueue(
+        body=f'Body {num}', mime_type='plain', subject=f'Subject {num}', sender='riberry@example.com',
+        recipients=['user@example.com'], kind=kind, user=user,
+    )
+    conn.commit()
+
+
+def _queued():
+    conn.expire_all()
+    return misc.OutboundEmail.query().all()
+
+
+class TestEnqueue:
+
+    def test_long_subject_truncated(self):
+        email = mail.enqueue(body='Body', mime_type='plain', subject='s' * 300, sender='riberry@example.com',
+                             recipients=['user@example.com'])
+
+        assert len(email.subject) == 256
+        assert email.subject.endswith('...')
+
+    def test_too_many_recipients_dropped(self):
+        recipients = [f'user-{num}@example.com' for num in range(100)]
+
+        assert mail.enqueue(body='Body', mime_type='plain', subject='Subject', sender='riberry@example.com',
+                            recipients=recipients) is None
+        assert _queued() == []
+
+
+class TestMailSender:
+
+    def test_batches_share_connections(self, smtp_server):
+        for num in range(5):
+            _enqueue(num)
+
+        sent = mail.MailSender(host=smtp_server.host, batch_size=2).send()
+
+        assert sent == 5
+        assert len(smtp_server.messages) == 5
+        assert smtp_server.connections == 3
+        assert _queued() == []
+
+    def test_failed_messages_retried_with_backoff(self):
+        def unavailable(host):
+            raise smtplib.SMTPConnectError(421, 'unavailable')
+
+        _enqueue(1)
+        sender = mail.MailSender(host='localhost', max_attempts=2, retry_delay=60, smtp_factory=unavailable)
+
+        assert sender.send() == 0
+        email, = _queued()
+        assert (email.status, email.attempts) == ('PENDING', 1)
+        assert sender.due() == []
+
+        email.next_attempt = email.created
+        conn.commit()
+        assert sender.send() == 0
+        email, = _queued()
+        assert (email.status, email.attempts) == ('FAILED', 2)
+        assert 'unavailable' in email.error
+
+    def test_connect_failure_defers_batch(self):
+        connects = []
+
+        def unavailable(host):
+            connects.append(host)
+            raise smtplib.SMTPConnectError(421, 'unavailable')
+
+        for num in range(3):
+            _enqueue(num)
+        sender = mail.MailSender(host='localhost', retry_delay=60, smtp_factory=unavailable)
+
+        assert sender.send() == 0
+        assert connects == ['localhost']
+        assert sorted(email.attempts for email in _queued()) == [0, 0, 1]
+        assert sender.due() == []
+
+    def test_workflow_emails_digested(self, smtp_server, dummy_user):
+        _enqueue(1, user=dummy_user, kind='workflow_started')
+        _enqueue(2, user=dummy_user, kind='workflow_complete')
+        _enqueue(3, user=dummy_user)
+
+        assert mail.MailSender(host=smtp_server.host, digest=True).send() == 2
+
+        subjects = sorted(data.decode().split('Subject: ')[1].splitlines()[0] for _, _, data in smtp_server.messages)
+        assert subjects == ['Riberry / 2 execution updates', 'Subject 3']
+        assert _queued() == []
+
+    def test_notifications_queued_not_sent(self, dummy_execution, monkeypatch):
+        monkeypatch.setattr(config.config.email, '_enabled', True)
+        monkeypatch.setattr(config.config.email, 'smtp_server', 'unreachable.invalid')
+        monkeypatch.setattr(config.config.email, 'sender', 'riberry@example.com')
+        dummy_execution.creator.details.email = 'johndoe@example.com'
+
+        data = json.dumps(dict(type='workflow_started', data={}))
+        conn.add(misc.Event(name='notify', time=1.0, root_id='root', task_id='root', data=data))
+        conn.commit()
+        events.process()
+
+        email, = _queued()
+        assert (email.kind, email.recipients, email.user) == (
+            'workflow_started', ['johndoe@example.com'], dummy_execution.creator
+        )
@@ -0,0 +1,191 @@
+import pendulum
+import pytest
+
+from riberry.celery.background import metrics
+from riberry.model import conn, job
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+BASE_TIME = 1_500_000_000
+
+
+@pytest.fixture(params=[metrics.ENGINE_PYTHON, metrics.ENGINE_SQL])
+def engine(request):
+    return request.param
+
+
+@pytest.fixture
+def stream(dummy_execution):
+    stream = job.JobExecutionStream(job_execution=dummy_execution, name='Stream', task_id='stream-task')
+    conn.add(stream)
+    conn.commit()
+    return stream
+
+
+def _add_step(stream, name, started, completed):
+    conn.add(job.JobExecutionStreamStep(
+        stream=stream,
+        task_id=f'{name}-{started}-{completed}',
+        name=name,
+        status='SUCCESS',
+        started=pendulum.from_timestamp(BASE_TIME + started, tz='utc'),
+        completed=pendulum.from_timestamp(BASE_TIME + completed, tz='utc'),
+    ))
+    conn.commit()
+
+
+def _metrics():
+    conn.expire_all()
+    return {
+        (metric.epoch_start - BASE_TIME, metric.step_name): (
+            metric.count, metric.sum_duration, metric.min_duration, metric.max_duration
+        )
+        for metric in job.JobExecutionMetric.query().all()
+    }
+
+
+def test_to_timestamp():
+    assert metrics.to_timestamp(pendulum.datetime(2020, 1, 1, 10, tz='Australia/Melbourne').add(microseconds=5)) == \
+        pendulum.datetime(2019, 12, 31, 23, tz='utc').timestamp() + 0.000005
+    assert metrics.to_timestamp(pendulum.naive(2020, 1, 1)) == pendulum.datetime(2020, 1, 1).timestamp()
+
+
+def test_steps_processed_once(stream, engine):
+    _add_step(stream, 'a', started=0, completed=2)
+    _add_step(stream, 'a', started=1, completed=5)
+    _add_step(stream, 'b', started=0, completed=20)
+    metrics.process_metrics(time_interval=15, limit=100, lateness=60, engine=engine)
+    metrics.process_metrics(time_interval=15, limit=100, lateness=60, engine=engine)
+
+    assert _metrics() == {(0, 'a'): (2, 6.0, 2.0, 4.0), (15, 'b'): (1, 20.0, 20.0, 20.0)}
+
+
+def test_limit_resumes_from_watermark(stream, engine):
+    for num in range(7):
+        _add_step(stream, 'a', started=0, completed=1)
+    for _ in range(4):
+        metrics.process_metrics(time_interval=15, limit=3, lateness=60, engine=engine)
+
+    assert _metrics() == {(0, 'a'): (7, 7.0, 1.0, 1.0)}
+
+
+def test_late_steps_merged_into_closed_buckets(stream, engine):
+    _add_step(stream, 'a', started=0, completed=1)
+    _add_step(stream, 'a', started=30, completed=40)
+    metrics.process_metrics(time_interval=15, limit=100, lateness=60, engine=engine)
+
+    _add_step(stream, 'a', started=0, completed=3)
+    metrics.process_metrics(time_interval=15, limit=100, lateness=60, engine=engine)
+    metrics.process_metrics(time_interval=15, limit=100, lateness=60, engine=engine)
+
+    assert _metrics() == {(0, 'a'): (2, 4.0, 1.0, 3.0), (30, 'a'): (1, 10.0, 10.0, 10.0)}
+
+
+def test_steps_beyond_lateness_ignored(stream, engine):
+    _add_step(stream, 'a', started=100, completed=100)
+    metrics.process_metrics(time_interval=15, limit=100, lateness=60, engine=engine)
+
+    _add_step(stream, 'a', started=0, completed=1)
+    metrics.process_metrics(time_interval=15, limit=100, lateness=60, engine=engine)
+
+    assert _metrics() == {(90, 'a'): (1, 0.0, 0.0, 0.0)}
+
+
+def test_watermark_initialised_from_existing_metrics(stream, engine):
+    _add_step(stream, 'a', started=0, completed=1)
+    conn.add(job.JobExecutionMetric(
+        form_id=stream.job_execution.job.form_id, job_execution=stream.job_execution, stream_name='Stream',
+        step_name='a', epoch_start=BASE_TIME, epoch_end=BASE_TIME + 15, epoch_last=BASE_TIME + 1,
+        count=1, sum_duration=1, min_duration=1, max_duration=1,
+    ))
+    conn.commit()
+
+    _add_step(stream, 'a', started=0, completed=2)
+    metrics.process_metrics(time_interval=15, limit=100, lateness=60, engine=engine)
+
+    assert _metrics() == {(0, 'a'): (2, 3.0, 1.0, 2.0)}
+
+
+def test_sketches_merged_across_runs(stream):
+    for duration in range(1, 6):
+        _add_step(stream, 'a', started=0, completed=duration)
+    metrics.process_metrics(time_interval=15, limit=3, lateness=60)
+    metrics.process_metrics(time_interval=15, limit=3, lateness=60)
+    conn.expire_all()
+
+    metric, = job.JobExecutionMetric.query().all()
+    sketch = job.JobExecutionMetric.merge_sketches([metric])
+    assert (sketch.count, sketch.min, sketch.max) == (5, 1.0, 5.0)
+    assert sketch.quantile(0.5) == pytest.approx(3.0, rel=0.01)
+
+
+def test_engines_equivalent(dummy_execution):
+    streams = [
+        job.JobExecutionStream(job_execution=dummy_execution, name=f'Stream {num}', task_id=f'stream-{num}')
+        for num in range(3)
+    ]
+    conn.add_all(streams)
+    conn.commit()
+    for num in range(300):
+        _add_step(streams[num % 3], f'step-{num % 4}', started=num * 0.37, completed=num * 0.91 + (num % 7) * 0.013)
+
+    def run(engine):
+        conn.query(job.JobExecutionMetric).delete()
+        metrics.Watermark().save()
+        conn.commit()
+        for _ in range(4):
+            metrics.process_metrics(time_interval=15, limit=100, lateness=60, engine=engine)
+        conn.expire_all()
+        return {
+            (metric.epoch_start, metric.stream_name, metric.step_name): (
+                metric.count,
+                pytest.approx(metric.sum_duration),
+                pytest.approx(metric.min_duration),
+                pytest.approx(metric.max_duration),
+                metric.epoch_last,
+            )
+            for metric in job.JobExecutionMetric.query().all()
+        }
+
+    python_metrics, sql_metrics = run(metrics.ENGINE_PYTHON), run(metrics.ENGINE_SQL)
+    assert len(python_metrics) > 20
+    assert sql_metrics == python_metrics
+
+
+def test_watermark_seen_stored_as_ranges():
+    watermark = metrics.Watermark()
+    watermark.advance([(1, 10.0), (2, 12.0), (3, 11.0), (7, 20.0), (8, 21.0)], lateness=60)
+    watermark.save()
+    conn.commit()
+
+    assert watermark.seen_ranges() == [[1, 3, 12.0], [7, 8, 21.0]]
+    assert set(metrics.Watermark.load(lateness=60).seen) == {1, 2, 3, 7, 8}
+
+
+def test_watermark_seen_untracked_without_lateness():
+    watermark = metrics.Watermark()
+    watermark.advance([(1, 10.0), (2, 12.0)], lateness=0)
+
+    assert watermark.seen == {}
+    assert (watermark.completed, watermark.step_id) == (12.0, 2)
+
+
+def test_sql_engine_keeps_sketches(stream):
+    def run(*engines):
+        conn.query(job.JobExecutionMetric).delete()
+        conn.query(job.JobExecutionStreamStep).delete()
+        metrics.Watermark().save()
+        conn.commit()
+        for num, engine in enumerate(engines):
+            _add_step(stream, 'a', started=num, completed=num + 2)
+            metrics.process_metrics(time_interval=15, limit=100, lateness=60, engine=engine)
+        conn.expire_all()
+        return job.JobExecutionMetric.query().one()
+
+    python_only = run(metrics.ENGINE_PYTHON, metrics.ENGINE_PYTHON)
+    python_metric = (python_only.count, python_only.sum_duration, python_only.sketch.count, python_only.sketch_partial)
+    assert python_metric == (2, 4.0, 2, False)
+
+    mixed = run(metrics.ENGINE_PYTHON, metrics.ENGINE_SQL)
+    assert (mixed.count, mixed.sum_duration) == (2, 4.0)
+    assert (mixed.sketch.count, mixed.sketch_partial) == (1, True)
@@ -0,0 +1,120 @@
+import pytest
+
+from riberry import config
+from riberry.celery.background import metrics, rollups
+from riberry.model import conn, job
+from riberry.util.sketch import LogHistogram
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+HOUR = 3600
+
+
+@pytest.fixture(autouse=True)
+def rollup_config(monkeypatch):
+    monkeypatch.setattr(config.config.background.metrics, 'time_interval', 15)
+    monkeypatch.setattr(config.config.background.rollups, 'retention', 2 * HOUR)
+    monkeypatch.setattr(config.config.background.rollups, 'tiers', [(60, 4 * HOUR), (HOUR, 0)])
+
+
+def _add_metric(execution, epoch_start, *durations, step='step'):
+    conn.add(job.JobExecutionMetric(
+        form_id=execution.job.form_id, job_execution=execution, stream_name='Stream', step_name=step,
+        epoch_start=epoch_start, epoch_end=epoch_start + 15, epoch_last=epoch_start,
+        count=len(durations), sum_duration=sum(durations), min_duration=min(durations), max_duration=max(durations),
+        sketch=LogHistogram.of(durations),
+    ))
+    conn.commit()
+
+
+def _set_step_watermark(completed):
+    metrics.Watermark(completed=completed).save()
+    conn.commit()
+
+
+def _rollups(resolution):
+    conn.expire_all()
+    return [
+        (rollup.epoch_start, rollup.count, rollup.sum_duration, rollup.min_duration, rollup.max_duration,
+         rollup.sketch.count)
+        for rollup in job.JobExecutionMetricRollup.query().filter_by(resolution=resolution).order_by(
+            job.JobExecutionMetricRollup.epoch_start)
+    ]
+
+
+def test_closed_buckets_rolled_up_once(dummy_execution):
+    _add_metric(dummy_execution, 0, 1.0, 2.0)
+    _add_metric(dummy_execution, 45, 4.0)
+    _add_metric(dummy_execution, 60, 8.0)
+    _set_step_watermark(completed=100)
+
+    rollups.process_rollups(lateness=30, now=HOUR)
+    rollups.process_rollups(lateness=30, now=HOUR)
+
+    assert _rollups(60) == [(0, 3, 7.0, 1.0, 4.0, 3)]
+    assert rollups.rolled_up_until(60) == 60
+
+
+def test_coarser_tiers_rolled_up_from_finer_tiers(dummy_execution):
+    for epoch_start in range(0, 2 * HOUR, 900):
+        _add_metric(dummy_execution, epoch_start, 1.0)
+    _set_step_watermark(completed=2 * HOUR)
+
+    rollups.process_rollups(now=2 * HOUR)
+
+    assert [row[:2] for row in _rollups(60)] == [(epoch_start, 1) for epoch_start in range(0, 2 * HOUR, 900)]
+    assert _rollups(HOUR) == [(0, 4, 4.0, 1.0, 1.0, 4), (HOUR, 4, 4.0, 1.0, 1.0, 4)]
+
+
+def test_execution_metrics_kept_by_default(dummy_execution, monkeypatch):
+    monkeypatch.setattr(config.config.background.rollups, 'retention', config.CONF_DEFAULT_BG_ROLLUP_RETENTION)
+    _add_metric(dummy_execution, 0, 1.0)
+    _set_step_watermark(completed=4 * HOUR)
+
+    rollups.process_rollups(now=400 * 86400)
+    assert job.JobExecutionMetric.query().count() == 1
+
+
+def test_retention_only_removes_rolled_up_rows(dummy_execution):
+    _add_metric(dummy_execution, 0, 1.0)
+    _add_metric(dummy_execution, 3 * HOUR, 1.0)
+
+    rollups.apply_retention(now=4 * HOUR)
+    assert job.JobExecutionMetric.query().count() == 2
+
+    _set_step_watermark(completed=4 * HOUR)
+    rollups.process_rollups(now=4 * HOUR)
+    assert [metric.epoch_start for metric in job.JobExecutionMetric.query()] == [3 * HOUR]
+
+    rollups.process_rollups(now=9 * HOUR)
+    assert job.JobExecutionMetric.query().count() == 0
+    assert [row[0] for row in _rollups(60)] == []
+    assert [row[:2] for row in _rollups(HOUR)] == [(0, 1), (3 * HOUR, 1)]
+
+
+@pytest.mark.parametrize('epoch_start, epoch_end, now, resolution, expected', [
+    (0, 600, 600, None, 15),
+    (0, 3 * HOUR, 3 * HOUR, None, 60),
+    (0, 6 * HOUR, 6 * HOUR, None, HOUR),
+    (0, 6 * HOUR, 6 * HOUR, HOUR, HOUR),
+    (0, 600, 5 * HOUR, None, HOUR),
+])
+def test_select_tier(epoch_start, epoch_end, now, resolution, expected):
+    tier = rollups.select_tier(epoch_start, epoch_end, resolution=resolution, max_points=100, now=now)
+    assert tier.resolution == expected
+
+
+def test_query_combines_tiers(dummy_execution):
+    for epoch_start in range(0, 3 * HOUR, 600):
+        _add_metric(dummy_execution, epoch_start, 2.0)
+    _set_step_watermark(completed=HOUR + 120)
+    rollups.process_rollups(now=3 * HOUR)
+
+    resolution, points = rollups.query(
+        dummy_execution.job.form_id, epoch_start=0, epoch_end=3 * HOUR, resolution=HOUR, now=3 * HOUR,
+    )
+
+    assert resolution == HOUR
+    assert [(point.epoch_start, point.count, point.sketch.count) for point in points] == [
+        (0, 6, 6), (HOUR, 6, 6), (2 * HOUR, 6, 6),
+    ]
@@ -0,0 +1,92 @@
+import pytest
+import redis
+
+from riberry.celery.util import RedisManager
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture
+def created_pools(monkeypatch):
+    server = fakeredis.FakeServer()
+    pools = []
+
+    def create_pool():
+        pool = redis.ConnectionPool(connection_class=fakeredis.FakeConnection, server=server)
+        pools.append(pool)
+        return pool
+
+    monkeypatch.setattr(RedisManager, '_create_pool', staticmethod(create_pool))
+    return pools
+
+
+@pytest.fixture
+def manager(created_pools):
+    return RedisManager()
+
+
+def test_clients_share_pool(manager, created_pools):
+    first, second = manager.client('scale'), manager.client('capacity')
+    first.set('key', 'value')
+
+    assert first.connection_pool is second.connection_pool
+    assert second.get('key') == b'value'
+    assert len(created_pools) == 1
+
+
+def test_pool_recreated_after_fork(manager, created_pools, monkeypatch):
+    pool = manager.client().connection_pool
+    manager.client('scale').get('key')
+
+    monkeypatch.setattr('os.getpid', lambda: -1)
+
+    assert manager.client().connection_pool is not pool
+    assert len(created_pools) == 2
+    assert manager.stats() == {'default': {}}
+
+
+def test_counts_commands_per_subsystem(manager):
+    scale, capacity = manager.client('scale'), manager.client('capacity')
+    scale.set('key', 'value')
+    scale.get('key')
+    capacity.get('key')
+
+    pipe = capacity.pipeline(transaction=False)
+    pipe.llen('a').llen('b').execute()
+
+    assert manager.stats() == {
+        'scale': {'SET': 1, 'GET': 1},
+        'capacity': {'GET': 1, 'PIPELINE': 1, 'LLEN': 2},
+    }
+
+    manager.reset_stats()
+    assert manager.stats() == {'scale': {}, 'capacity': {}}
+
+
+def test_read_many(manager):
+    r = manager.client()
+    r.rpush('list', 'a', 'b')
+    r.sadd('set', 'a')
+    r.set('string', 'value')
+
+    results = manager.read_many([
+        ('llen', 'list'),
+        ('sismember', 'set', 'a'),
+        ('sismember', 'set', 'b'),
+        ('llen', 'string'),
+    ], subsystem='tracker')
+
+    assert results[:3] == [2, True, False]
+    assert isinstance(results[3], redis.ResponseError)
+    assert manager.stats()['tracker'] == {'PIPELINE': 1, 'LLEN': 2, 'SISMEMBER': 2}
+
+
+def test_report_interval(manager):
+    manager.client('scale').get('key')
+    reported = manager._reported
+
+    manager.report(now=reported + 1)
+    assert manager.stats()['scale'] == {'GET': 1}
+
+    manager.report(now=reported + manager.report_interval)
+    assert manager.stats()['scale'] == {}
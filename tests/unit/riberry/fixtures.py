@@ -1,5 +1,5 @@
 import pytest
-from riberry.model import init, conn, auth, base
+from riberry.model import init, conn, auth, base, interface, application as application_model, job as job_model
 from riberry.plugins.defaults.authentication import hash_password
 
 
@@ -17,3 +17,16 @@ def dummy_user():
     conn.add(user)
     conn.commit()
     return user
+
+
+@pytest.fixture
+def dummy_execution(dummy_user):
+    application = application_model.Application(name='Application', internal_name='application', type='Test')
+    instance = application_model.ApplicationInstance(
+        application=application, name='Instance', internal_name='instance')
+    form = interface.Form(application=application, instance=instance, name='Form', internal_name='form')
+    job = job_model.Job(form=form, creator=dummy_user, name='Job')
+    execution = job_model.JobExecution(job=job, creator=dummy_user, task_id='root', status='ACTIVE')
+    conn.add(execution)
+    conn.commit()
+    return execution
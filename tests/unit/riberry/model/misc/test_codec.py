@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from riberry.model.misc import codec
+
+
+@pytest.mark.parametrize('payload', [
+    dict(stream='Overall', state='ACTIVE'),
+    dict(stream='Overall', step='Download', state='SUCCESS'),
+    dict(stream='Overall', step='Download', state='CUSTOM'),
+    dict(name='Artifact', type='output', category='Default', data={'a': 1}, stream=None, filename='a.txt'),
+    dict(type='workflow_started', data={}),
+    dict(stream='', step='', state='QUEUED'),
+    dict(stream='Over\x1fall', state='ACTIVE'),
+    dict(stream='Overall', state='\x1e'),
+    dict(stream='Overall', state='X'),
+    dict(stream=1, state='ACTIVE'),
+    {},
+])
+def test_round_trip(payload):
+    data = codec.encode(payload)
+    assert data.startswith(codec.VERSION_1)
+    assert codec.decode(data) == payload
+
+
+@pytest.mark.parametrize('payload', [[1, 2, 3], 'data', None])
+def test_unsupported_payloads_fall_back_to_json(payload):
+    data = codec.encode(payload)
+    assert data == json.dumps(payload)
+    assert codec.decode(data) == payload
+
+
+def test_decodes_legacy_json():
+    payload = dict(stream='Overall', step='Download', state='SUCCESS')
+    assert codec.decode(json.dumps(payload)) == payload
+    assert codec.decode(codec.encode(payload, encoding=codec.ENCODING_JSON)) == payload
+
+
+def test_compact_smaller_than_json():
+    payload = dict(stream='Overall', step='Download', state='SUCCESS')
+    assert len(codec.encode(payload)) < len(json.dumps(payload)) / 2
+
+
+def test_large_tail_compressed():
+    payload = dict(stream='Overall', state='FAILURE', data={'message': 'error ' * 500})
+    data = codec.encode(payload)
+    assert codec.COMPRESSED_PREFIX in data
+    assert len(data) <= codec.DATA_LIMIT
+    assert codec.decode(data) == payload
+
+
+def test_data_too_large():
+    with pytest.raises(codec.EventDataTooLarge):
+        codec.encode(dict(stream='Overall', data=json.dumps(list(range(2000)))), encoding=codec.ENCODING_JSON)
+
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError):
+        codec.encode({}, encoding='msgpack')
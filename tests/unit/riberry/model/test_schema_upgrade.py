@@ -0,0 +1,25 @@
+import sqlalchemy
+
+from riberry import model
+
+
+def test_add_missing_columns(tmp_path):
+    url = f'sqlite:///{tmp_path / "riberry.db"}'
+    engine = sqlalchemy.create_engine(url)
+    engine.execute('CREATE TABLE job_artifact_binary (id INTEGER PRIMARY KEY, binary BLOB, artifact_id INTEGER NOT NULL)')
+    engine.execute("INSERT INTO job_artifact_binary (id, binary, artifact_id) VALUES (1, x'00', 1)")
+
+    model.init(url=url)
+    columns = {column['name'] for column in sqlalchemy.inspect(engine).get_columns('job_artifact_binary')}
+    assert not {'store', 'digest'} & columns
+
+    model.add_missing_columns(model.conn.raw_engine)
+
+    columns = {column['name'] for column in sqlalchemy.inspect(engine).get_columns('job_artifact_binary')}
+    assert {'store', 'digest'} <= columns
+
+    binary = model.conn.query(model.job.JobExecutionArtifactBinary).one()
+    assert (binary.store, binary.digest) == (None, None)
+
+    # idempotent once the columns exist
+    model.add_missing_columns(model.conn.raw_engine)
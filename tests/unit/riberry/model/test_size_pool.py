@@ -0,0 +1,41 @@
+import pytest
+
+from riberry import model
+
+
+@pytest.fixture
+def file_url(tmp_path):
+    return f'sqlite:///{tmp_path / "riberry.db"}'
+
+
+def test_size_pool(file_url):
+    model.init(url=file_url)
+    session_factory = model.conn.raw_session.session_factory
+
+    model.size_pool(pool_size=12)
+
+    assert model.conn.raw_engine.pool.size() == 12
+    assert model.conn.raw_engine.pool._max_overflow == 10
+    assert session_factory.kw['bind'] is model.conn.raw_engine
+    assert model.conn.query(model.auth.User).count() == 0
+
+
+def test_size_pool_configured(file_url):
+    model.init(url=file_url, engine_settings={'pool_size': 3})
+    engine = model.conn.raw_engine
+
+    model.size_pool(pool_size=12)
+
+    assert model.conn.raw_engine is engine
+    assert engine.pool.size() == 3
+
+
+
+def test_size_pool_rebinds_session(file_url):
+    model.init(url=file_url, engine_settings={'max_overflow': 2})
+    assert model.conn.query(model.auth.User).count() == 0
+
+    model.size_pool(pool_size=12)
+
+    assert model.conn.raw_engine.pool._max_overflow == 2
+    assert model.conn.get_bind() is model.conn.raw_engine
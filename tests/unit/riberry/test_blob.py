@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from riberry import blob, config
+from riberry.celery.background.events import events
+from riberry.model import conn, misc, job
+# noinspection PyUnresolvedReferences
+from tests.unit.riberry.fixtures import init_model, dummy_user, dummy_execution
+
+
+@pytest.fixture
+def filesystem_store(tmp_path, monkeypatch):
+    store_config = config.BlobStoreConfig({'type': 'filesystem', 'path': str(tmp_path)})
+    monkeypatch.setattr(config.config.artifacts, 'store', store_config)
+    return store_config.instance
+
+
+def _add_artifact_event(binary=None, **data):
+    data = dict(name='Artifact', type='output', category='Default', data={}, stream=None, filename='a.txt', **data)
+    conn.add(misc.Event(name='artifact', time=1.0, root_id='root', task_id='root', data=json.dumps(data), binary=binary))
+    conn.commit()
+
+
+class TestFilesystemBlobStore:
+
+    def test_identical_content_stored_once(self, filesystem_store):
+        first = filesystem_store.put(b'content')
+        second = filesystem_store.put(b'content')
+
+        assert first == second == blob.digest(b'content')
+        assert [path.name for path in filesystem_store.path.rglob('*') if path.is_file()] == [first]
+
+    def test_chunks(self, filesystem_store):
+        binary = filesystem_store.create(b'0123456789')
+        assert binary.binary is None
+        assert list(binary.chunks(chunk_size=4)) == [b'0123', b'4567', b'89']
+
+    def test_artifact_event_references_blob(self, dummy_execution, filesystem_store):
+        digest = filesystem_store.put(b'traceback')
+        _add_artifact_event(blob={'store': 'filesystem', 'digest': digest, 'size': 9})
+        events.process()
+
+        artifact = job.JobExecutionArtifact.query().one()
+        assert artifact.size == 9
+        assert (artifact.binary.store, artifact.binary.digest) == ('filesystem', digest)
+        assert artifact.binary.read() == b'traceback'
+
+    def test_inline_artifact_event_offloaded(self, dummy_execution, filesystem_store):
+        _add_artifact_event(binary=b'inline')
+        events.process()
+
+        binary = job.JobExecutionArtifact.query().one().binary
+        assert binary.binary is None
+        assert filesystem_store.location(binary.digest).read_bytes() == b'inline'
+
+
+class TestDatabaseBlobStore:
+
+    def test_chunks_read_from_database(self, dummy_execution):
+        _add_artifact_event(binary=b'0123456789')
+        events.process()
+        conn.expire_all()
+
+        binary = job.JobExecutionArtifactBinary.query().one()
+        assert binary.store == 'database'
+        assert binary.digest == blob.digest(b'0123456789')
+        assert list(binary.chunks(chunk_size=4)) == [b'0123', b'4567', b'89']
+        assert 'binary' not in binary.__dict__
+
+    def test_legacy_binary(self, dummy_execution):
+        conn.add(job.JobExecutionArtifact(
+            job_execution=dummy_execution, name='Legacy', type='output', filename='a.txt', size=3,
+            binary=job.JobExecutionArtifactBinary(binary=b'abc'),
+        ))
+        conn.commit()
+        conn.expire_all()
+
+        assert job.JobExecutionArtifactBinary.query().one().read() == b'abc'
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from riberry.util.sketch import LogHistogram, RELATIVE_ACCURACY, MAX_BUCKETS
+
+
+def _exact_quantile(values, q):
+    return sorted(values)[int(q * (len(values) - 1))]
+
+
+@pytest.fixture
+def values():
+    rng = random.Random(0)
+    return [rng.lognormvariate(0, 2) for _ in range(10_000)]
+
+
+def test_quantiles_within_relative_accuracy(values):
+    sketch = LogHistogram.of(values)
+    for q in (0.01, 0.25, 0.5, 0.95, 0.99, 0.999):
+        assert sketch.quantile(q) == pytest.approx(_exact_quantile(values, q), rel=RELATIVE_ACCURACY * 1.01)
+    assert (sketch.quantile(0), sketch.quantile(1)) == (min(values), max(values))
+    assert (sketch.count, sketch.sum) == (len(values), pytest.approx(sum(values)))
+
+
+def test_merge_equivalent_to_single_sketch(values):
+    merged = LogHistogram()
+    for idx in range(0, len(values), 1000):
+        merged.merge(LogHistogram.of(values[idx:idx + 1000]))
+
+    expected = LogHistogram.of(values)
+    assert merged.buckets == expected.buckets
+    assert merged.quantiles([0.5, 0.99]) == expected.quantiles([0.5, 0.99])
+
+
+def test_serialization_round_trip(values):
+    sketch = LogHistogram.of(values + [0.0, 0.0])
+    data = sketch.to_bytes()
+    assert LogHistogram.from_bytes(data) == sketch
+    assert len(data) < len(values)
+
+
+def test_empty():
+    sketch = LogHistogram.from_bytes(None)
+    assert sketch.quantile(0.5) is None
+    assert LogHistogram.from_bytes(sketch.to_bytes()) == sketch
+
+
+def test_bucket_count_bounded():
+    sketch = LogHistogram.of(1.05 ** exponent for exponent in range(MAX_BUCKETS * 3))
+    assert len(sketch.buckets) <= MAX_BUCKETS
+    assert sketch.quantile(0.99) == pytest.approx(_exact_quantile(
+        [1.05 ** exponent for exponent in range(MAX_BUCKETS * 3)], 0.99), rel=RELATIVE_ACCURACY * 1.01)